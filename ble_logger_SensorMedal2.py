@@ -20,101 +20,80 @@
 #   実行するときは sudoを付与してください
 #       sudo ./ble_logger_SensorMedal2.py &
 #
+#   受信毎に全ての広告とセンサ値を表示する場合(下記の実行結果の一例の表示)
+#       下記の display を 'frame' に設定してください
+#   端末以外(nohupやファイルへのリダイレクト)へ出力するときは一覧を表示しません
+#
 #【参考文献】
 #   本プログラムを作成するにあたり下記を参考にしました
 #   https://www.rohm.co.jp/documents/11401/3946483/sensormedal-evk-002_ug-j.pdf
 #   https://ianharvey.github.io/bluepy-doc/scanner.html
 
 interval = 3 # 動作間隔
+display = 'table' # 画面表示 'table':一覧を書き換え 'frame':受信毎に表示 'quiet':表示なし
 
-from bluepy import btle
-from sys import argv
-import getpass
-from time import sleep
+from sensormedal2.scan import stream
+from sensormedal2 import SensorMedal2Frame
+from sensormedal2.state import DeviceTable
+from sensormedal2.dashboard import Dashboard
+from sensormedal2.prefilter import Prefilter
 
-def payval(num, bytes=1, sign=False):
-    global val
-    a = 0
-    for i in range(0, bytes):
-        a += (256 ** i) * int(val[(num - 2 + i) * 2 : (num - 1 + i) * 2],16)
-    if sign:
-        if a >= 2 ** (bytes * 8):
-            a -= 2 ** (bytes * 8)
-    return a
+medals = DeviceTable()                          # メダル毎の最新値
+if display == 'table':
+    Dashboard(medals).start()                   # 別スレッドで一定間隔で表示
 
-scanner = btle.Scanner()
-while True:
-    # BLE受信処理
-    try:
-        devices = scanner.scan(interval)
-    except Exception as e:
-        print("ERROR",e)
-        if getpass.getuser() != 'root':
-            print('使用方法: sudo', argv[0])
-            exit()
-        sleep(interval)
-        continue
+prefilter = Prefilter()                         # メダル以外の広告を除外
 
-    # 受信データについてBLEデバイス毎の処理
-    for dev in devices:
+# 受信データについてBLEデバイス毎の処理
+def handle(dev):
+    if not prefilter.check(dev):                # メダル以外は表示しない
+        return
+    if display == 'frame':
         print("\nDevice %s (%s), RSSI=%d dB" % (dev.addr, dev.addrType, dev.rssi))
-        isRohmMedal = False
-        sensors = dict()
-        for (adtype, desc, val) in dev.getScanData():
+    isRohmMedal = False
+    sensors = dict()
+    for (adtype, desc, val) in dev.getScanData():
+        if display == 'frame':
             print("  %s = %s" % (desc, val))
-            if desc == 'Short Local Name' and val[0:10] == 'ROHMMedal2':
-                isRohmMedal = True
-            if isRohmMedal and desc == 'Manufacturer':
+        if desc == 'Short Local Name' and val[0:10] == 'ROHMMedal2':
+            isRohmMedal = True
+        if isRohmMedal and desc == 'Manufacturer':
+
+            # センサ値を辞書型変数sensorsへ代入
+            sensors = SensorMedal2Frame.from_hex(val).sensors()
+            sensors['RSSI'] = dev.rssi
+            medals.update(dev.addr, sensors, dev.rssi)
+            if display != 'frame':
+                continue
+
+            # 画面へ表示
+            print('    ID            =',sensors['ID'])
+            print('    SEQ           =',sensors['SEQ'])
+            print('    Temperature   =',round(sensors['Temperature'],2),'℃')
+            print('    Humidity      =',round(sensors['Humidity'],2),'%')
+            print('    Pressure      =',round(sensors['Pressure'],3),'hPa')
+            print('    Illuminance   =',round(sensors['Illuminance'],1),'lx')
+            print('    Accelerometer =',round(sensors['Accelerometer'],3),'g (',\
+                                        round(sensors['Accelerometer X'],3),\
+                                        round(sensors['Accelerometer Y'],3),\
+                                        round(sensors['Accelerometer Z'],3),'g)')
+            print('    Geomagnetic   =',round(sensors['Geomagnetic'],1),'uT (',\
+                                        round(sensors['Geomagnetic X'],1),\
+                                        round(sensors['Geomagnetic Y'],1),\
+                                        round(sensors['Geomagnetic Z'],1),'uT)')
+            print('    Magnetic      =',sensors['Magnetic'])
+            print('    Steps         =',sensors['Steps'],'歩')
+            print('    Battery Level =',sensors['Battery Level'],'%')
+            print('    RSSI          =',sensors['RSSI'],'dB')
 
-                # センサ値を辞書型変数sensorsへ代入
-                sensors['ID'] = hex(payval(2,2))
-                sensors['Temperature'] = -45 + 175 * payval(4,2) / 65536
-                sensors['Humidity'] = 100 * payval(6,2) / 65536
-                sensors['SEQ'] = payval(8)
-                sensors['Condition Flags'] = bin(int(val[16:18],16))
-                sensors['Accelerometer X'] = payval(10,2,True) / 4096
-                sensors['Accelerometer Y'] = payval(12,2,True) / 4096
-                sensors['Accelerometer Z'] = payval(14,2,True) / 4096
-                sensors['Accelerometer'] = (sensors['Accelerometer X'] ** 2\
-                                          + sensors['Accelerometer Y'] ** 2\
-                                          + sensors['Accelerometer Z'] ** 2) ** 0.5
-                sensors['Geomagnetic X'] = payval(16,2,True) / 10
-                sensors['Geomagnetic Y'] = payval(18,2,True) / 10
-                sensors['Geomagnetic Z'] = payval(20,2,True) / 10
-                sensors['Geomagnetic']  = (sensors['Geomagnetic X'] ** 2\
-                                         + sensors['Geomagnetic Y'] ** 2\
-                                         + sensors['Geomagnetic Z'] ** 2) ** 0.5
-                sensors['Pressure'] = payval(22,3) / 2048
-                sensors['Illuminance'] = payval(25,2) / 1.2
-                sensors['Magnetic'] = hex(payval(27))
-                sensors['Steps'] = payval(28,2)
-                sensors['Battery Level'] = payval(30)
-                sensors['RSSI'] = dev.rssi
+            '''
+            for key, value in sorted(sensors.items(), key=lambda x:x[0]):
+                print('    ',key,'=',value)
+            '''
 
-                # 画面へ表示
-                print('    ID            =',sensors['ID'])
-                print('    SEQ           =',sensors['SEQ'])
-                print('    Temperature   =',round(sensors['Temperature'],2),'℃')
-                print('    Humidity      =',round(sensors['Humidity'],2),'%')
-                print('    Pressure      =',round(sensors['Pressure'],3),'hPa')
-                print('    Illuminance   =',round(sensors['Illuminance'],1),'lx')
-                print('    Accelerometer =',round(sensors['Accelerometer'],3),'g (',\
-                                            round(sensors['Accelerometer X'],3),\
-                                            round(sensors['Accelerometer Y'],3),\
-                                            round(sensors['Accelerometer Z'],3),'g)')
-                print('    Geomagnetic   =',round(sensors['Geomagnetic'],1),'uT (',\
-                                            round(sensors['Geomagnetic X'],1),\
-                                            round(sensors['Geomagnetic Y'],1),\
-                                            round(sensors['Geomagnetic Z'],1),'uT)')
-                print('    Magnetic      =',sensors['Magnetic'])
-                print('    Steps         =',sensors['Steps'],'歩')
-                print('    Battery Level =',sensors['Battery Level'],'%')
-                print('    RSSI          =',sensors['RSSI'],'dB')
+# BLE受信処理(広告を受信する度にhandleを実行)
+stream(handle, timeout=interval)
 
-                '''
-                for key, value in sorted(sensors.items(), key=lambda x:x[0]):
-                    print('    ',key,'=',value)
-                '''
 ''' 実行結果の一例
 pi@raspberrypi:~ $ cd
 pi@raspberrypi:~ $ git clone http://github.com/bokunimowakaru/SensorMedal2
@@ -19,6 +19,8 @@
 #【Ambientの設定】
 #   Ambient（https://ambidata.io/）でIDとライトキーを取得し、プログラム内の
 #   ambient_chidとambient_wkeyへ代入してください。
+#   複数のメダルを複数のチャネルへ送信する時は ambient_channels を設定します
+#   (設定方法は sensormedal2/channels.py を参照)。
 #
 #【実行方法】
 #   実行するときは sudoを付与してください(動作表示あり)
@@ -35,110 +37,43 @@
 ambient_chid='0000'                 # ここにAmbientで取得したチャネルIDを入力
 ambient_wkey='0123456789abcdef'     # ここにはライトキーを入力
 ambient_interval = 30               # Ambientへの送信間隔
+ambient_id = None                   # 送信するメダルのID(Noneは最初に受信したメダル)
+ambient_aggregate = 'mean'          # 送信間隔内の集計方法('mean','min','max','last')
+ambient_url = 'https://ambidata.io' # 送信先(試験時はローカルのサーバ)
+ambient_spool = 'ambient.spool'     # 未送信データの保存ファイル
+ambient_channels = None             # 複数チャネルへの振り分け(Noneは1チャネル)
+ambient_channels_spool = 'ambient_channels.spool'   # 振り分け時の保存ファイル
+                                    #   (チャネルIDを付けたファイル名で保存)
 interval = 3                        # 動作間隔
 
-from bluepy import btle
-from sys import argv
-import getpass
-from time import sleep
-import urllib.request                           # HTTP通信ライブラリを組み込む
-import json                                     # JSON変換ライブラリを組み込む
-
-url_s = 'https://ambidata.io/api/v2/channels/'+ambient_chid+'/data' # アクセス先
-head_dict = {'Content-Type':'application/json'} # ヘッダを変数head_dictへ
-body_dict = {'writeKey':ambient_wkey, \
-            'd1':0, 'd2':0, 'd3':0, 'd4':0, 'd5':0, 'd6':0, 'd7':0, 'd8':0}
-
-def payval(num, bytes=1, sign=False):
-    global val
-    a = 0
-    for i in range(0, bytes):
-        a += (256 ** i) * int(val[(num - 2 + i) * 2 : (num - 1 + i) * 2],16)
-    if sign:
-        if a >= 2 ** (bytes * 8):
-            a -= 2 ** (bytes * 8)
-    return a
-
-scanner = btle.Scanner()
-sensors = dict()
-time = 999
-isMedalAvail = False
+from sensormedal2.scan import stream
+from sensormedal2 import SensorMedal2Frame
+from sensormedal2.ambient import AmbientUploader
+from sensormedal2.channels import AmbientScheduler
+from sensormedal2.state import DeviceTable
+from sensormedal2.aggregate import TumblingWindow, summarize
+from sensormedal2.pipeline import Record
+from sensormedal2.replay import device_time
+from sensormedal2.prefilter import Prefilter
+
+body_dict = {'d1':0, 'd2':0, 'd3':0, 'd4':0, 'd5':0, 'd6':0, 'd7':0, 'd8':0}
+
+scheduler = None
+ambient = None
+if ambient_channels:                            # 各チャネルの上限まで送信
+    scheduler = AmbientScheduler(ambient_channels, ambient_aggregate,
+                                 url=ambient_url, spool=ambient_channels_spool)
+elif int(ambient_chid) != 0:                    # Ambientへの送信処理
+    ambient = AmbientUploader(ambient_chid, ambient_wkey, url=ambient_url,
+                              spool=ambient_spool)
+
+medals = DeviceTable()                          # メダル毎の状態
 if ambient_interval < 30:
     ambient_interval = 30
 
-while True:
-    # BLE受信処理
-    try:
-        devices = scanner.scan(interval)
-    except Exception as e:
-        print("ERROR",e)
-        if getpass.getuser() != 'root':
-            print('使用方法: sudo', argv[0])
-            exit()
-        sleep(interval)
-        continue
-
-    # 受信データについてBLEデバイス毎の処理
-    for dev in devices:
-        print("\nDevice %s (%s), RSSI=%d dB" % (dev.addr,dev.addrType,dev.rssi))
-        isRohmMedal = False
-        for (adtype, desc, val) in dev.getScanData():
-            print("  %s = %s" % (desc, val))
-            if desc == 'Short Local Name' and val[0:10] == 'ROHMMedal2':
-                isRohmMedal = True
-            if isRohmMedal and desc == 'Manufacturer':
-                isMedalAvail = True
-
-                # センサ値を辞書型変数sensorsへ代入
-                sensors['ID'] = hex(payval(2,2))
-                sensors['Temperature'] = -45 + 175 * payval(4,2) / 65536
-                sensors['Humidity'] = 100 * payval(6,2) / 65536
-                sensors['SEQ'] = payval(8)
-                sensors['Condition Flags'] = bin(int(val[16:18],16))
-                sensors['Accelerometer X'] = payval(10,2,True) / 4096
-                sensors['Accelerometer Y'] = payval(12,2,True) / 4096
-                sensors['Accelerometer Z'] = payval(14,2,True) / 4096
-                sensors['Accelerometer'] = (sensors['Accelerometer X'] ** 2\
-                                          + sensors['Accelerometer Y'] ** 2\
-                                          + sensors['Accelerometer Z'] ** 2) ** 0.5
-                sensors['Geomagnetic X'] = payval(16,2,True) / 10
-                sensors['Geomagnetic Y'] = payval(18,2,True) / 10
-                sensors['Geomagnetic Z'] = payval(20,2,True) / 10
-                sensors['Geomagnetic']  = (sensors['Geomagnetic X'] ** 2\
-                                         + sensors['Geomagnetic Y'] ** 2\
-                                         + sensors['Geomagnetic Z'] ** 2) ** 0.5
-                sensors['Pressure'] = payval(22,3) / 2048
-                sensors['Illuminance'] = payval(25,2) / 1.2
-                sensors['Magnetic'] = hex(payval(27))
-                sensors['Steps'] = payval(28,2)
-                sensors['Battery Level'] = payval(30)
-                sensors['RSSI'] = dev.rssi
-
-                # 画面へ表示
-                print('    ID            =',sensors['ID'])
-                print('    SEQ           =',sensors['SEQ'])
-                print('    Temperature   =',round(sensors['Temperature'],2),'℃')
-                print('    Humidity      =',round(sensors['Humidity'],2),'%')
-                print('    Pressure      =',round(sensors['Pressure'],3),'hPa')
-                print('    Illuminance   =',round(sensors['Illuminance'],1),'lx')
-                print('    Accelerometer =',round(sensors['Accelerometer'],3),'g (',\
-                                            round(sensors['Accelerometer X'],3),\
-                                            round(sensors['Accelerometer Y'],3),\
-                                            round(sensors['Accelerometer Z'],3),'g)')
-                print('    Geomagnetic   =',round(sensors['Geomagnetic'],1),'uT (',\
-                                            round(sensors['Geomagnetic X'],1),\
-                                            round(sensors['Geomagnetic Y'],1),\
-                                            round(sensors['Geomagnetic Z'],1),'uT)')
-                print('    Magnetic      =',sensors['Magnetic'])
-                print('    Steps         =',sensors['Steps'],'歩')
-                print('    Battery Level =',sensors['Battery Level'],'%')
-
-    # Ambient（クラウド）へ送信するかどうかを判断
-    if int(ambient_chid) == 0 or not isMedalAvail or time < ambient_interval / interval:
-        time += 1
-        continue
-    time = 0
-    isMedalAvail = False
+# 送信間隔内の集計結果をAmbientへ送信
+def send_ambient(dev_id, start, stats):
+    sensors = summarize(stats, ambient_aggregate)
 
     # Ambientへ送るデータをbody_dictへ代入する
     body_dict['d1'] = sensors['Temperature']
@@ -150,19 +85,80 @@ while True:
     body_dict['d7'] = sensors['Steps']
     body_dict['d8'] = sensors['Battery Level']
 
-    # Ambientへ送信する
-    print(head_dict)                                # 送信ヘッダhead_dictを表示
+    # Ambientへ送信する(送信は別スレッドで実行)
     print(body_dict)                                # 送信内容body_dictを表示
-    post = urllib.request.Request(url_s, json.dumps(body_dict).encode(), head_dict)
-                                                    # POSTリクエストデータを作成
-    try:                                            # 例外処理の監視を開始
-        res = urllib.request.urlopen(post)          # HTTPアクセスを実行
-    except Exception as e:                          # 例外処理発生時
-        print(e,url_s)                              # エラー内容と変数url_sを表示
-    res_str = res.read().decode()                   # 受信テキストを変数res_strへ
-    res.close()                                     # HTTPアクセスの終了
-    if len(res_str):                                # 受信テキストがあれば
-        print('Response:', res_str)                 # 変数res_strの内容を表示
-    else:
-        print('Done')                               # Doneを表示
+    ambient.send(body_dict, start)
+
+tumbling = TumblingWindow(ambient_interval, send_ambient)
+
+prefilter = Prefilter()                         # メダル以外の広告を除外
+
+# 受信データについてBLEデバイス毎の処理
+def handle(dev):
+    now = device_time(dev)
+    tumbling.flush(now)                         # 受信が途絶えたメダルの集計も送信
+    if scheduler is not None:
+        scheduler.poll(now)
+    if not prefilter.check(dev):                # メダル以外は表示しない
+        return
+    global ambient_id
+    print("\nDevice %s (%s), RSSI=%d dB" % (dev.addr,dev.addrType,dev.rssi))
+    isRohmMedal = False
+    isMedalAvail = False
+    for (adtype, desc, val) in dev.getScanData():
+        print("  %s = %s" % (desc, val))
+        if desc == 'Short Local Name' and val[0:10] == 'ROHMMedal2':
+            isRohmMedal = True
+        if isRohmMedal and desc == 'Manufacturer':
+            isMedalAvail = True
+            payload = val                       # Manufacturerの16進文字列
+
+            # センサ値を辞書型変数sensorsへ代入
+            sensors = SensorMedal2Frame.from_hex(val).sensors()
+            sensors['RSSI'] = dev.rssi
+            state = medals.update(dev.addr, sensors, dev.rssi)
+
+            # 画面へ表示
+            print('    ID            =',sensors['ID'])
+            print('    SEQ           =',sensors['SEQ'])
+            print('    Temperature   =',round(sensors['Temperature'],2),'℃')
+            print('    Humidity      =',round(sensors['Humidity'],2),'%')
+            print('    Pressure      =',round(sensors['Pressure'],3),'hPa')
+            print('    Illuminance   =',round(sensors['Illuminance'],1),'lx')
+            print('    Accelerometer =',round(sensors['Accelerometer'],3),'g (',\
+                                        round(sensors['Accelerometer X'],3),\
+                                        round(sensors['Accelerometer Y'],3),\
+                                        round(sensors['Accelerometer Z'],3),'g)')
+            print('    Geomagnetic   =',round(sensors['Geomagnetic'],1),'uT (',\
+                                        round(sensors['Geomagnetic X'],1),\
+                                        round(sensors['Geomagnetic Y'],1),\
+                                        round(sensors['Geomagnetic Z'],1),'uT)')
+            print('    Magnetic      =',sensors['Magnetic'])
+            print('    Steps         =',sensors['Steps'],'歩')
+            print('    Battery Level =',sensors['Battery Level'],'%')
+
+    if not isMedalAvail:
+        return
+    if scheduler is not None:                   # 設定に従って各チャネルへ送信
+        scheduler.add(Record(now, dev.addr, dev.rssi, payload, sensors))
+        scheduler.poll(now)
+        return
+
+    # Ambient（クラウド）へ送信するメダルかどうかを判断
+    if ambient is None:
+        return
+    if ambient_id is None:
+        ambient_id = state.id                       # 最初に受信したメダル
+    if state.id != ambient_id:
+        return
+    tumbling.add(Record(now, dev.addr, dev.rssi, payload, sensors))  # 送信間隔内の値を集計
 
+# BLE受信処理(広告を受信する度にhandleを実行)
+try:
+    stream(handle, timeout=interval)
+finally:                                        # 再生終了時やCtrl-Cによる終了時
+    tumbling.flush(force=True)                  # 集計途中の値も送信
+    if ambient:
+        ambient.flush(10)                       # 未送信データを送信(最大10秒)
+    if scheduler:
+        scheduler.flush(10)
@@ -26,16 +26,7 @@
 #   https://ianharvey.github.io/bluepy-doc/scanner.html
 
 from bluepy import btle
-
-def payval(num, bytes=1, sign=False):
-    global val
-    a = 0
-    for i in range(0, bytes):
-        a += (256 ** i) * int(val[(num - 2 + i) * 2 : (num - 1 + i) * 2],16)
-    if sign:
-        if a >= 2 ** (bytes * 8):
-            a -= 2 ** (bytes * 8)
-    return a
+from sensormedal2 import SensorMedal2Frame
 
 scanner = btle.Scanner()
 while True:
@@ -48,10 +39,11 @@ while True:
             if desc == 'Short Local Name' and val[0:10] == 'ROHMMedal2':
                 isRohmMedal = True
             if isRohmMedal and desc == 'Manufacturer':
-                sensors['Temperature'] = -45 + 175 * payval(4,2) / 65536
-                sensors['Humidity'] = 100 * payval(6,2) / 65536
-                sensors['Pressure'] = payval(22,3) / 2048
-                sensors['Illuminance'] = payval(25,2) / 1.2
+                frame = SensorMedal2Frame.from_hex(val)
+                sensors['Temperature'] = frame.temperature
+                sensors['Humidity'] = frame.humidity
+                sensors['Pressure'] = frame.pressure
+                sensors['Illuminance'] = frame.illuminance
                 for sensor in sensors:
                     print('    ',sensor,'=',round(sensors[sensor],2))
 
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+################################################################################
+# BLE Logger for Rohm SensorMedal-EVK-002 [複数出力・常駐用]
+# Raspberry Piを使って、センサメダルのセンサ情報を表示・保存・送信します。
+# 1回の受信と1回のデコードで、画面表示・CSV保存・UDP送信・Ambient送信を
+# 同時に行います(出力先毎にスレッドとキューを持ちます)。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【インストール方法】
+#   bluepy (Bluetooth LE interface for Python)をインストールしてください
+#       sudo pip3 install bluepy
+#
+#   pip3 がインストールされていない場合は、先に下記を実行
+#       sudo apt-get update
+#       sudo apt-get install python-pip libglib2.0-dev
+#
+#【設定】
+#   下記の display と sink_csv ～ sink_sqlite で出力先を選択してください
+#   Ambientへ送信する場合は ambient_chid と ambient_wkey を設定してください
+#   複数のメダルを複数のチャネルへ送信する場合は ambient_channels を設定してください
+#   CSV保存・UDP送信を値が変化した時のみにする場合は deadband を True にしてください
+#   (変化が無くても heartbeat秒毎に保存・送信します)
+#   動作状況は http://localhost:9100/metrics から取得できます(Prometheus形式)
+#   sink_history を True にすると、直近の値を http://localhost:8080/latest から
+#   取得できます(JSON形式)
+#
+#【実行方法】
+#   実行するときは sudoを付与してください
+#       sudo ./ble_logger_SensorMedal2_daemon.py &
+#
+#   ロガーとして継続的にバックグラウンドで実行する場合
+#       sudo nohup ./ble_logger_SensorMedal2_daemon.py >& /dev/null &
+#
+#【参考文献】
+#   本プログラムを作成するにあたり下記を参考にしました
+#   https://www.rohm.co.jp/documents/11401/3946483/sensormedal-evk-002_ug-j.pdf
+#   https://ianharvey.github.io/bluepy-doc/scanner.html
+
+interval = 3                        # 受信処理の待ち時間
+iface = 0                           # BLEアダプタ番号(複数の時は [0, 1] のように指定)
+adaptive_scan = False               # メダルの送信間隔に合わせて受信を休止(省電力)
+allow_addrs = None                  # 受信するアドレスのリスト(Noneは全て)
+deny_addrs = []                     # 受信しないアドレスのリスト
+
+display = 'table'                   # 画面表示 'table':一覧を書き換え
+                                    #   'frame':受信毎に表示 'quiet':表示なし
+sink_csv = True                     # CSVファイルへ保存
+sink_udp = False                    # UDPで送信
+sink_ambient = False                # Ambientへ送信
+sink_archive = False                # 列形式アーカイブへ保存
+sink_history = False                # 直近の履歴を保持してHTTPで公開
+sink_raw = False                    # 受信フレームの生データをリングファイルへ保存
+sink_sqlite = False                 # SQLiteデータベースへ保存
+
+deadband = False                    # TrueでCSV保存・UDP送信は値が変化した時のみ
+heartbeat = 300                     # 変化が無くても保存・送信する間隔(秒)
+
+filename = 'SensorMedal2.csv'       # 保存するファイルの名前
+username = 'pi'                     # ファイル保存時の所有者名
+archive_file = 'SensorMedal2.sm2'   # 列形式アーカイブのファイル名
+raw_file = 'SensorMedal2.ring'      # 生データのリングファイル名
+raw_capacity = 262144               # リングファイルの記録数(1件48バイト)
+sqlite_file = 'SensorMedal2.db'     # SQLiteデータベースのファイル名
+sqlite_retention = 90               # データベースの保存日数(Noneは削除しない)
+
+udp_to = '255.255.255.255'          # UDPブロードキャスト
+udp_port = 1024                     # UDPポート番号
+device_s = 'medal'                  # デバイス識別名(5文字)
+device_n = None                     # デバイス識別番号(1桁, NoneでメダルのID下1桁)
+udp_interval = None                 # UDP送信間隔(秒, Noneは受信毎), 間隔内は平均値
+
+ambient_chid='0000'                 # ここにAmbientで取得したチャネルIDを入力
+ambient_wkey='0123456789abcdef'     # ここにはライトキーを入力
+ambient_interval = 30               # Ambientへの送信間隔
+ambient_id = None                   # 送信するメダルのID(Noneは最初に受信したメダル)
+ambient_aggregate = 'mean'          # 送信間隔内の集計方法('mean','min','max','last')
+ambient_channels = None             # 複数チャネルへの振り分け(sensormedal2/channels.pyの形式)
+
+history_size = 3600                 # メダル毎に保持する履歴の件数
+history_port = 8080                 # 履歴のHTTP公開ポート
+history_window = 300                # 移動窓の集計の時間(秒, /rolling)
+
+state_file = 'SensorMedal2.state'   # 動作状態の保存先(Noneで保存しない)
+checkpoint_interval = 30            # 動作状態の保存間隔(秒)
+
+metrics_port = 9100                 # 計測値のHTTP公開ポート(Noneで公開しない)
+summary_interval = 60               # 計測値の概要の表示間隔(秒, Noneで表示しない)
+
+from sensormedal2.scan import stream
+from sensormedal2.pipeline import Pipeline
+from sensormedal2.prefilter import Prefilter
+from sensormedal2.sinks import ConsoleSink, CsvSink, UdpSink, AmbientSink, AmbientChannelsSink, ArchiveSink, HistorySink, RawRingSink, SqliteSink
+from sensormedal2.history import serve as serve_history
+from sensormedal2.dashboard import Dashboard
+from sensormedal2.deadband import ChangeFilter
+from sensormedal2.checkpoint import Checkpoint
+from sensormedal2.dutycycle import DutyCycle
+from sensormedal2.metrics import serve, Summary
+
+sinks = []
+if display == 'frame':
+    sinks.append(ConsoleSink())
+if sink_csv:
+    sinks.append(CsvSink(filename, username,
+                         change=ChangeFilter(heartbeat=heartbeat) if deadband else None))
+if sink_udp:
+    sinks.append(UdpSink(udp_to, udp_port, device_s, device_n, udp_interval,
+                         change=ChangeFilter(heartbeat=heartbeat) if deadband else None))
+if sink_ambient and ambient_channels:
+    sinks.append(AmbientChannelsSink(ambient_channels, ambient_aggregate, spool='ambient_channels.spool'))
+elif sink_ambient and int(ambient_chid) != 0:
+    sinks.append(AmbientSink(ambient_chid, ambient_wkey, ambient_interval, ambient_id,
+                             ambient_aggregate, spool='ambient.spool'))
+if sink_archive:
+    sinks.append(ArchiveSink(archive_file, username=username))
+if sink_raw:
+    sinks.append(RawRingSink(raw_file, raw_capacity))
+if sink_sqlite:
+    sinks.append(SqliteSink(sqlite_file, username=username,
+                            retention=sqlite_retention * 86400 if sqlite_retention else None))
+if sink_history:                    # http://localhost:8080/latest
+    sinks.append(HistorySink(history_size, window=history_window))
+    serve_history(sinks[-1].history, history_port)
+
+pipeline = Pipeline(sinks, prefilter=Prefilter(allow_addrs, deny_addrs))
+
+checkpoint = None
+if state_file:                      # 前回の動作状態を復元
+    checkpoint = Checkpoint(state_file, pipeline, checkpoint_interval)
+    if checkpoint.load():
+        print('restored', len(pipeline.medals), 'medals from', state_file)
+    checkpoint.start()
+
+def status():                       # 一覧表示の最下行
+    s = 'frames: ' + str(pipeline.frames) + '  errors: ' + str(pipeline.errors)
+    for sink in sinks:
+        s += '  ' + sink.name + ': ' + str(sink.processed)
+        if sink.dropped:
+            s += ' (dropped ' + str(sink.dropped) + ')'
+    return s
+
+table = display == 'table' and Dashboard(pipeline.medals, status=status).start()
+if not table and summary_interval:  # 一覧表示をしない時(端末以外を含む)は概要を表示
+    Summary(summary_interval).start()
+if metrics_port:                    # http://localhost:9100/metrics
+    serve(metrics_port)
+
+# BLE受信処理(広告を受信する度に各出力先へ配信)
+try:
+    stream(pipeline.handle, iface=iface, timeout=interval,
+           duty=DutyCycle() if adaptive_scan and not isinstance(iface, list) else None)
+finally:                            # 再生終了時やCtrl-Cによる終了時
+    pipeline.close()
+    if checkpoint:
+        checkpoint.save()
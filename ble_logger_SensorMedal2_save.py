@@ -24,6 +24,13 @@
 #       sudo nohup ./ble_logger_SensorMedal2_save.py >& /dev/null &
 #       tail -f SensorMedal2.csv
 #
+#   値が変化した時のみCSVへ保存する場合(保存容量を減らす)
+#       下記の deadband を True に設定してください
+#       変化が無くても heartbeat秒毎に保存します
+#
+#   列形式アーカイブ(sensormedal2/archive.py)へも保存する場合
+#       下記の archive_file を 'SensorMedal2.sm2' のように設定してください
+#
 #【参考文献】
 #   本プログラムを作成するにあたり下記を参考にしました
 #   https://www.rohm.co.jp/documents/11401/3946483/sensormedal-evk-002_ug-j.pdf
@@ -32,139 +39,137 @@
 interval = 3                    # 動作間隔
 filename = 'SensorMedal2.csv'   # 保存するファイルの名前
 username = 'pi'                 # ファイル保存時の所有者名
+flush_lines = 64                # 書き込みをまとめる行数
+flush_interval = 10             # 書き込みの最大待ち時間(秒)
+fsync = False                   # 書き込み毎にSDカードへ同期する
+rotate = None                   # 'day'で日毎にファイルを切り替え
+archive_file = None             # 列形式アーカイブのファイル名(Noneで保存しない)
+deadband = False                # Trueで値が変化した時のみCSVへ保存
+heartbeat = 300                 # 変化が無くても保存する間隔(秒)
 
-from bluepy import btle
-from sys import argv
-import getpass
-from shutil import chown
-from time import sleep
+from sensormedal2.scan import stream
+from sensormedal2 import SensorMedal2Frame
+from sensormedal2.dedup import DedupCache
+from sensormedal2.csvwriter import CsvWriter
+from sensormedal2.archive import ArchiveWriter
+from sensormedal2.deadband import ChangeFilter
+from sensormedal2.prefilter import Prefilter
+from time import time
 
 import datetime
 
+writer = CsvWriter(username, flush_lines=flush_lines, flush_interval=flush_interval,
+                   fsync=fsync, rotate=rotate)
+
+archive = None
+if archive_file:
+    archive = ArchiveWriter(archive_file, username=username)
+
 def save(filename, data):
-    try:
-        fp = open(filename, mode='a')                   # 書込用ファイルを開く
-    except Exception as e:                              # 例外処理発生時
-        print(e)                                        # エラー内容を表示
-    fp.write(data + '\n')                               # dataをファイルへ
-    fp.close()                                          # ファイルを閉じる
-    chown(filename, username, username)                 # 所有者をpiユーザへ
-
-def payval(num, bytes=1, sign=False):
-    global val
-    a = 0
-    for i in range(0, bytes):
-        a += (256 ** i) * int(val[(num - 2 + i) * 2 : (num - 1 + i) * 2],16)
-    if sign:
-        if a >= 2 ** (bytes * 8):
-            a -= 2 ** (bytes * 8)
-    return a
-
-scanner = btle.Scanner()
-while True:
-    # BLE受信処理
-    try:
-        devices = scanner.scan(interval)
-    except Exception as e:
-        print("ERROR",e)
-        if getpass.getuser() != 'root':
-            print('使用方法: sudo', argv[0])
-            exit()
-        sleep(interval)
-        continue
-
-    # 受信データについてBLEデバイス毎の処理
-    for dev in devices:
-        print("\nDevice %s (%s), RSSI=%d dB" % (dev.addr, dev.addrType, dev.rssi))
-        isRohmMedal = False
-        sensors = dict()
-        for (adtype, desc, val) in dev.getScanData():
-            print("  %s = %s" % (desc, val))
-            if desc == 'Short Local Name' and val[0:10] == 'ROHMMedal2':
-                isRohmMedal = True
-            if isRohmMedal and desc == 'Manufacturer':
-
-                # センサ値を辞書型変数sensorsへ代入
-                sensors['ID'] = hex(payval(2,2))
-                sensors['Temperature'] = -45 + 175 * payval(4,2) / 65536
-                sensors['Humidity'] = 100 * payval(6,2) / 65536
-                sensors['SEQ'] = payval(8)
-                sensors['Condition Flags'] = bin(int(val[16:18],16))
-                sensors['Accelerometer X'] = payval(10,2,True) / 4096
-                sensors['Accelerometer Y'] = payval(12,2,True) / 4096
-                sensors['Accelerometer Z'] = payval(14,2,True) / 4096
-                sensors['Accelerometer'] = (sensors['Accelerometer X'] ** 2\
-                                          + sensors['Accelerometer Y'] ** 2\
-                                          + sensors['Accelerometer Z'] ** 2) ** 0.5
-                sensors['Geomagnetic X'] = payval(16,2,True) / 10
-                sensors['Geomagnetic Y'] = payval(18,2,True) / 10
-                sensors['Geomagnetic Z'] = payval(20,2,True) / 10
-                sensors['Geomagnetic']  = (sensors['Geomagnetic X'] ** 2\
-                                         + sensors['Geomagnetic Y'] ** 2\
-                                         + sensors['Geomagnetic Z'] ** 2) ** 0.5
-                sensors['Pressure'] = payval(22,3) / 2048
-                sensors['Illuminance'] = payval(25,2) / 1.2
-                sensors['Magnetic'] = hex(payval(27))
-                sensors['Steps'] = payval(28,2)
-                sensors['Battery Level'] = payval(30)
-                sensors['RSSI'] = dev.rssi
-
-                # 画面へ表示
-                print('    ID            =',sensors['ID'])
-                print('    SEQ           =',sensors['SEQ'])
-                print('    Temperature   =',round(sensors['Temperature'],2),'℃')
-                print('    Humidity      =',round(sensors['Humidity'],2),'%')
-                print('    Pressure      =',round(sensors['Pressure'],3),'hPa')
-                print('    Illuminance   =',round(sensors['Illuminance'],1),'lx')
-                print('    Accelerometer =',round(sensors['Accelerometer'],3),'g (',\
-                                            round(sensors['Accelerometer X'],3),\
-                                            round(sensors['Accelerometer Y'],3),\
-                                            round(sensors['Accelerometer Z'],3),'g)')
-                print('    Geomagnetic   =',round(sensors['Geomagnetic'],1),'uT (',\
-                                            round(sensors['Geomagnetic X'],1),\
-                                            round(sensors['Geomagnetic Y'],1),\
-                                            round(sensors['Geomagnetic Z'],1),'uT)')
-                print('    Magnetic      =',sensors['Magnetic'])
-                print('    Steps         =',sensors['Steps'],'歩')
-                print('    Battery Level =',sensors['Battery Level'],'%')
-                print('    RSSI          =',sensors['RSSI'],'dB')
-
-                # 全センサ値のファイルを保存
-                date=datetime.datetime.today()
-                s = date.strftime('%Y/%m/%d %H:%M') + ', SensorMedal2'
-                s += ', ' + str(int(sensors['ID'],16))
-                s += ', ' + str(sensors['SEQ'])
-                s += ', ' + str(sensors['Temperature'])
-                s += ', ' + str(sensors['Humidity'])
-                s += ', ' + str(sensors['Pressure'])
-                s += ', ' + str(sensors['Illuminance'])
-                s += ', ' + str(sensors['Accelerometer'])
-                s += ', ' + str(sensors['Accelerometer X'])
-                s += ', ' + str(sensors['Accelerometer Y'])
-                s += ', ' + str(sensors['Accelerometer Z'])
-                s += ', ' + str(sensors['Geomagnetic'])
-                s += ', ' + str(sensors['Geomagnetic X'])
-                s += ', ' + str(sensors['Geomagnetic Y'])
-                s += ', ' + str(sensors['Geomagnetic Z'])
-                s += ', ' + str(int(sensors['Magnetic'],16))
-                s += ', ' + str(sensors['Steps'])
-                s += ', ' + str(sensors['Battery Level'])
-                s += ', ' + str(sensors['RSSI'])
+    writer.write(filename, data)                        # dataをバッファへ
+
+dedup = DedupCache()                            # 重複受信の除去用
+change = ChangeFilter(heartbeat=heartbeat) if deadband else None
+
+prefilter = Prefilter()                         # メダル以外の広告を除外
+
+# 受信データについてBLEデバイス毎の処理
+def handle(dev):
+    writer.tick()                               # 受信が途絶えたメダルの行も書き込む
+    if archive:
+        archive.tick()
+    if not prefilter.check(dev):                # メダル以外は表示しない
+        return
+    print("\nDevice %s (%s), RSSI=%d dB" % (dev.addr, dev.addrType, dev.rssi))
+    isRohmMedal = False
+    sensors = dict()
+    for (adtype, desc, val) in dev.getScanData():
+        print("  %s = %s" % (desc, val))
+        if desc == 'Short Local Name' and val[0:10] == 'ROHMMedal2':
+            isRohmMedal = True
+        if isRohmMedal and desc == 'Manufacturer':
+
+            # 受信済みのSEQであれば処理しない
+            if dedup.seen(dev.addr, val):
+                print('    SEQ重複のため省略 (累計',dedup.duplicates,'件)')
+                return
+
+            # センサ値を辞書型変数sensorsへ代入
+            sensors = SensorMedal2Frame.from_hex(val).sensors()
+            sensors['RSSI'] = dev.rssi
+
+            # 画面へ表示
+            print('    ID            =',sensors['ID'])
+            print('    SEQ           =',sensors['SEQ'])
+            print('    Temperature   =',round(sensors['Temperature'],2),'℃')
+            print('    Humidity      =',round(sensors['Humidity'],2),'%')
+            print('    Pressure      =',round(sensors['Pressure'],3),'hPa')
+            print('    Illuminance   =',round(sensors['Illuminance'],1),'lx')
+            print('    Accelerometer =',round(sensors['Accelerometer'],3),'g (',\
+                                        round(sensors['Accelerometer X'],3),\
+                                        round(sensors['Accelerometer Y'],3),\
+                                        round(sensors['Accelerometer Z'],3),'g)')
+            print('    Geomagnetic   =',round(sensors['Geomagnetic'],1),'uT (',\
+                                        round(sensors['Geomagnetic X'],1),\
+                                        round(sensors['Geomagnetic Y'],1),\
+                                        round(sensors['Geomagnetic Z'],1),'uT)')
+            print('    Magnetic      =',sensors['Magnetic'])
+            print('    Steps         =',sensors['Steps'],'歩')
+            print('    Battery Level =',sensors['Battery Level'],'%')
+            print('    RSSI          =',sensors['RSSI'],'dB')
+
+            # 列形式アーカイブへ保存
+            if archive:
+                archive.append(time(), val, dev.rssi)
+
+            # 全センサ値のファイルを保存
+            dev_id = int(sensors['ID'],16)
+            date=datetime.datetime.today()
+            s = date.strftime('%Y/%m/%d %H:%M') + ', SensorMedal2'
+            s += ', ' + str(int(sensors['ID'],16))
+            s += ', ' + str(sensors['SEQ'])
+            s += ', ' + str(sensors['Temperature'])
+            s += ', ' + str(sensors['Humidity'])
+            s += ', ' + str(sensors['Pressure'])
+            s += ', ' + str(sensors['Illuminance'])
+            s += ', ' + str(sensors['Accelerometer'])
+            s += ', ' + str(sensors['Accelerometer X'])
+            s += ', ' + str(sensors['Accelerometer Y'])
+            s += ', ' + str(sensors['Accelerometer Z'])
+            s += ', ' + str(sensors['Geomagnetic'])
+            s += ', ' + str(sensors['Geomagnetic X'])
+            s += ', ' + str(sensors['Geomagnetic Y'])
+            s += ', ' + str(sensors['Geomagnetic Z'])
+            s += ', ' + str(int(sensors['Magnetic'],16))
+            s += ', ' + str(sensors['Steps'])
+            s += ', ' + str(sensors['Battery Level'])
+            s += ', ' + str(sensors['RSSI'])
+            if change is None or change.changed(dev_id, sensors):
                 save(filename, s)
 
-                # センサ個別値のファイルを保存
-                for sensor in sensors:
-                    if sensor.find(' ') >= 0 or len(sensor) <= 5 or sensor == 'Magnetic':
-                        continue
-                    s = date.strftime('%Y/%m/%d %H:%M') + ', ' + sensor
-                    s += ', ' + str(sensors[sensor])
-                    if sensor == 'Accelerometer':
-                        s += ', ' + str(sensors['Accelerometer X'])
-                        s += ', ' + str(sensors['Accelerometer Y'])
-                        s += ', ' + str(sensors['Accelerometer Z'])
-                    if sensor == 'Geomagnetic':
-                        s += ', ' + str(sensors['Geomagnetic X'])
-                        s += ', ' + str(sensors['Geomagnetic Y'])
-                        s += ', ' + str(sensors['Geomagnetic Z'])
-                    print(s, '-> ' + sensor + '.csv') 
-                    save(sensor + '.csv', s)
+            # センサ個別値のファイルを保存
+            for sensor in sensors:
+                if sensor.find(' ') >= 0 or len(sensor) <= 5 or sensor == 'Magnetic':
+                    continue
+                if change and not change.changed(dev_id, sensors, sensor):
+                    continue                    # 変化が無いので保存しない
+                s = date.strftime('%Y/%m/%d %H:%M') + ', ' + sensor
+                s += ', ' + str(sensors[sensor])
+                if sensor == 'Accelerometer':
+                    s += ', ' + str(sensors['Accelerometer X'])
+                    s += ', ' + str(sensors['Accelerometer Y'])
+                    s += ', ' + str(sensors['Accelerometer Z'])
+                if sensor == 'Geomagnetic':
+                    s += ', ' + str(sensors['Geomagnetic X'])
+                    s += ', ' + str(sensors['Geomagnetic Y'])
+                    s += ', ' + str(sensors['Geomagnetic Z'])
+                print(s, '-> ' + sensor + '.csv') 
+                save(sensor + '.csv', s)
+
+# BLE受信処理(広告を受信する度にhandleを実行)
+try:
+    stream(handle, timeout=interval)
+finally:                                        # 再生終了時やCtrl-Cによる終了時
+    writer.close()                              # 未書込の行を書き込む
+    if archive:
+        archive.close()
@@ -0,0 +1,11 @@
+# coding: utf-8
+
+################################################################################
+# BLE Logger for Rohm SensorMedal-EVK-002 共通ライブラリ
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+from .frame import SensorMedal2Frame, decode, decode_batch
+
+__all__ = ['SensorMedal2Frame', 'decode', 'decode_batch']
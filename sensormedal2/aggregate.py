@@ -0,0 +1,169 @@
+# coding: utf-8
+
+################################################################################
+# センサ値の集計(最小・最大・平均・最新値)
+# メダル毎・センサ毎に一定時間の値を集計し、出力先の送信間隔で渡します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   固定窓(tumbling): window秒毎に集計結果をcallbackへ渡す
+#       def callback(dev_id, start, stats):
+#           print(dev_id, stats['Temperature'].mean())
+#       tw = TumblingWindow(60, callback)
+#       tw.add(record)                      # 受信毎(O(1))
+#       tw.flush()                          # 受信が途絶えたメダルの集計も出力
+#   移動窓(sliding): 直近window秒の集計をいつでも取得
+#       sw = SlidingWindow(60, panes=12)    # 5秒毎の区間で管理
+#       sw.add(record)
+#       stats = sw.stats(dev_id)            # History.rolling()で使用
+#
+#   集計結果は summarize(stats, 'mean') で従来の辞書型変数sensorsの形式へ
+#   変換できるので、各出力先の送信データ作成処理をそのまま使えます。
+
+from time import time
+
+# 集計するセンサ(数値)
+NUMERIC = ('Temperature', 'Humidity', 'Pressure', 'Illuminance',
+           'Accelerometer', 'Accelerometer X', 'Accelerometer Y', 'Accelerometer Z',
+           'Geomagnetic', 'Geomagnetic X', 'Geomagnetic Y', 'Geomagnetic Z',
+           'Steps', 'Battery Level', 'RSSI')
+
+class Stat:
+    __slots__ = ('count', 'total', 'min', 'max', 'last', 't')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.last = None                        # 最新値
+        self.t = None                           # 最新値の時刻
+
+    def add(self, value, t):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.t is None or t >= self.t:
+            self.last = value
+            self.t = t
+
+    def merge(self, other):
+        if not other.count:
+            return
+        self.count += other.count
+        self.total += other.total
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        if self.t is None or other.t >= self.t:
+            self.last = other.last
+            self.t = other.t
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def value(self, how='mean'):
+        if how == 'mean':
+            return self.mean()
+        return getattr(self, how)               # 'min', 'max', 'last'
+
+def new_stats(sensors):
+    stats = dict()
+    for key in NUMERIC:
+        stats[key] = Stat()
+    stats['sensors'] = sensors                  # 数値以外(ID, SEQ等)は最新値
+    return stats
+
+def add_stats(stats, sensors, t):
+    for key in NUMERIC:
+        stats[key].add(sensors[key], t)
+    stats['sensors'] = sensors
+
+def summarize(stats, how='mean'):
+    # 集計結果を辞書型変数sensorsの形式へ変換
+    sensors = dict(stats['sensors'])
+    for key in NUMERIC:
+        if stats[key].count:
+            sensors[key] = stats[key].value(how)
+    sensors['Count'] = stats['Temperature'].count
+    return sensors
+
+class TumblingWindow:
+    def __init__(self, window, callback):
+        self.window = window                    # 集計する時間(秒)
+        self.callback = callback                # callback(dev_id, start, stats)
+        self.windows = dict()                   # ID毎の[開始時刻, stats]
+
+    def add(self, record):
+        w = self.windows.get(record.id)
+        if w is not None and record.t >= w[0] + self.window:
+            del self.windows[record.id]
+            self.callback(record.id, w[0], w[1])
+            w = None
+        if w is None:
+            start = record.t - record.t % self.window   # 時刻を窓の境界に揃える
+            w = self.windows[record.id] = [start, new_stats(record.sensors)]
+        add_stats(w[1], record.sensors, record.t)
+
+    def flush(self, now=None, force=False):
+        # 終了時刻を過ぎた窓(force=Trueの時は全ての窓)を出力
+        if now is None:
+            now = time()
+        for dev_id, w in list(self.windows.items()):
+            if force or now >= w[0] + self.window:
+                del self.windows[dev_id]
+                self.callback(dev_id, w[0], w[1])
+
+    def get_state(self):                        # チェックポイント用
+        return dict(self.windows)
+
+    def set_state(self, windows):
+        self.windows.update(windows)
+
+class SlidingWindow:
+    def __init__(self, window, panes=12):
+        self.pane = window / panes              # 1区間の時間(秒)
+        self.panes = panes
+        self.series = dict()                    # ID毎の区間のリスト
+
+    def add(self, record):
+        n = int(record.t // self.pane)          # 区間の番号
+        series = self.series.get(record.id)
+        if series is None:
+            series = self.series[record.id] = [None] * self.panes
+        p = series[n % self.panes]
+        if p is None or p[0] != n:              # 古い区間は再利用
+            p = series[n % self.panes] = [n, new_stats(record.sensors)]
+        add_stats(p[1], record.sensors, record.t)
+
+    def stats(self, dev_id, now=None):
+        # 直近window秒の集計結果(区間を合成)
+        if now is None:
+            now = time()
+        series = self.series.get(dev_id)
+        if series is None:
+            return None
+        n = int(now // self.pane)
+        result = None
+        for p in series:
+            if p is None or p[0] <= n - self.panes or p[0] > n:
+                continue
+            if result is None:
+                result = new_stats(p[1]['sensors'])
+            for key in NUMERIC:
+                result[key].merge(p[1][key])
+            if result[NUMERIC[0]].t == p[1][NUMERIC[0]].t:
+                result['sensors'] = p[1]['sensors']
+        return result
+
+    def devices(self):
+        return list(self.series)
+
+    def remove(self, dev_id):
+        self.series.pop(dev_id, None)
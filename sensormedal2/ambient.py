@@ -0,0 +1,169 @@
+# coding: utf-8
+
+################################################################################
+# Ambientへのデータ送信処理(バックグラウンド送信)
+# 受信処理を止めないように、別スレッドからまとめてAmbientへ送信します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   ambient = AmbientUploader(ambient_chid, ambient_wkey, spool='ambient.spool')
+#   ambient.send({'d1':温度, 'd2':湿度})    # すぐに戻る
+#
+#【動作】
+#   ・HTTP接続を保持したまま、たまったデータを一括送信(dataarray)します
+#   ・送信に失敗したときは、待ち時間を倍にしながら(最大backoff_max秒)再送します
+#   ・未送信のデータはspoolファイルに保存し、再起動時に読み込んで再送します
+#   ・urlを変更すると、ローカルの試験用HTTPサーバへ送信することができます
+#
+#【参考文献】
+#   https://ambidata.io/refs/api/
+
+import datetime
+import http.client
+import json
+import os
+import threading
+from time import monotonic, time
+from urllib.parse import urlsplit
+
+from .metrics import METRICS
+
+AMBIENT_URL = 'https://ambidata.io'
+
+class AmbientUploader:
+    def __init__(self, chid, wkey, url=AMBIENT_URL, spool=None, min_interval=5,
+                 batch=100, max_pending=10000, backoff_max=300, timeout=10,
+                 verbose=True):
+        self.path = '/api/v2/channels/' + str(chid) + '/dataarray'
+        self.wkey = wkey
+        u = urlsplit(url)
+        self.https = (u.scheme == 'https')
+        self.host = u.hostname
+        self.port = u.port
+        self.spool = spool                      # 未送信データの保存ファイル
+        self.min_interval = min_interval        # 送信の最小間隔(秒)
+        self.batch = batch                      # 1回に送信する最大件数
+        self.max_pending = max_pending          # 未送信データの最大件数
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.verbose = verbose
+        self.conn = None
+        self.pending = []                       # 未送信データ
+        self.sent = 0                           # 送信したデータ数
+        self.dropped = 0                        # 上限超過で破棄したデータ数
+        self.errors = 0                         # 送信エラー数
+        self.cond = threading.Condition()
+        self.load_spool()
+        METRICS.gauge('queue_depth', lambda: len(self.pending),   # 出力先のキューと区別
+                      queue='ambient_' + str(chid))
+        self.thread = threading.Thread(target=self.run, name='ambient', daemon=True)
+        self.thread.start()
+
+    def load_spool(self):
+        if not self.spool or not os.path.exists(self.spool):
+            return
+        with open(self.spool) as fp:
+            for line in fp:
+                try:
+                    self.pending.append(json.loads(line))
+                except ValueError:
+                    pass                        # 書き込み途中の行は無視
+        self.pending = self.pending[-self.max_pending:]
+        if self.verbose and self.pending:
+            print('Ambient: 未送信データ', len(self.pending), '件を再送します')
+
+    def save_spool(self):
+        if not self.spool:
+            return
+        tmp = self.spool + '.tmp'
+        with open(tmp, 'w') as fp:
+            for d in self.pending:
+                fp.write(json.dumps(d) + '\n')
+        os.replace(tmp, self.spool)             # 置き換えは一度に行う
+
+    def send(self, data, t=None):
+        # data: {'d1':値, ...}  t: 測定時刻(UNIX時刻, 省略時は現在時刻)
+        if t is None:
+            t = time()
+        d = dict(data)
+        d['created'] = datetime.datetime.fromtimestamp(t).strftime(
+            '%Y-%m-%d %H:%M:%S.%f')[:-3]
+        with self.cond:
+            self.pending.append(d)
+            if len(self.pending) > self.max_pending:
+                del self.pending[0]
+                self.dropped += 1
+            if self.spool:                      # 送信前にファイルへ追記
+                with open(self.spool, 'a') as fp:
+                    fp.write(json.dumps(d) + '\n')
+            self.cond.notify()
+
+    def connect(self):
+        if self.conn is None:
+            if self.https:
+                self.conn = http.client.HTTPSConnection(self.host, self.port,
+                                                        timeout=self.timeout)
+            else:
+                self.conn = http.client.HTTPConnection(self.host, self.port,
+                                                       timeout=self.timeout)
+        return self.conn
+
+    def post(self, data):
+        body = json.dumps({'writeKey': self.wkey, 'data': data}).encode()
+        conn = self.connect()
+        try:
+            conn.request('POST', self.path, body,
+                         {'Content-Type': 'application/json'})
+            res = conn.getresponse()
+            res_str = res.read().decode()
+        except Exception:
+            conn.close()                        # 次回は接続し直す
+            self.conn = None
+            raise
+        if res.status >= 300:
+            raise Exception('HTTP ' + str(res.status) + ' ' + res_str)
+        return res_str
+
+    def run(self):
+        backoff = 0
+        next_post = 0                           # 次に送信できる時刻
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                wait = next_post - monotonic()
+                if wait > 0:
+                    self.cond.wait(wait)        # 送信間隔の調整
+                    continue
+                data = self.pending[:self.batch]
+            try:
+                with METRICS.timer('ambient_post_seconds'):
+                    res_str = self.post(data)
+            except Exception as e:              # 例外処理発生時
+                self.errors += 1
+                METRICS.inc('ambient_errors_total')
+                backoff = min(max(backoff * 2, self.min_interval, 1), self.backoff_max)
+                print('Ambient:', e, '(', backoff, '秒後に再送)')
+                next_post = monotonic() + backoff
+                continue
+            next_post = monotonic() + self.min_interval
+            backoff = 0
+            with self.cond:
+                for d in data:                  # 送信済みのデータを削除
+                    if self.pending and self.pending[0] is d:
+                        del self.pending[0]
+                self.sent += len(data)
+                self.save_spool()
+            if self.verbose:
+                print('Ambient:', len(data), '件送信', res_str)
+
+    def flush(self, timeout=None):              # 未送信データが無くなるまで待つ
+        t = monotonic()
+        while self.pending:
+            if timeout is not None and monotonic() - t > timeout:
+                return False
+            with self.cond:
+                self.cond.wait(0.1)
+        return True
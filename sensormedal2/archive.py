@@ -0,0 +1,287 @@
+# coding: utf-8
+
+################################################################################
+# センサ値の列形式バイナリ・アーカイブ
+# 受信値をメダル毎のブロックにまとめて追記し、時刻範囲で高速に読み出します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   書き込み
+#       archive = ArchiveWriter('SensorMedal2.sm2')
+#       archive.append(time(), bytes.fromhex(val), dev.rssi)
+#       archive.tick()                          # 受信が途絶えたメダルのブロックも書き出す
+#       archive.close()                         # 終了時に必ず実行(未書出のブロックを書き出す)
+#   読み出し
+#       reader = ArchiveReader('SensorMedal2.sm2')
+#       data = reader.query(device=1, start=t0, end=t1, columns=['temperature'])
+#   コマンドで読み出し(CSV形式で表示)
+#       python3 -m sensormedal2.archive SensorMedal2.sm2 [ID] [開始] [終了]
+#       開始・終了は 'YYYY/MM/DD HH:MM' または UNIX時刻
+#
+#【ファイル形式】
+#   ブロック(メダル毎に最大block_size件)の繰り返し
+#       ヘッダ      BLOCK_HEAD (識別子, 版, フラグ, ID, 件数, 先頭・末尾時刻,
+#                               データ部の長さ, CRC32)
+#       最小最大    列毎の最小値と最大値 (int32 x 2 x 列数)
+#       データ部    時刻差分(ms, uint32)と各列を列毎に格納(flags bit0でzlib圧縮)
+#   センサ値はManufacturerの値のまま(単位換算前)の固定長整数で保存します。
+#   CRC32はヘッダ(CRC32を除く)・最小最大・データ部の全体について計算します。
+#   CRC32が一致しないブロック(書き込み途中や破損)は、次の識別子まで読み飛ばします
+#   (skippedバイト)。
+
+import datetime
+import mmap
+import os
+import struct
+import sys
+import zlib
+from shutil import chown
+from time import monotonic
+
+from .frame import FRAME
+
+BLOCK_MAGIC = b'SM2A'
+BLOCK_VERSION = 2
+BLOCK_HEAD = struct.Struct('<4sBBHIqqII')
+CRC_POS = BLOCK_HEAD.size - 4                   # ヘッダ内のCRC32の位置
+FLAG_ZLIB = 0x01
+
+# 列名と型(arrayモジュールの型コード)
+COLUMNS = (
+    ('temperature', 'H'), ('humidity', 'H'), ('seq', 'B'), ('flags', 'B'),
+    ('accel_x', 'h'), ('accel_y', 'h'), ('accel_z', 'h'),
+    ('geo_x', 'h'), ('geo_y', 'h'), ('geo_z', 'h'),
+    ('pressure', 'I'), ('illuminance', 'H'), ('magnetic', 'B'),
+    ('steps', 'H'), ('battery', 'B'), ('rssi', 'b'),
+)
+COLUMN_NAMES = tuple(c[0] for c in COLUMNS)
+MINMAX = struct.Struct('<' + 'ii' * len(COLUMNS))
+
+# 単位換算(保存値 -> 物理量)
+SCALE = {
+    'temperature': lambda v: -45 + 175 * v / 65536,
+    'humidity': lambda v: 100 * v / 65536,
+    'accel_x': lambda v: v / 4096,
+    'accel_y': lambda v: v / 4096,
+    'accel_z': lambda v: v / 4096,
+    'geo_x': lambda v: v / 10,
+    'geo_y': lambda v: v / 10,
+    'geo_z': lambda v: v / 10,
+    'pressure': lambda v: v / 2048,
+    'illuminance': lambda v: v / 1.2,
+}
+
+def raw_values(data, rssi):
+    # Manufacturerのバイト列を保存用の整数の並び(COLUMNSの順)へ変換
+    (dev_id, temp, humi, seq, flags, ax, ay, az, gx, gy, gz,
+     press_l, press_h, illum, mag, steps, batt) = FRAME.unpack_from(data)
+    return dev_id, (temp, humi, seq, flags, ax, ay, az, gx, gy, gz,
+                    press_l + (press_h << 16), illum, mag, steps, batt, rssi)
+
+class ArchiveWriter:
+    def __init__(self, filename, block_size=256, block_age=600,
+                 compress=True, username=None):
+        self.filename = filename
+        self.block_size = block_size            # 1ブロックの最大件数
+        self.block_age = block_age              # ブロックを書き出す最大経過秒
+        self.compress = compress
+        self.username = username                # ファイルの所有者名
+        self.blocks = dict()                    # ID毎の[時刻のリスト, 値のリスト, 作成時刻]
+
+    def append(self, t, data, rssi=0):
+        if isinstance(data, str):
+            data = bytes.fromhex(data)
+        dev_id, values = raw_values(data, rssi)
+        self.append_values(t, dev_id, values)
+
+    def append_values(self, t, dev_id, values):
+        # 保存用の整数の並び(COLUMNSの順)を追記
+        ms = int(t * 1000)
+        block = self.blocks.get(dev_id)
+        if block and (ms - block[0][0] > 0xFFFFFFFF or ms < block[0][0]):
+            self.write_block(dev_id)            # 時刻差分が収まらない時
+            block = None
+        if block is None:
+            block = self.blocks[dev_id] = [[], [], monotonic()]
+        block[0].append(ms)
+        block[1].append(values)
+        if len(block[0]) >= self.block_size \
+                or (ms - block[0][0]) / 1000 >= self.block_age:
+            self.write_block(dev_id)
+
+    def write_block(self, dev_id):
+        times, rows, created = self.blocks.pop(dev_id)
+        if not times:
+            return
+        t0 = times[0]
+        payload = struct.pack('<%dI' % len(times), *[t - t0 for t in times])
+        minmax = []
+        for i, (name, tc) in enumerate(COLUMNS):
+            col = [r[i] for r in rows]
+            payload += struct.pack('<%d%s' % (len(col), tc), *col)
+            minmax += [min(col), max(col)]
+        flags = 0
+        if self.compress:
+            payload = zlib.compress(payload)
+            flags |= FLAG_ZLIB
+        head = BLOCK_HEAD.pack(BLOCK_MAGIC, BLOCK_VERSION, flags, dev_id,
+                               len(times), t0, times[-1], len(payload), 0)[:CRC_POS]
+        body = MINMAX.pack(*minmax) + payload
+        crc = zlib.crc32(body, zlib.crc32(head))
+        new = not os.path.exists(self.filename)
+        with open(self.filename, 'ab') as fp:   # 1ブロックを1回で追記
+            fp.write(head + struct.pack('<I', crc) + body)
+        if new and self.username:
+            try:
+                chown(self.filename, self.username, self.username)
+            except Exception as e:
+                print(e)
+
+    def tick(self):
+        # block_age秒以上前に作成したブロックを書き出す(受信が途絶えたメダル用)
+        now = monotonic()
+        for dev_id, block in list(self.blocks.items()):
+            if now - block[2] >= self.block_age:
+                self.write_block(dev_id)
+
+    def flush(self):
+        for dev_id in list(self.blocks):
+            self.write_block(dev_id)
+
+    def close(self):
+        self.flush()
+
+class ArchiveReader:
+    def __init__(self, filename):
+        self.fp = open(filename, 'rb')
+        size = os.fstat(self.fp.fileno()).st_size
+        self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.index = []                         # ブロックの索引
+        self.skipped = 0                        # 読み飛ばしたバイト数
+        off = 0
+        head_len = BLOCK_HEAD.size + MINMAX.size
+        while off + head_len <= size:
+            (magic, ver, flags, dev_id, count, t0, t1,
+             length, crc) = BLOCK_HEAD.unpack_from(self.mm, off)
+            end = off + head_len + length
+            if magic != BLOCK_MAGIC or ver != BLOCK_VERSION or end > size \
+                    or zlib.crc32(self.mm[off + BLOCK_HEAD.size:end],
+                                  zlib.crc32(self.mm[off:off + CRC_POS])) != crc:
+                # 書き込み途中・破損したブロックは次の識別子まで読み飛ばす
+                nxt = self.mm.find(BLOCK_MAGIC, off + 1)
+                if nxt < 0:
+                    nxt = size
+                self.skipped += nxt - off
+                off = nxt
+                continue
+            minmax = MINMAX.unpack_from(self.mm, off + BLOCK_HEAD.size)
+            self.index.append((dev_id, t0, t1, count, flags,
+                               off + head_len, length, minmax))
+            off = end
+        self.skipped += size - off              # 末尾の書き込み途中のヘッダ
+
+    def devices(self):
+        return sorted(set(b[0] for b in self.index))
+
+    def blocks(self, device=None, start=None, end=None):
+        # 条件に合うブロックを索引から選択(時刻はUNIX時刻[秒])
+        s = None if start is None else int(start * 1000)
+        e = None if end is None else int(end * 1000)
+        for b in self.index:
+            if device is not None and b[0] != device:
+                continue
+            if (s is not None and b[2] < s) or (e is not None and b[1] > e):
+                continue
+            yield b
+
+    def column_range(self, name, device=None):
+        # 列の最小値と最大値(物理量)を索引のみから求める
+        i = COLUMN_NAMES.index(name)
+        lo = hi = None
+        for b in self.blocks(device):
+            if lo is None or b[7][i * 2] < lo:
+                lo = b[7][i * 2]
+            if hi is None or b[7][i * 2 + 1] > hi:
+                hi = b[7][i * 2 + 1]
+        if lo is None:
+            return None
+        f = SCALE.get(name, lambda v: v)
+        return f(lo), f(hi)
+
+    def read_block(self, b, columns):
+        dev_id, t0, t1, count, flags, off, length, minmax = b
+        buf = memoryview(self.mm)[off:off + length]
+        if flags & FLAG_ZLIB:
+            buf = memoryview(zlib.decompress(buf))
+        out = {'time': [(t0 + d) / 1000 for d in column(buf, 0, 'I', count)]}
+        pos = count * 4
+        for name, tc in COLUMNS:
+            size = struct.calcsize(tc) * count
+            if name in columns:
+                col = column(buf, pos, tc, count)
+                f = SCALE.get(name)
+                out[name] = [f(v) for v in col] if f else list(col)
+            pos += size
+        return out
+
+    def query(self, device=None, start=None, end=None, columns=None):
+        # 時刻範囲のデータを列毎のリストで返す
+        if columns is None:
+            columns = COLUMN_NAMES
+        result = {'time': [], 'id': []}
+        for name in columns:
+            result[name] = []
+        for b in self.blocks(device, start, end):
+            try:
+                data = self.read_block(b, columns)
+            except zlib.error:                  # データ部が破損したブロック
+                self.skipped += b[6]
+                continue
+            for j, t in enumerate(data['time']):
+                if (start is not None and t < start) or (end is not None and t > end):
+                    continue
+                result['time'].append(t)
+                result['id'].append(b[0])
+                for name in columns:
+                    result[name].append(data[name][j])
+        return result
+
+    def close(self):
+        if self.mm:
+            self.mm.close()
+        self.fp.close()
+
+def column(buf, pos, tc, count):
+    # 列をコピーせずに参照(リトルエンディアン機), それ以外は変換
+    size = struct.calcsize(tc) * count
+    if sys.byteorder == 'little':
+        return buf[pos:pos + size].cast(tc)
+    return struct.unpack_from('<%d%s' % (count, tc), buf, pos)
+
+def parse_time(s):
+    try:
+        return float(s)
+    except ValueError:
+        return datetime.datetime.strptime(s, '%Y/%m/%d %H:%M').timestamp()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('使用方法:', sys.argv[0], 'ファイル名 [ID] [開始] [終了]')
+        exit()
+    reader = ArchiveReader(sys.argv[1])
+    device = int(sys.argv[2], 0) if len(sys.argv) >= 3 else None
+    start = parse_time(sys.argv[3]) if len(sys.argv) >= 4 else None
+    end = parse_time(sys.argv[4]) if len(sys.argv) >= 5 else None
+    data = reader.query(device, start, end)
+    print('time, ID, ' + ', '.join(COLUMN_NAMES))
+    for j, t in enumerate(data['time']):
+        s = datetime.datetime.fromtimestamp(t).strftime('%Y/%m/%d %H:%M:%S.%f')[:-3]
+        s += ', ' + str(data['id'][j])
+        for name in COLUMN_NAMES:
+            s += ', ' + str(data[name][j])
+        print(s)
+    if reader.skipped:
+        print('読み飛ばし:', reader.skipped, 'バイト', file=sys.stderr)
+    reader.close()
@@ -0,0 +1,343 @@
+# coding: utf-8
+
+################################################################################
+# 処理速度の測定(ベンチマーク)
+# 擬似センサメダルのデータを使って、デコード・CSV/UDP/JSONの文字列作成・各出力先
+# の1秒あたりの処理フレーム数とメモリ使用量を測定し、基準値と比較します。
+# 出力先は一時フォルダ・ループバックのUDP・ローカルのHTTPサーバへ出力します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   測定して基準値と比較(基準値より threshold 以上遅い時は終了コード1)
+#       python3 -m sensormedal2.bench
+#   測定結果を基準値として保存
+#       python3 -m sensormedal2.bench save
+#   一部の項目のみ測定
+#       python3 -m sensormedal2.bench decode_hex format_csv sink_csv
+#
+#【表示の内容】
+#   frames/s    1秒あたりの処理フレーム数(repeat回の最良値)
+#   peak KiB    処理中に増加したメモリの最大値(tracemallocで測定)
+#   kept B/f    処理後に残ったメモリの1フレームあたりの大きさ
+#   ratio       基準値に対する frames/s の比(NGは threshold を超えて低下)
+#
+#【メモ】
+#   基準値は測定した機器でのみ有効です。機器やPythonの版を変えた時は
+#   保存し直してください。
+
+import datetime
+import http.server
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import tracemalloc
+from itertools import islice
+from time import perf_counter, time
+
+from .frame import FRAME, SensorMedal2Frame
+from .pipeline import Pipeline, Record
+from .replay import fleet
+from .sinks import (AmbientSink, ArchiveSink, CsvSink, HistorySink, RawRingSink,
+                    SqliteSink, UdpSink, ambient_data, console_lines, csv_lines,
+                    udp_lines)
+
+baseline_file = 'SensorMedal2.bench'            # 基準値の保存先
+threshold = 0.2                                 # 許容する速度の低下(2割)
+repeat = 3                                      # 測定回数(最良値を採用)
+
+def payloads(n, medals=10, seed=1):
+    # 擬似センサメダルのManufacturer(バイト列) n件, 各値は全範囲から乱数で作成
+    rnd = random.Random(seed)
+    r = rnd.randint
+    out = []
+    for i in range(n):
+        press = r(300 * 2048, 1100 * 2048)
+        out.append(FRAME.pack(i % medals + 1, r(0, 65535), r(0, 65535), i // medals & 0xFF,
+                              r(0, 255), r(-32768, 32767), r(-32768, 32767),
+                              r(-32768, 32767), r(-32768, 32767), r(-32768, 32767),
+                              r(-32768, 32767), press & 0xFFFF, press >> 16,
+                              r(0, 65535), r(0, 3), r(0, 65535), r(0, 100)))
+    return out
+
+def records(n, medals=10, step=1.0):
+    # 出力先へ渡すRecord n件(メダル毎に step秒間隔)
+    start = time() - n * step / medals
+    out = []
+    for i, p in enumerate(payloads(n, medals)):
+        sensors = SensorMedal2Frame(p).sensors()
+        sensors['RSSI'] = -50 - i % medals
+        out.append(Record(start + i * step / medals, 'ff:e0:9b:00:00:%02x' % (i % medals),
+                          sensors['RSSI'], p.hex(), sensors))
+    return out
+
+# 各項目は (実行する関数, 終了時の関数) を返す
+# 実行する関数は処理したフレーム数を返す(出力先の取りこぼしを含めないため)
+
+def bench_decode_hex(n):
+    vals = [p.hex() for p in payloads(n)]
+    def run():
+        for val in vals:                        # 受信処理と同じ16進文字列から
+            SensorMedal2Frame.from_hex(val).sensors()
+        return len(vals)
+    return run, None
+
+def bench_decode_bytes(n):
+    data = payloads(n)
+    def run():
+        for d in data:
+            SensorMedal2Frame(d)
+        return len(data)
+    return run, None
+
+def bench_format_csv(n):
+    recs = records(n)
+    def run():
+        for record in recs:
+            csv_lines(record)
+        return len(recs)
+    return run, None
+
+def bench_format_udp(n):
+    recs = records(n)
+    def run():
+        for record in recs:
+            udp_lines(record.sensors, str(record.id % 10))
+        return len(recs)
+    return run, None
+
+def bench_format_json(n):
+    recs = records(n)
+    def run():
+        for record in recs:                     # AmbientUploaderと同じ形式
+            d = ambient_data(record.sensors)
+            d['created'] = datetime.datetime.fromtimestamp(record.t).strftime(
+                '%Y-%m-%d %H:%M:%S.%f')[:-3]
+            json.dumps(d)
+        return len(recs)
+    return run, None
+
+def bench_format_console(n):
+    recs = records(n)
+    def run():
+        for record in recs:
+            '\n'.join(console_lines(record))
+        return len(recs)
+    return run, None
+
+def bench_pipeline(n):
+    # 受信した広告(半数はメダル以外)の判定・重複除去・デコード・配信
+    devs = list(islice(fleet(10, 1.0, others=10), n))
+    def run():
+        pipeline = Pipeline([])
+        for dev in devs:
+            pipeline.handle(dev)
+        return len(devs)
+    return run, None
+
+def feed(sink, recs):
+    for record in recs:
+        sink.queue.put(record)                  # 満杯の時は待つ(破棄しない)
+    sink.close()
+
+def in_tempdir(make):
+    # 一時フォルダで出力先を作成(センサ個別値のCSVも一時フォルダへ)
+    tmp = tempfile.mkdtemp(prefix='sm2bench')
+    cwd = os.getcwd()
+    os.chdir(tmp)
+    try:
+        sink = make(tmp)
+    finally:
+        os.chdir(cwd)
+    def done():
+        shutil.rmtree(tmp, ignore_errors=True)
+    return sink, tmp, done
+
+def bench_sink_csv(n):
+    recs = records(n)
+    sink, tmp, done = in_tempdir(lambda tmp: CsvSink(os.path.join(tmp, 'SensorMedal2.csv')))
+    def run():
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            feed(sink, recs)
+        finally:
+            os.chdir(cwd)
+        return sink.processed
+    return run, done
+
+def bench_sink_archive(n):
+    recs = records(n)
+    sink, tmp, done = in_tempdir(lambda tmp: ArchiveSink(os.path.join(tmp, 'SensorMedal2.sm2')))
+    def run():
+        feed(sink, recs)
+        return sink.processed
+    return run, done
+
+def bench_sink_raw(n):
+    recs = records(n)
+    sink, tmp, done = in_tempdir(
+        lambda tmp: RawRingSink(os.path.join(tmp, 'SensorMedal2.ring'), capacity=max(n, 1)))
+    def run():
+        feed(sink, recs)
+        return sink.processed
+    return run, done
+
+def bench_sink_sqlite(n):
+    recs = records(n)
+    sink, tmp, done = in_tempdir(lambda tmp: SqliteSink(os.path.join(tmp, 'SensorMedal2.db')))
+    def run():
+        feed(sink, recs)
+        return sink.db.written
+    return run, done
+
+def bench_sink_history(n):
+    recs = records(n)
+    sink = HistorySink()
+    def run():
+        feed(sink, recs)
+        return sink.processed
+    return run, None
+
+def bench_sink_udp(n):
+    recs = records(n)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # 受信側(読み捨て)
+    sock.bind(('127.0.0.1', 0))
+    sink = UdpSink('127.0.0.1', sock.getsockname()[1], pace=0, block=True,
+                   verbose=False)
+    def run():
+        feed(sink, recs)
+        return sink.processed
+    return run, sock.close
+
+class AmbientStandIn(http.server.BaseHTTPRequestHandler):
+    # Ambientの代わりに受信件数を数えて200を返す
+    protocol_version = 'HTTP/1.1'               # 接続を保持する
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.received += len(json.loads(body.decode())['data'])
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):       # アクセス毎の表示をしない
+        pass
+
+def bench_sink_ambient(n):
+    recs = records(n, medals=1, step=30)        # 送信間隔(30秒)毎のデータ
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), AmbientStandIn)
+    server.received = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    sink = AmbientSink(0, 'bench', url='http://127.0.0.1:%d' % server.server_port,
+                       min_interval=0, verbose=False)
+    def run():
+        feed(sink, recs)
+        return sink.uploader.sent
+    def done():
+        server.shutdown()
+        server.server_close()
+    return run, done
+
+# 項目名: (関数, フレーム数)
+BENCHES = {
+    'decode_hex': (bench_decode_hex, 20000),
+    'decode_bytes': (bench_decode_bytes, 20000),
+    'format_csv': (bench_format_csv, 10000),
+    'format_udp': (bench_format_udp, 10000),
+    'format_json': (bench_format_json, 10000),
+    'format_console': (bench_format_console, 10000),
+    'pipeline': (bench_pipeline, 20000),
+    'sink_csv': (bench_sink_csv, 5000),
+    'sink_udp': (bench_sink_udp, 2000),
+    'sink_ambient': (bench_sink_ambient, 2000),
+    'sink_archive': (bench_sink_archive, 5000),
+    'sink_history': (bench_sink_history, 5000),
+    'sink_raw': (bench_sink_raw, 5000),
+    'sink_sqlite': (bench_sink_sqlite, 5000),
+}
+
+def measure(bench, n):
+    # 速度(repeat回の最良値)とメモリ(1回)を測定
+    fps = 0
+    for i in range(repeat):
+        run, done = bench(n)
+        t = perf_counter()
+        frames = run()
+        fps = max(fps, frames / (perf_counter() - t))
+        if done:
+            done()
+    run, done = bench(n)
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    frames = run()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if done:
+        done()
+    return {'fps': fps, 'peak_kib': (peak - start) / 1024,
+            'kept_bpf': (current - start) / max(frames, 1)}
+
+def load_baseline(filename=None):
+    try:
+        with open(filename or baseline_file) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return None
+
+def save_baseline(results, filename=None):
+    with open(filename or baseline_file, 'w') as fp:
+        json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                   'results': results}, fp, indent=1)
+
+def main(args):
+    save = 'save' in args
+    names = [a for a in args if a != 'save']
+    for name in names:
+        if name not in BENCHES:
+            print('使用方法:', sys.argv[0], '[save] [項目名...]')
+            print('項目名:', ', '.join(BENCHES))
+            return 2
+    baseline = None if save else load_baseline()
+    if baseline and baseline.get('python') != platform.python_version():
+        print('基準値のPythonの版が異なります:', baseline.get('python'))
+    print('%-16s %10s %9s %9s %10s %6s' % ('bench', 'frames/s', 'peak KiB',
+                                          'kept B/f', 'baseline', 'ratio'))
+    results = dict()
+    slow = []
+    for name in names or BENCHES:
+        bench, n = BENCHES[name]
+        r = results[name] = measure(bench, n)
+        s = '%-16s %10.0f %9.1f %9.1f' % (name, r['fps'], r['peak_kib'], r['kept_bpf'])
+        base = baseline and baseline['results'].get(name)
+        if base:
+            ratio = r['fps'] / base['fps']
+            s += ' %10.0f %6.2f' % (base['fps'], ratio)
+            if ratio < 1 - threshold:
+                s += ' NG'
+                slow.append(name)
+        print(s)
+    if save:
+        if names:                               # 一部の項目のみ測定した時
+            old = load_baseline()
+            if old:
+                old['results'].update(results)
+                results = old['results']
+        save_baseline(results)
+        print('基準値を', baseline_file, 'へ保存しました')
+    elif baseline is None:
+        print('基準値がありません(save を付けて実行すると保存します)')
+    if slow:
+        print('速度が低下しました:', ', '.join(slow))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,156 @@
+# coding: utf-8
+
+################################################################################
+# 複数のAmbientチャネルへの振り分け送信
+# 多数のメダルのセンサ値を、設定に従って複数のAmbientチャネルのd1～d8へ割り当て、
+# チャネル毎の送信回数の上限を守りながら、できるだけ短い間隔で送信します。
+# 1つのプロセス(1つの受信処理)で、全てのメダルを送信できます。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   channels = [
+#       {'chid': '1234', 'wkey': '0123456789abcdef', 'fields': {
+#           'd1': (1, 'Temperature'), 'd2': (1, 'Humidity'),    # メダル1
+#           'd3': (2, 'Temperature'), 'd4': (2, 'Humidity')}},  # メダル2
+#       {'chid': '1235', 'wkey': 'fedcba9876543210', 'fields': {...}},
+#   ]
+#   または、メダルのIDとセンサ名から順に割り当て(1つのメダルは同じチャネルへ)
+#       channels = assign([('1234', '0123456789abcdef'), ('1235', 'fedcba9876543210')],
+#                         [1, 2, 3, 4, 5, 6], ('Temperature', 'Humidity'))
+#   scheduler = AmbientScheduler(channels)
+#   scheduler.add(record)                   # 受信毎
+#   scheduler.poll(record.t)                # 送信できるチャネルのデータを送信
+#
+#【送信回数の上限】
+#   Ambientはチャネル毎に1日daily_limit件(3,000件)まで、min_interval秒(5秒)以上の
+#   間隔でデータを受け付けます。各チャネルは、その日の残りの件数を残りの時間で
+#   割った間隔(最短min_interval秒)で送信します。通常は28.8秒毎に送信し、
+#   受信が無く送信しなかった時間があれば、その分だけ間隔を短くします。
+#   日付の区切りは、Raspberry Piのタイムゾーンの0時です。起動した日は、起動前に
+#   通常の間隔で送信していたものとして件数を数えます(再起動時に超えないため)。
+#   送信間隔内の値は aggregate('mean','min','max','last')で集計します。
+
+import datetime
+import os
+
+from .aggregate import Stat
+from .ambient import AmbientUploader
+from .metrics import METRICS
+
+FIELDS = ('d1', 'd2', 'd3', 'd4', 'd5', 'd6', 'd7', 'd8')
+
+def assign(channels, medals, sensors):
+    # [(チャネルID, ライトキー), ...] へ メダル毎のsensorsを順に割り当てた設定
+    if len(sensors) > len(FIELDS):
+        raise ValueError('too many sensors for one channel')
+    config = []
+    fields = None
+    for dev_id in medals:
+        if fields is None or len(fields) + len(sensors) > len(FIELDS):
+            if len(config) >= len(channels):
+                raise ValueError('not enough channels for ' + str(len(medals)) + ' medals')
+            chid, wkey = channels[len(config)]
+            fields = dict()
+            config.append({'chid': chid, 'wkey': wkey, 'fields': fields})
+        for sensor in sensors:
+            fields[FIELDS[len(fields)]] = (dev_id, sensor)
+    return config
+
+def midnight(day):
+    return datetime.datetime.combine(day, datetime.time()).timestamp()
+
+class Channel:
+    def __init__(self, chid, wkey, fields, daily_limit=3000, min_interval=5,
+                 spool=None, **uploader_args):
+        self.chid = chid
+        self.fields = fields                    # 'd1' -> (メダルのID, センサ名)
+        self.daily_limit = daily_limit          # 1日の送信件数の上限
+        self.min_interval = min_interval        # 送信の最小間隔(秒)
+        self.stats = dict((d, Stat()) for d in fields)  # 送信間隔内の集計
+        self.sent = None                        # 最後に送信した時刻
+        self.day_end = 0                        # その日の終わり(翌日0時)
+        self.used = 0                           # その日に送信した件数(推定を含む)
+        if spool:                               # チャネル毎の未送信データのファイル
+            base, ext = os.path.splitext(spool)
+            spool = base + '_' + str(chid) + ext
+        self.uploader = AmbientUploader(chid, wkey, min_interval=min_interval,
+                                        spool=spool, **uploader_args)
+        METRICS.gauge('ambient_points_today', lambda: self.used, channel=str(chid))
+
+    def due(self, t):
+        # 時刻tに送信できればTrue(送信する値が無い時はFalse)
+        if t >= self.day_end:                   # 起動時と日付が変わった時
+            day = datetime.date.fromtimestamp(t)
+            start = midnight(day)
+            self.day_end = midnight(day + datetime.timedelta(days=1))
+            self.used = int(self.daily_limit * (t - start) / (self.day_end - start))
+        remaining = self.daily_limit - self.used
+        if remaining <= 0 or not any(s.count for s in self.stats.values()):
+            return False
+        if self.sent is None:
+            return True
+        period = max((self.day_end - t) / remaining, self.min_interval)
+        return t - self.sent >= period
+
+    def send(self, t, how='mean'):
+        data = dict()
+        for d, s in self.stats.items():
+            if s.count:
+                data[d] = s.value(how)
+        self.stats = dict((d, Stat()) for d in self.fields)
+        self.uploader.send(data, t)
+        self.sent = t
+        self.used += 1
+
+    def get_state(self):                        # チェックポイント用
+        return {'stats': self.stats, 'sent': self.sent,
+                'day_end': self.day_end, 'used': self.used}
+
+    def set_state(self, state):
+        for d, s in state['stats'].items():
+            if d in self.stats:
+                self.stats[d] = s
+        self.sent = state['sent']
+        self.day_end = state['day_end']
+        self.used = state['used']
+
+class AmbientScheduler:
+    def __init__(self, channels, aggregate='mean', **channel_args):
+        self.aggregate = aggregate              # 送信間隔内の集計方法
+        self.channels = [Channel(c['chid'], c['wkey'], c['fields'], **channel_args)
+                         for c in channels]
+        self.routes = dict()                    # メダルのID -> [(Channel, 'dN', センサ名)]
+        for ch in self.channels:
+            for d, (dev_id, sensor) in ch.fields.items():
+                self.routes.setdefault(dev_id, []).append((ch, d, sensor))
+
+    def add(self, record):
+        for ch, d, sensor in self.routes.get(record.id, ()):
+            value = record.sensors.get(sensor)
+            if isinstance(value, str):          # Magnetic等の16進文字列
+                value = int(value, 16)
+            if value is not None:
+                ch.stats[d].add(value, record.t)
+
+    def poll(self, t):
+        # 送信できるチャネルのデータを送信し、送信したチャネル数を返す
+        n = 0
+        for ch in self.channels:
+            if ch.due(t):
+                ch.send(t, self.aggregate)
+                n += 1
+        return n
+
+    def flush(self, timeout=None):              # 未送信データが無くなるまで待つ
+        for ch in self.channels:
+            ch.uploader.flush(timeout)
+
+    def get_state(self):
+        return dict((ch.chid, ch.get_state()) for ch in self.channels)
+
+    def set_state(self, state):
+        for ch in self.channels:
+            if ch.chid in state:
+                ch.set_state(state[ch.chid])
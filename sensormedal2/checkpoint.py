@@ -0,0 +1,141 @@
+# coding: utf-8
+
+################################################################################
+# 動作状態の保存と復元(チェックポイント)
+# メダル毎の最新値・重複受信の記録・出力待ちのデータ・集計途中の値を一定間隔で
+# ファイルへ保存し、再起動時に復元します。再起動の前後で重複や欠落を防ぎます。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   checkpoint = Checkpoint('SensorMedal2.state', pipeline, interval=30)
+#   checkpoint.load()                       # 前回の状態を復元(ファイルが無ければ何もしない)
+#   checkpoint.start()                      # 30秒毎に保存
+#   ...
+#   pipeline.close()
+#   checkpoint.save()                       # 終了時に保存
+#
+#【保存方法】
+#   一時ファイルへ書き込んでから名前を変更するので、書き込み中に電源が切れても
+#   前回のファイルが残ります。形式はJSONです。タプル・文字列以外のキーの辞書・
+#   Record・Statは印を付けた辞書で保存します(それ以外の型は復元しません)。
+#   sudoで実行する時に他の利用者が書き換えた状態を読まないよう、実行中の
+#   利用者(root)が所有していないファイルやシンボリックリンクは読み込みません。
+
+import json
+import os
+import tempfile
+import threading
+from time import sleep, time
+
+from .aggregate import Stat
+from .pipeline import Record
+
+VERSION = 2
+
+def encode(obj):
+    # JSONで表せない値を印付きの辞書へ変換
+    if isinstance(obj, dict):
+        if all(isinstance(k, str) for k in obj):
+            return dict((k, encode(v)) for k, v in obj.items())
+        return {'__items__': [[encode(k), encode(v)] for k, v in obj.items()]}
+    if isinstance(obj, tuple):
+        return {'__tuple__': [encode(v) for v in obj]}
+    if isinstance(obj, list):
+        return [encode(v) for v in obj]
+    if isinstance(obj, Record):
+        return {'__record__': [obj.t, obj.addr, obj.rssi, obj.payload, encode(obj.sensors)]}
+    if isinstance(obj, Stat):
+        return {'__stat__': [getattr(obj, k) for k in Stat.__slots__]}
+    return obj
+
+def decode(d):
+    # json.loadのobject_hook(encodeの逆変換)
+    if '__items__' in d:
+        return dict((hashable(k), v) for k, v in d['__items__'])
+    if '__tuple__' in d:
+        return tuple(d['__tuple__'])
+    if '__record__' in d:
+        return Record(*d['__record__'])
+    if '__stat__' in d:
+        stat = Stat()
+        for k, v in zip(Stat.__slots__, d['__stat__']):
+            setattr(stat, k, v)
+        return stat
+    return d
+
+def hashable(k):                                # 辞書のキーに使えるように
+    return tuple(hashable(v) for v in k) if isinstance(k, (list, tuple)) else k
+
+class Checkpoint:
+    def __init__(self, filename, pipeline, interval=30, max_age=86400):
+        self.filename = filename
+        self.pipeline = pipeline
+        self.interval = interval                # 保存間隔(秒)
+        self.max_age = max_age                  # これより古い状態は復元しない(秒)
+        self.saved = 0                          # 保存した回数
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name='checkpoint', daemon=True)
+
+    def load(self):
+        try:
+            fd = os.open(self.filename, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+        except FileNotFoundError:
+            return False
+        except OSError as e:                    # シンボリックリンク等
+            print('checkpoint', e)
+            return False
+        try:
+            with os.fdopen(fd, 'r') as fp:
+                if os.fstat(fp.fileno()).st_uid != os.geteuid():
+                    print('checkpoint', self.filename, 'is not owned by this user')
+                    return False
+                state = json.load(fp, object_hook=decode)
+        except Exception as e:                  # 壊れたファイルや旧版の形式
+            print('checkpoint', e)
+            return False
+        if not isinstance(state, dict) or state.get('version') != VERSION \
+                or time() - state['t'] > self.max_age:
+            return False
+        self.pipeline.set_state(state['pipeline'])
+        return True
+
+    def save(self):
+        for retry in range(3):
+            try:
+                state = {'version': VERSION, 't': time(),
+                         'pipeline': self.pipeline.get_state()}
+                break
+            except RuntimeError:                # 取得中に受信処理が変更した時
+                continue
+        else:
+            return False
+        data = json.dumps(encode(state))
+        with self.lock:
+            # 一時ファイルは毎回新しく作成(既存のファイルやリンクを開かない)
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.filename) + '.',
+                                       suffix='.tmp',
+                                       dir=os.path.dirname(self.filename) or '.')
+            try:
+                with os.fdopen(fd, 'w') as fp:
+                    fp.write(data)
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                os.replace(tmp, self.filename)  # 置き換え(アトミック)
+            except BaseException:
+                os.remove(tmp)
+                raise
+            self.saved += 1
+        return True
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while True:
+            sleep(self.interval)
+            try:
+                self.save()
+            except Exception as e:              # 例外処理発生時
+                print('checkpoint', e)
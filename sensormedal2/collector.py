@@ -0,0 +1,266 @@
+# coding: utf-8
+
+################################################################################
+# UDP受信・保存(複数のゲートウェイからの受信データを集約)
+# ble_logger_SensorMedal2_udp_tx.py 等が送信する illum_N, envir_N, accem_N,
+# medal_N のデータを受信し、複数のゲートウェイが同じ受信データを送信した時は
+# 1件にまとめて(RSSIの最も強いゲートウェイを記録)、まとめてCSVへ保存します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   受信してCSVファイルへ保存(既定はポート1024, SensorMedal2_udp.csv)
+#       python3 -m sensormedal2.collector [ポート番号] [ファイル名]
+#   ループバックで動作確認(擬似ゲートウェイ3台・メダル10個・100回分を送信)
+#       python3 -m sensormedal2.collector test [ゲートウェイ数] [メダル数] [回数] [件/秒]
+#   プログラムから
+#       collector = await start(1024, write=csv_write('SensorMedal2_udp.csv'))
+#       ...
+#       await collector.close()
+#
+#【保存形式】
+#   日時, デバイス名, RSSI, ゲートウェイ, ゲートウェイ数, 値...
+#       2019/12/01 12:34:56, envir_3, -58, 192.168.0.12, 2, 23.4, 45.0, 1013.0
+#   ゲートウェイは送信元のIPアドレスです(送信毎や再起動で変わるポート番号は
+#   使いません)。
+#   RSSIは medal_N の値です。その他のデータは、同じゲートウェイが window秒以内に
+#   送信した同じ番号の medal_N のRSSIです(不明な時は空欄)。
+#
+#【重複の判定】
+#   デバイス名と値が同じデータを window秒以内に別のゲートウェイから受信した時は
+#   同じ受信データとします(送信データにSEQが無いため)。同じゲートウェイから
+#   再び受信した時は、値が同じでも新しい受信データとします。
+
+import asyncio
+import datetime
+import random
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, time
+
+from .csvwriter import CsvWriter
+from .frame import SensorMedal2Frame
+from .metrics import METRICS
+from .replay import medal_payload
+from .sinks import udp_lines
+
+rcvbuf = 4 << 20                                # 受信バッファ(バイト)
+VALUES = {1: 'illum', 3: 'envir/accem', 6: 'medal'}  # 値の数(RSSIを含む)
+
+class Reading:
+    __slots__ = ('t', 'device', 'values', 'rssi', 'gateway', 'gateways')
+
+    def __init__(self, t, device, values, rssi, gateway):
+        self.t = t                              # 最初に受信した時刻
+        self.device = device                    # 'envir_3' 等(バイト列)
+        self.values = values                    # 値(バイト列のタプル)
+        self.rssi = rssi
+        self.gateway = gateway                  # RSSIの最も強いゲートウェイ
+        self.gateways = [gateway]               # 受信したゲートウェイ
+
+    def line(self):
+        return ', '.join([
+            datetime.datetime.fromtimestamp(self.t).strftime('%Y/%m/%d %H:%M:%S'),
+            self.device.decode(), '' if self.rssi is None else str(self.rssi),
+            self.gateway, str(len(self.gateways))] + [v.decode() for v in self.values])
+
+class Collector(asyncio.DatagramProtocol):
+    def __init__(self, write=None, window=3.0, max_pending=100000):
+        self.write = write                      # 保存する関数(行のリストを渡す)
+        self.window = window                    # 重複と判定する時間(秒)
+        self.max_pending = max_pending          # 保存待ちの最大数
+        self.pending = dict()                   # (デバイス名, 値) -> Reading(受信順)
+        self.links = dict()                     # (ゲートウェイ, 番号) -> (RSSI, 時刻)
+        self.ready = []                         # 保存するReading
+        self.executor = ThreadPoolExecutor(1)   # 保存用(書き込みの順序を保つ)
+        self.transport = None
+        self.task = None
+        self.datagrams = 0                      # 受信したパケット数
+        self.lines = 0                          # 受信したデータ数
+        self.duplicates = 0                     # 別のゲートウェイからの重複
+        self.errors = 0                         # 形式の誤り
+        self.written = 0                        # 保存した受信データ数
+        for k in ('datagrams', 'lines', 'duplicates', 'errors', 'written'):
+            METRICS.gauge('collector_' + k, lambda k=k: getattr(self, k))
+        METRICS.gauge('queue_depth', lambda: len(self.pending), queue='collector')
+
+    def connection_made(self, transport):
+        self.transport = transport
+        try:                                    # 多数のゲートウェイからの集中に備える
+            transport.get_extra_info('socket').setsockopt(
+                socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        except OSError:
+            pass
+
+    def datagram_received(self, data, addr):
+        self.datagrams += 1
+        t = time()
+        gateway = addr[0]                       # 送信元のポート番号は送信毎に変わる
+        for line in data.split(b'\n'):          # まとめ送信(coalesce)にも対応
+            if line:
+                self.receive(line.strip(), gateway, t)
+
+    def receive(self, line, gateway, t):
+        self.lines += 1
+        fields = line.split(b',')
+        device = fields[0]
+        i = device.find(b'_')
+        if i < 1 or len(fields) - 1 not in VALUES:
+            self.errors += 1
+            return
+        link = (gateway, device[i + 1:])        # ゲートウェイとデバイス番号
+        values = tuple(fields[1:])
+        if len(values) == 6:                    # medal_N の最後はRSSI
+            try:
+                rssi = int(values[-1])
+            except ValueError:
+                self.errors += 1
+                return
+            values = values[:-1]
+            if len(self.links) > 4096:
+                self.links.clear()
+            self.links[link] = (rssi, t)
+        else:
+            rssi = None
+            lt = self.links.get(link)
+            if lt is not None and t - lt[1] <= self.window:
+                rssi = lt[0]                    # 古いRSSIは使わない
+        key = (device, values)
+        r = self.pending.get(key)
+        if r is not None:
+            if gateway not in r.gateways:       # 別のゲートウェイからの重複
+                self.duplicates += 1
+                r.gateways.append(gateway)
+                if rssi is not None and (r.rssi is None or rssi > r.rssi):
+                    r.rssi = rssi
+                    r.gateway = gateway
+                return
+            self.ready.append(self.pending.pop(key))  # 同じゲートウェイの次の受信
+        try:
+            for v in values:                    # 新しい受信データのみ確認
+                float(v)
+        except ValueError:
+            self.errors += 1
+            return
+        self.pending[key] = Reading(t, device, values, rssi, gateway)
+        if len(self.pending) > self.max_pending:
+            self.ready.append(self.pending.pop(next(iter(self.pending))))
+
+    def take(self, before):
+        # before以前に受信した保存待ちのReadingを取り出す
+        ready = self.ready
+        self.ready = []
+        pending = self.pending
+        while pending:
+            key = next(iter(pending))           # 受信順なので古いものから
+            if pending[key].t > before:
+                break
+            ready.append(pending.pop(key))
+        return ready
+
+    async def flush(self, force=False):
+        ready = self.take(float('inf') if force else time() - self.window)
+        if not ready:
+            return
+        lines = [r.line() for r in ready]
+        if self.write is not None:              # 受信処理を止めずに保存
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.write, lines)
+        self.written += len(lines)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.window / 2)
+            try:
+                await self.flush()
+            except Exception as e:              # 例外処理発生時
+                print('collector', e)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        if self.transport is not None:
+            self.transport.close()
+        await self.flush(force=True)
+        self.executor.shutdown()
+
+def csv_write(filename='SensorMedal2_udp.csv', username=None):
+    # 行のリストをまとめてCSVファイルへ書き込む関数
+    writer = CsvWriter(username, flush_lines=1 << 30, flush_interval=float('inf'))
+    def write(lines):
+        for s in lines:
+            writer.write(filename, s)
+        writer.flush()
+    return write
+
+async def start(port=1024, addr='0.0.0.0', **collector_args):
+    loop = asyncio.get_running_loop()
+    transport, collector = await loop.create_datagram_endpoint(
+        lambda: Collector(**collector_args), local_addr=(addr, port))
+    collector.task = loop.create_task(collector.run())
+    return collector
+
+async def simulate(port, gateways=3, medals=10, frames=100, addr='127.0.0.1',
+                   loss=0.1, rate=10000, seed=1):
+    # 擬似ゲートウェイ gateways台が、同じメダルの受信データを送信
+    #   loss: 受信できない割合  rate: 全ゲートウェイの合計の送信数(件/秒)
+    #   各ゲートウェイは別のIPアドレス(127.0.0.2～)から送信
+    rnd = random.Random(seed)
+    socks = []
+    for g in range(gateways):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.%d' % (g + 2), 0))
+        socks.append(sock)
+    start = time()
+    t0 = perf_counter()
+    sent = 0
+    for f in range(frames):
+        for m in range(medals):
+            sensors = SensorMedal2Frame.from_hex(medal_payload(m + 1, f, start + f)).sensors()
+            for g, sock in enumerate(socks):
+                if rnd.random() < loss:
+                    continue
+                sensors['RSSI'] = -50 - 5 * g + rnd.randint(-3, 3)
+                for s in udp_lines(sensors, str((m + 1) % 10)):
+                    sock.sendto((s + '\n').encode(), (addr, port))
+                    sent += 1
+            wait = t0 + sent / rate - perf_counter()
+            await asyncio.sleep(max(wait, 0))   # 受信側を動作させる
+    for sock in socks:
+        sock.close()
+    return sent
+
+async def test(gateways=3, medals=10, frames=100, rate=10000):
+    written = []
+    collector = await start(0, '127.0.0.1', write=written.extend, window=0.5)
+    port = collector.transport.get_extra_info('sockname')[1]
+    t = perf_counter()
+    sent = await simulate(port, gateways, medals, frames, rate=rate)
+    await asyncio.sleep(0.1)
+    await collector.close()
+    t = perf_counter() - t
+    print('送信:', sent, ' 受信:', collector.lines, ' 重複:', collector.duplicates,
+          ' 保存:', collector.written, ' 誤り:', collector.errors)
+    print('%.0f 件/秒' % (collector.lines / t))
+    for s in written[:4]:
+        print(s)
+    return sent == collector.lines == collector.written + collector.duplicates
+
+async def main(port=1024, filename='SensorMedal2_udp.csv'):
+    collector = await start(port, write=csv_write(filename))
+    print('UDP', port, 'で受信中 ->', filename)
+    try:
+        await asyncio.Event().wait()            # 終了(Ctrl-C)まで受信
+    finally:
+        await collector.close()
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args and args[0] == 'test':
+        ok = asyncio.run(test(*[int(a) for a in args[1:5]]))
+        sys.exit(0 if ok else 1)
+    try:
+        asyncio.run(main(int(args[0]) if args else 1024, *args[1:2]))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,332 @@
+# coding: utf-8
+
+################################################################################
+# 保存済みCSVファイルの変換と集計
+# ble_logger_SensorMedal2_save.py が保存した SensorMedal2.csv や Temperature.csv
+# 等を少しずつ読み込み、列形式アーカイブへの変換や日毎の集計を行います。
+# 大きなファイルは範囲に分け、複数のプロセスで同時に処理します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   アーカイブ(sensormedal2/archive.py の形式)へ変換
+#       python3 -m sensormedal2.csvtool convert SensorMedal2.csv SensorMedal2.sm2
+#   メダル毎・日毎の最小・最大・平均(CSV形式で表示)
+#       python3 -m sensormedal2.csvtool stats SensorMedal2.csv [day|hour] [センサ名]
+#       python3 -m sensormedal2.csvtool stats Temperature.csv Humidity.csv
+#       python3 -m sensormedal2.csvtool stats SensorMedal2.sm2
+#   受信が途絶えた期間(既定は600秒以上)
+#       python3 -m sensormedal2.csvtool gaps SensorMedal2.csv [秒数]
+#
+#【メモ】
+#   ・メモリの使用量はファイルの大きさに依らず、chunk_size程度です。
+#   ・センサ個別値のファイル(Temperature.csv等)にはメダルのIDが無いため、
+#     集計のみに対応します(IDは '-' と表示します)。
+#   ・旧版のロガーは加速度と地磁気の負の値を正しく保存していませんでした。
+#     変換時・集計時は16ビットの符号付き整数として補正します(fix_signed)。
+
+import datetime
+import multiprocessing
+import os
+import sys
+import tempfile
+
+from .aggregate import Stat
+from .archive import ArchiveReader, ArchiveWriter
+
+# SensorMedal2.csv の列(日時, 'SensorMedal2', ID, SEQ の後)
+CSV_FIELDS = ('Temperature', 'Humidity', 'Pressure', 'Illuminance',
+              'Accelerometer', 'Accelerometer X', 'Accelerometer Y', 'Accelerometer Z',
+              'Geomagnetic', 'Geomagnetic X', 'Geomagnetic Y', 'Geomagnetic Z',
+              'Magnetic', 'Steps', 'Battery Level', 'RSSI')
+
+# センサ個別値のファイルの列
+SENSOR_FIELDS = {
+    'Accelerometer': ('Accelerometer', 'Accelerometer X', 'Accelerometer Y', 'Accelerometer Z'),
+    'Geomagnetic': ('Geomagnetic', 'Geomagnetic X', 'Geomagnetic Y', 'Geomagnetic Z'),
+}
+
+# 旧版のロガーが符号無しで保存した列と換算係数(3軸の合成値の列)
+SIGNED_FIELDS = {
+    'Accelerometer': (4096, ('Accelerometer X', 'Accelerometer Y', 'Accelerometer Z')),
+    'Geomagnetic': (10, ('Geomagnetic X', 'Geomagnetic Y', 'Geomagnetic Z')),
+}
+
+# アーカイブの列名とCSVの列名の対応
+ARCHIVE_FIELDS = {
+    'temperature': 'Temperature', 'humidity': 'Humidity', 'pressure': 'Pressure',
+    'illuminance': 'Illuminance', 'accel_x': 'Accelerometer X',
+    'accel_y': 'Accelerometer Y', 'accel_z': 'Accelerometer Z',
+    'geo_x': 'Geomagnetic X', 'geo_y': 'Geomagnetic Y', 'geo_z': 'Geomagnetic Z',
+    'magnetic': 'Magnetic', 'steps': 'Steps', 'battery': 'Battery Level',
+    'rssi': 'RSSI',
+}
+
+chunk_size = 1 << 20                            # 1回に読み込む大きさ(バイト)
+split_size = 64 << 20                           # 1プロセスで処理する大きさ(バイト)
+
+def split(filename, size=None):
+    # ファイルを行の境界で (開始, 終了) の範囲に分ける
+    if size is None:
+        size = split_size
+    total = os.path.getsize(filename)
+    ranges = []
+    start = 0
+    with open(filename, 'rb') as fp:
+        while start < total:
+            end = start + size
+            if end < total:
+                fp.seek(end)
+                fp.readline()                   # 行の途中で分けない
+                end = fp.tell()
+            else:
+                end = total
+            ranges.append((filename, start, end))
+            start = end
+    return ranges
+
+def read_lines(filename, start, end):
+    # 範囲内の行をchunk_size毎のリストで返す
+    with open(filename, 'rb') as fp:
+        fp.seek(start)
+        rest = b''
+        pos = start
+        while pos < end:
+            buf = fp.read(min(chunk_size, end - pos))
+            if not buf:
+                break
+            pos += len(buf)
+            buf = rest + buf
+            i = buf.rfind(b'\n') + 1
+            rest = buf[i:]
+            yield buf[:i].decode(errors='replace').splitlines()
+        if rest:
+            yield [rest.decode(errors='replace')]
+
+class Clock:
+    # 'YYYY/MM/DD HH:MM' -> UNIX時刻 (同じ分の行が続くので結果を再利用)
+    def __init__(self):
+        self.s = None
+        self.t = None
+
+    def __call__(self, s):
+        if s != self.s:
+            self.t = datetime.datetime.strptime(s, '%Y/%m/%d %H:%M').timestamp()
+            self.s = s
+        return self.t
+
+def rows(filename, start, end):
+    # 1行毎に (日時の文字列, ID, SEQ, {列名: 値}) を返す
+    for lines in read_lines(filename, start, end):
+        for line in lines:
+            cols = line.split(',')
+            if len(cols) < 3:
+                continue
+            try:
+                kind = cols[1].strip()
+                if kind == 'SensorMedal2':
+                    if len(cols) < 4 + len(CSV_FIELDS):
+                        continue
+                    values = dict(zip(CSV_FIELDS, map(float, cols[4:4 + len(CSV_FIELDS)])))
+                    yield cols[0].strip(), int(cols[2]), int(cols[3]), fix_signed(values)
+                else:
+                    fields = SENSOR_FIELDS.get(kind, (kind,))
+                    values = dict(zip(fields, map(float, cols[2:2 + len(fields)])))
+                    yield cols[0].strip(), None, None, fix_signed(values)
+            except ValueError:                  # 書き込み途中の行など
+                continue
+
+def signed16(v):
+    v &= 0xFFFF
+    return v - 0x10000 if v >= 0x8000 else v
+
+def fix_signed(values):
+    # 加速度・地磁気の3軸を16ビットの符号付き整数として補正し、合成値を再計算
+    for total, (scale, axes) in SIGNED_FIELDS.items():
+        if axes[0] not in values:
+            continue
+        for key in axes:
+            values[key] = signed16(round(values[key] * scale)) / scale
+        values[total] = sum(values[key] ** 2 for key in axes) ** 0.5
+    return values
+
+def clamp(v, lo, hi):
+    return lo if v < lo else hi if v > hi else v
+
+def raw_row(seq, values):
+    # CSVの値 -> アーカイブの保存値(COLUMNSの順)
+    return (clamp(round((values['Temperature'] + 45) * 65536 / 175), 0, 0xFFFF),
+            clamp(round(values['Humidity'] * 65536 / 100), 0, 0xFFFF),
+            seq & 0xFF, 0,
+            signed16(round(values['Accelerometer X'] * 4096)),
+            signed16(round(values['Accelerometer Y'] * 4096)),
+            signed16(round(values['Accelerometer Z'] * 4096)),
+            signed16(round(values['Geomagnetic X'] * 10)),
+            signed16(round(values['Geomagnetic Y'] * 10)),
+            signed16(round(values['Geomagnetic Z'] * 10)),
+            clamp(round(values['Pressure'] * 2048), 0, 0xFFFFFF),
+            clamp(round(values['Illuminance'] * 1.2), 0, 0xFFFF),
+            int(values['Magnetic']) & 0xFF, int(values['Steps']) & 0xFFFF,
+            clamp(int(values['Battery Level']), 0, 0xFF),
+            clamp(int(values['RSSI']), -128, 127))
+
+def convert_range(args):
+    # 範囲を一時ファイルへ変換してファイル名と件数を返す
+    filename, start, end, tmpdir = args
+    fd, part = tempfile.mkstemp(suffix='.sm2', dir=tmpdir)
+    os.close(fd)
+    writer = ArchiveWriter(part, block_size=1024, block_age=86400)
+    clock = Clock()
+    n = 0
+    for date, dev_id, seq, values in rows(filename, start, end):
+        if dev_id is None:
+            continue
+        writer.append_values(clock(date), dev_id, raw_row(seq, values))
+        n += 1
+    writer.close()
+    return part, n
+
+def convert(filenames, output, processes=None):
+    tmpdir = os.path.dirname(os.path.abspath(output))
+    tasks = [r + (tmpdir,) for f in filenames for r in split(f)]
+    total = 0
+    with multiprocessing.Pool(processes) as pool, open(output, 'ab') as out:
+        for part, n in pool.imap(convert_range, tasks):  # 入力の順に連結
+            with open(part, 'rb') as fp:
+                while True:
+                    buf = fp.read(chunk_size)
+                    if not buf:
+                        break
+                    out.write(buf)
+            os.remove(part)
+            total += n
+    return total
+
+def period(date, by):
+    # 日時の文字列から集計単位の文字列を作成
+    return date[:10] if by == 'day' else date[:13] + ':00'
+
+def stats_range(args):
+    filename, start, end, by, fields = args
+    stats = dict()                              # (ID, 期間, 列名) -> Stat
+    clock = Clock()
+    for date, dev_id, seq, values in rows(filename, start, end):
+        t = clock(date)
+        p = period(date, by)
+        for key, v in values.items():
+            if fields and key not in fields:
+                continue
+            k = (dev_id, p, key)
+            s = stats.get(k)
+            if s is None:
+                s = stats[k] = Stat()
+            s.add(v, t)
+    return stats
+
+def stats_archive(filename, by, fields):
+    reader = ArchiveReader(filename)
+    stats = dict()
+    names = dict((v, k) for k, v in ARCHIVE_FIELDS.items())
+    columns = [names[f] for f in (fields or ARCHIVE_FIELDS.values()) if f in names]
+    for b in reader.blocks():
+        data = reader.read_block(b, columns)
+        for j, t in enumerate(data['time']):
+            p = period(datetime.datetime.fromtimestamp(t).strftime('%Y/%m/%d %H:%M'), by)
+            for name in columns:
+                k = (b[0], p, ARCHIVE_FIELDS[name])
+                s = stats.get(k)
+                if s is None:
+                    s = stats[k] = Stat()
+                s.add(data[name][j], t)
+    reader.close()
+    return stats
+
+def stats(filenames, by='day', fields=None, processes=None):
+    result = dict()
+    tasks = []
+    for f in filenames:
+        if f.endswith('.sm2'):
+            merge_stats(result, stats_archive(f, by, fields))
+        else:
+            tasks += [r + (by, fields) for r in split(f)]
+    if tasks:
+        with multiprocessing.Pool(processes) as pool:
+            for s in pool.imap_unordered(stats_range, tasks):
+                merge_stats(result, s)
+    return result
+
+def merge_stats(result, stats):
+    for k, s in stats.items():
+        r = result.get(k)
+        if r is None:
+            result[k] = s
+        else:
+            r.merge(s)
+
+def gaps_range(args):
+    # メダル毎の [最初の時刻, 最後の時刻, [(途絶えた時刻, 再開した時刻), ...]]
+    filename, start, end, min_gap = args
+    devices = dict()
+    clock = Clock()
+    for date, dev_id, seq, values in rows(filename, start, end):
+        t = clock(date)
+        d = devices.get(dev_id)
+        if d is None:
+            devices[dev_id] = [t, t, []]
+            continue
+        if t - d[1] >= min_gap:
+            d[2].append((d[1], t))
+        d[1] = t
+    return devices
+
+def gaps(filename, min_gap=600, processes=None):
+    # ファイルは時刻順に記録されていること
+    result = dict()
+    with multiprocessing.Pool(processes) as pool:
+        for devices in pool.imap(gaps_range, [r + (min_gap,) for r in split(filename)]):
+            for dev_id, (first, last, g) in devices.items():
+                d = result.get(dev_id)
+                if d is None:
+                    result[dev_id] = [first, last, g]
+                    continue
+                if first - d[1] >= min_gap:     # 範囲の境界をまたぐ途絶
+                    d[2].append((d[1], first))
+                d[1] = last
+                d[2] += g
+    return result
+
+def timestr(t):
+    return datetime.datetime.fromtimestamp(t).strftime('%Y/%m/%d %H:%M')
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ('convert', 'stats', 'gaps'):
+        print('使用方法:', sys.argv[0], 'convert CSVファイル... 出力ファイル')
+        print('         ', sys.argv[0], 'stats ファイル... [day|hour] [センサ名]')
+        print('         ', sys.argv[0], 'gaps CSVファイル [秒数]')
+        exit()
+    cmd, args = sys.argv[1], sys.argv[2:]
+    if cmd == 'convert':
+        if len(args) < 2:
+            print('出力ファイル名を指定してください')
+            exit()
+        n = convert(args[:-1], args[-1])
+        print(n, '件を', args[-1], 'へ変換しました')
+    elif cmd == 'stats':
+        files = [a for a in args if os.path.exists(a)]
+        opts = [a for a in args if not os.path.exists(a)]
+        by = 'hour' if 'hour' in opts else 'day'
+        fields = [a for a in opts if a not in ('day', 'hour')] or None
+        print('period, ID, sensor, count, min, max, mean')
+        for (dev_id, p, key), s in sorted(stats(files, by, fields).items(),
+                                          key=lambda i: (str(i[0][0]), i[0][1], i[0][2])):
+            print('%s, %s, %s, %d, %s, %s, %s' % (p, '-' if dev_id is None else dev_id,
+                                                  key, s.count, s.min, s.max, s.mean()))
+    else:
+        min_gap = float(args[1]) if len(args) >= 2 else 600
+        print('ID, from, to, seconds')
+        for dev_id, (first, last, g) in sorted(gaps(args[0], min_gap).items(),
+                                               key=lambda i: str(i[0])):
+            for t0, t1 in g:
+                print('%s, %s, %s, %d' % ('-' if dev_id is None else dev_id,
+                                          timestr(t0), timestr(t1), t1 - t0))
@@ -0,0 +1,138 @@
+# coding: utf-8
+
+################################################################################
+# CSVファイルへの書き込み(バッファ付き)
+# ファイルを開いたままにして、複数行をまとめて書き込みます。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   writer = CsvWriter(username='pi')
+#   writer.write('SensorMedal2.csv', s)     # 改行は自動で付与
+#   writer.close()                          # 終了時に必ず実行(未書込の行を書き込む)
+#
+#【書き込みの条件】
+#   flush_lines行たまるか、前回の書き込みからflush_interval秒が経過した時に
+#   まとめて書き込みます。fsync=Trueのときは書き込み毎にSDカードへ同期します。
+#   書き込む行が無い時も、tick()を定期的に呼ぶとflush_interval秒毎に書き込みます。
+#
+#【ファイルの切り替え】
+#   rotate='day'  日付が変わった時に 名前_YYYYMMDD.csv へ改名
+#                 (日付が変わる前の行は、改名する前のファイルへ書き込みます)
+#   max_bytes     ファイルサイズが超えた時に 名前_YYYYMMDD_HHMMSS.csv へ改名
+
+import datetime
+import os
+from shutil import chown
+from time import monotonic
+
+from .metrics import METRICS
+
+class CsvWriter:
+    def __init__(self, username=None, flush_lines=64, flush_interval=10,
+                 fsync=False, rotate=None, max_bytes=0):
+        self.username = username                # ファイルの所有者名
+        self.flush_lines = flush_lines
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.rotate = rotate
+        self.max_bytes = max_bytes
+        self.files = dict()                     # ファイル名毎の[fp, 日付, 容量]
+        self.lines = dict()                     # ファイル名毎の未書込の行
+        self.pending = 0                        # 未書込の行数
+        self.flushed = monotonic()
+        self.day = datetime.date.today()        # 未書込の行の日付
+
+    def open(self, filename):
+        new = not os.path.exists(filename)
+        try:
+            fp = open(filename, mode='a')       # 書込用ファイルを開く
+        except Exception as e:                  # 例外処理発生時
+            print(e)                            # エラー内容を表示
+            return None
+        if new and self.username:               # 作成時のみ所有者を変更
+            try:
+                chown(filename, self.username, self.username)
+            except Exception as e:
+                print(e)
+        self.files[filename] = [fp, datetime.date.today(), fp.tell()]
+        return self.files[filename]
+
+    def rotated_name(self, filename, date):
+        base, ext = os.path.splitext(filename)
+        if self.rotate == 'day':
+            name = base + date.strftime('_%Y%m%d')
+        else:
+            name = base + datetime.datetime.now().strftime('_%Y%m%d_%H%M%S')
+        i = 1
+        rotated = name + ext
+        while os.path.exists(rotated):          # 同名のファイルは上書きしない
+            rotated = name + '_' + str(i) + ext
+            i += 1
+        return rotated
+
+    def check_rotate(self, filename, f):
+        if (self.rotate == 'day' and f[1] != datetime.date.today()) \
+                or (self.max_bytes and f[2] >= self.max_bytes):
+            f[0].close()
+            del self.files[filename]
+            try:
+                os.rename(filename, self.rotated_name(filename, f[1]))
+            except Exception as e:
+                print(e)
+            return self.open(filename)
+        return f
+
+    def check_day(self):
+        # 日付が変わる前の行を、ファイルを切り替える前に書き込む
+        if self.rotate != 'day':
+            return
+        today = datetime.date.today()
+        if today != self.day:
+            if self.pending:
+                self.write_lines(rotate=False)
+                self.pending = 0
+            self.day = today
+
+    def write(self, filename, data):
+        self.check_day()
+        self.lines.setdefault(filename, []).append(data + '\n')
+        self.pending += 1
+        if self.pending >= self.flush_lines \
+                or monotonic() - self.flushed >= self.flush_interval:
+            self.flush()
+
+    def tick(self):                             # 定期的に呼ぶ(書き込む行が無い時用)
+        if self.pending and monotonic() - self.flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.check_day()
+        with METRICS.timer('csv_flush_seconds'):
+            self.write_lines()
+        self.pending = 0
+        self.flushed = monotonic()
+
+    def write_lines(self, rotate=True):
+        for filename, lines in self.lines.items():
+            if not lines:
+                continue
+            s = ''.join(lines)
+            lines.clear()
+            f = self.files.get(filename) or self.open(filename)
+            if f is not None and rotate and (self.rotate or self.max_bytes):
+                f = self.check_rotate(filename, f)
+            if f is None:
+                continue
+            f[0].write(s)                       # まとめてファイルへ書き込む
+            f[0].flush()
+            if self.fsync:
+                os.fsync(f[0].fileno())
+            f[2] += len(s.encode())
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f[0].close()                        # ファイルを閉じる
+        self.files.clear()
@@ -0,0 +1,70 @@
+# coding: utf-8
+
+################################################################################
+# メダル毎の最新値を一覧表示(一定間隔で画面を書き換え)
+# 受信処理とは別のスレッドで表示するので、表示が遅くても受信は止まりません。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   dashboard = Dashboard(pipeline.medals, refresh=1)
+#   dashboard.start()
+#
+#   端末以外(nohupやファイルへのリダイレクト)へ出力するときは表示しません。
+
+import sys
+import threading
+from datetime import datetime
+from time import sleep, time
+
+HEAD = '  ID  Address            SEQ   Temp  Humid  Pressure   Illum  Accel  Batt  RSSI    Age  Count'
+LINE = '%4d  %-17s  %3d  %5.1f  %5.1f  %8.2f  %6.1f  %5.2f  %3d%%  %4d  %5.0f  %5d'
+
+def render(table, now=None, stats=None):
+    if now is None:
+        now = time()
+    lines = ['BLE Logger for Rohm SensorMedal-EVK-002   %s   medals: %d'
+             % (timestr(now), len(table)), '', HEAD]
+    for state in sorted(table, key=lambda s: (s.id, s.addr)):
+        sensors = state.sensors
+        lines.append(LINE % (state.id, state.addr, state.seq,
+                             sensors['Temperature'], sensors['Humidity'],
+                             sensors['Pressure'], sensors['Illuminance'],
+                             sensors['Accelerometer'], sensors['Battery Level'],
+                             state.rssi, now - state.last_seen, state.count))
+    if stats:
+        lines += ['', stats]
+    return lines
+
+def timestr(t):
+    return datetime.fromtimestamp(t).strftime('%Y/%m/%d %H:%M:%S')
+
+class Dashboard:
+    def __init__(self, table, refresh=1.0, out=None, status=None):
+        self.table = table                      # DeviceTable
+        self.refresh = refresh                  # 書き換え間隔(秒)
+        self.out = out or sys.stdout
+        self.status = status                    # 最下行に表示する文字列を返す関数
+        self.thread = threading.Thread(target=self.run, name='dashboard', daemon=True)
+
+    def start(self):
+        if not self.out.isatty():               # 端末でなければ表示しない
+            return False
+        self.thread.start()
+        return True
+
+    def draw(self):
+        try:
+            lines = render(self.table, stats=self.status() if self.status else None)
+        except RuntimeError:                    # 表示中に台数が変化した時
+            return
+        # カーソルを左上へ移動し、各行の残りと画面の残りを消去して1回で出力
+        self.out.write('\033[H' + '\033[K\n'.join(lines) + '\033[K\n\033[J')
+        self.out.flush()
+
+    def run(self):
+        self.out.write('\033[2J')               # 画面消去
+        while True:
+            self.draw()
+            sleep(self.refresh)
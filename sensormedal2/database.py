@@ -0,0 +1,173 @@
+# coding: utf-8
+
+################################################################################
+# SQLiteデータベースへの保存
+# 受信値をメダルのIDと受信時刻(秒未満まで)付きで保存し、メダル毎・期間毎に
+# 読み出せるようにします。まとめて書き込み(WAL)、古いデータは自動で削除します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   書き込み
+#       db = SqliteWriter('SensorMedal2.db', retention=90*86400)
+#       db.append(time(), dev.addr, sensors)
+#       db.close()                          # 終了時に必ず実行(未書込の行を書き込む)
+#   読み出し
+#       rows = query('SensorMedal2.db', device=1, start=t0, end=t1)
+#   コマンドで読み出し(CSV形式で表示)
+#       python3 -m sensormedal2.database SensorMedal2.db [ID] [開始] [終了]
+#       開始・終了は 'YYYY/MM/DD HH:MM' または UNIX時刻
+#   SQLで読み出し
+#       sqlite3 SensorMedal2.db "SELECT * FROM readings WHERE id=1 ORDER BY t DESC LIMIT 10"
+#
+#【書き込みの条件】
+#   batch件たまるか、前回の書き込みから interval秒が経過した時に、1回の
+#   トランザクションでまとめて書き込みます。WALモード・synchronous=NORMALのため、
+#   書き込み毎のSDカードへの同期は行いません(電源断時は最後の数件を失います)。
+#
+#【データの削除】
+#   prune_interval秒毎に、retention秒より古いデータをメダル毎に削除します。
+
+import datetime
+import os
+import sqlite3
+import sys
+from shutil import chown
+from time import monotonic, time
+
+from .archive import parse_time
+from .metrics import METRICS
+
+# 列名とセンサ名(辞書型変数sensorsのキー)
+COLUMNS = (
+    ('seq', 'SEQ'), ('temperature', 'Temperature'), ('humidity', 'Humidity'),
+    ('pressure', 'Pressure'), ('illuminance', 'Illuminance'),
+    ('accel_x', 'Accelerometer X'), ('accel_y', 'Accelerometer Y'),
+    ('accel_z', 'Accelerometer Z'), ('geo_x', 'Geomagnetic X'),
+    ('geo_y', 'Geomagnetic Y'), ('geo_z', 'Geomagnetic Z'),
+    ('steps', 'Steps'), ('battery', 'Battery Level'), ('rssi', 'RSSI'),
+)
+COLUMN_NAMES = ('id', 't', 'addr', 'magnetic') + tuple(c[0] for c in COLUMNS)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER NOT NULL,
+    t REAL NOT NULL,
+    addr TEXT,
+    magnetic INTEGER,
+    seq INTEGER,
+    temperature REAL, humidity REAL, pressure REAL, illuminance REAL,
+    accel_x REAL, accel_y REAL, accel_z REAL,
+    geo_x REAL, geo_y REAL, geo_z REAL,
+    steps INTEGER, battery INTEGER, rssi INTEGER
+);
+CREATE INDEX IF NOT EXISTS readings_id_t ON readings (id, t);
+'''
+
+INSERT = 'INSERT INTO readings (%s) VALUES (%s)' % (
+    ', '.join(COLUMN_NAMES), ', '.join('?' * len(COLUMN_NAMES)))
+
+def connect(filename, **kwargs):
+    conn = sqlite3.connect(filename, **kwargs)
+    conn.execute('PRAGMA journal_mode=WAL')     # 読み出し中も書き込める
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+class SqliteWriter:
+    def __init__(self, filename, batch=500, interval=5, retention=None,
+                 prune_interval=3600, username=None):
+        self.filename = filename
+        self.batch = batch                      # まとめて書き込む件数
+        self.interval = interval                # 書き込みの最大間隔(秒)
+        self.retention = retention              # 保存期間(秒, Noneは削除しない)
+        self.prune_interval = prune_interval    # 古いデータの削除間隔(秒)
+        new = not os.path.exists(filename)
+        self.conn = connect(filename, check_same_thread=False)  # 出力先のスレッドで使用
+        self.conn.executescript(SCHEMA)
+        if new and username:                    # 作成時のみ所有者を変更
+            try:
+                chown(filename, username, username)
+            except Exception as e:
+                print(e)
+        self.rows = []                          # 未書込の行
+        self.committed = monotonic()
+        self.pruned = 0                         # 最後に削除した時刻
+        self.written = 0                        # 書き込んだ行数
+        self.deleted = 0                        # 削除した行数
+        METRICS.gauge('queue_depth', lambda: len(self.rows), queue='sqlite_rows')
+
+    def append(self, t, addr, sensors):
+        self.rows.append((int(sensors['ID'], 16), t, addr, int(sensors['Magnetic'], 16))
+                         + tuple(sensors.get(key) for name, key in COLUMNS))
+        if len(self.rows) >= self.batch:
+            self.commit()
+
+    def tick(self):                             # 受信が無い時も間隔毎に書き込む
+        if self.rows and monotonic() - self.committed >= self.interval:
+            self.commit()
+
+    def commit(self):
+        rows = self.rows
+        self.rows = []
+        with METRICS.timer('sqlite_commit_seconds'):
+            with self.conn:                     # 1回のトランザクション
+                self.conn.executemany(INSERT, rows)
+        self.written += len(rows)
+        self.committed = monotonic()
+        if self.retention and monotonic() - self.pruned >= self.prune_interval:
+            self.prune()
+
+    def prune(self, before=None):
+        # before(UNIX時刻)より古いデータを削除, 索引を使うためメダル毎に削除
+        if before is None:
+            before = time() - self.retention
+        with self.conn:
+            ids = [r[0] for r in self.conn.execute('SELECT DISTINCT id FROM readings')]
+            for dev_id in ids:
+                self.deleted += self.conn.execute(
+                    'DELETE FROM readings WHERE id = ? AND t < ?', (dev_id, before)).rowcount
+        self.pruned = monotonic()
+
+    def close(self):
+        if self.conn is None:
+            return
+        if self.rows:
+            self.commit()
+        self.conn.close()
+        self.conn = None
+
+def query(filename, device=None, start=None, end=None):
+    # (COLUMN_NAMESの順の値)のリストを時刻順に返す
+    sql = 'SELECT ' + ', '.join(COLUMN_NAMES) + ' FROM readings WHERE 1'
+    args = []
+    if device is not None:
+        sql += ' AND id = ?'
+        args.append(device)
+    if start is not None:
+        sql += ' AND t >= ?'
+        args.append(start)
+    if end is not None:
+        sql += ' AND t < ?'
+        args.append(end)
+    sql += ' ORDER BY t'
+    conn = sqlite3.connect(filename)
+    try:
+        return conn.execute(sql, args).fetchall()
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('使用方法:', sys.argv[0], 'ファイル名 [ID] [開始] [終了]')
+        exit()
+    device = int(sys.argv[2], 0) if len(sys.argv) >= 3 else None
+    start = parse_time(sys.argv[3]) if len(sys.argv) >= 4 else None
+    end = parse_time(sys.argv[4]) if len(sys.argv) >= 5 else None
+    print('time, ' + ', '.join(c for c in COLUMN_NAMES if c != 't'))
+    for row in query(sys.argv[1], device, start, end):
+        s = datetime.datetime.fromtimestamp(row[1]).strftime('%Y/%m/%d %H:%M:%S.%f')[:-3]
+        for c, v in zip(COLUMN_NAMES, row):
+            if c != 't':
+                s += ', ' + str(v)
+        print(s)
@@ -0,0 +1,88 @@
+# coding: utf-8
+
+################################################################################
+# 変化した時のみ送信・保存(デッドバンド)
+# 前回送信した値からの変化が不感帯を超えた時、または一定時間が経過した時のみ
+# 送信・保存し、変化の少ない環境での通信量と保存容量を減らします。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   change = ChangeFilter(heartbeat=300)    # 変化が無くても300秒毎に送信
+#   if change.changed(dev_id, sensors, 'envir'):
+#       udp.send(s)
+#
+#【不感帯の設定】
+#   センサ名: (絶対値, 相対値) で指定し、前回送信した値との差が
+#   絶対値 と 前回値×相対値 の大きい方を超えた時に送信します。
+#       ChangeFilter({'Temperature': (0.5, 0), 'Illuminance': (10, 0.1)})
+#   文字列の値(Magnetic等)と不感帯の無いセンサは、値が変わった時に送信します。
+
+from time import time
+
+DEADBANDS = {
+    'Temperature': (0.1, 0),                    # ℃
+    'Humidity': (1, 0),                         # %
+    'Pressure': (0.2, 0),                       # hPa
+    'Illuminance': (5, 0.05),                   # lx (明るい時は5%)
+    'Accelerometer': (0.05, 0),                 # g
+    'Accelerometer X': (0.05, 0),
+    'Accelerometer Y': (0.05, 0),
+    'Accelerometer Z': (0.05, 0),
+    'Geomagnetic': (2, 0),                      # uT
+    'Geomagnetic X': (2, 0),
+    'Geomagnetic Y': (2, 0),
+    'Geomagnetic Z': (2, 0),
+    'Magnetic': None,
+    'Steps': (0, 0),                            # 歩
+    'Battery Level': (0, 0),                    # %
+}
+
+# 送信データ(UDPの種別・CSVのファイル名)毎に変化を確認するセンサ
+GROUPS = {
+    'illum': ('Illuminance',),
+    'envir': ('Temperature', 'Humidity', 'Pressure'),
+    'accem': ('Accelerometer X', 'Accelerometer Y', 'Accelerometer Z'),
+    'medal': ('Accelerometer', 'Geomagnetic', 'Magnetic', 'Battery Level', 'Steps'),
+    'Accelerometer': ('Accelerometer', 'Accelerometer X', 'Accelerometer Y', 'Accelerometer Z'),
+    'Geomagnetic': ('Geomagnetic', 'Geomagnetic X', 'Geomagnetic Y', 'Geomagnetic Z'),
+    'all': tuple(DEADBANDS),                    # RSSIは含めない
+}
+
+class ChangeFilter:
+    def __init__(self, deadbands=None, heartbeat=300):
+        self.deadbands = dict(DEADBANDS)
+        if deadbands:
+            self.deadbands.update(deadbands)
+        self.heartbeat = heartbeat              # 変化が無くても送信する間隔(秒)
+        self.reported = dict()                  # (ID, 送信データ) -> [時刻, 値]
+        self.passed = 0                         # 送信・保存した数
+        self.suppressed = 0                     # 変化が無く省略した数
+
+    def exceeds(self, key, old, new):
+        band = self.deadbands.get(key)
+        if band is None or isinstance(new, str):
+            return new != old
+        return abs(new - old) > max(band[0], band[1] * abs(old))
+
+    def changed(self, dev_id, sensors, group='all', t=None):
+        # 前回の送信から変化していればTrue(送信したものとして記録)
+        if t is None:
+            t = time()
+        keys = GROUPS.get(group, (group,))
+        k = (dev_id, group)
+        last = self.reported.get(k)
+        if last is None or (self.heartbeat is not None and t - last[0] >= self.heartbeat) \
+                or any(self.exceeds(key, last[1][key], sensors[key]) for key in keys):
+            self.reported[k] = [t, dict((key, sensors[key]) for key in keys)]
+            self.passed += 1
+            return True
+        self.suppressed += 1
+        return False
+
+    def get_state(self):                        # チェックポイント用
+        return dict(self.reported)
+
+    def set_state(self, reported):
+        self.reported.update(reported)
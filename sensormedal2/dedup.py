@@ -0,0 +1,49 @@
+# coding: utf-8
+
+################################################################################
+# SEQ番号による重複受信の除去
+# センサメダルは同じSEQの広告を複数回送信するので、2回目以降を読み捨てます。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   dedup = DedupCache()
+#   if dedup.seen(dev.addr, val):           # valはManufacturerの16進文字列
+#       return                              # 受信済みのため処理しない
+
+from collections import OrderedDict
+from time import monotonic
+
+class DedupCache:
+    def __init__(self, size=256, ttl=60):
+        self.size = size                        # 保持する最大件数(LRUで削除)
+        self.ttl = ttl                          # 保持する秒数(SEQの一巡対策)
+        self.cache = OrderedDict()
+        self.passed = 0                         # 通過させた件数
+        self.duplicates = 0                     # 読み捨てた件数
+
+    def seen(self, addr, val, now=None):
+        # デコード前のペイロードからIDとSEQを取り出して照合する
+        key = (addr, val[0:4], val[12:14])
+        if now is None:
+            now = monotonic()
+        t = self.cache.get(key)
+        if t is not None and now - t < self.ttl:
+            self.duplicates += 1
+            return True
+        self.cache[key] = now
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.size:      # 古いものから削除
+            self.cache.popitem(last=False)
+        self.passed += 1
+        return False
+
+    def get_state(self):                        # チェックポイント用
+        return list(self.cache.items())
+
+    def set_state(self, state):
+        self.cache = OrderedDict(state)
+
+    def __len__(self):
+        return len(self.cache)
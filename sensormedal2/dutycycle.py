@@ -0,0 +1,117 @@
+# coding: utf-8
+
+################################################################################
+# 受信の間欠動作(メダルの送信間隔に合わせて受信を休止)
+# メダル毎の送信間隔を受信時刻から学習し、次の送信が予想される時刻まで受信を
+# 休止します。予想時刻に受信できなければ連続受信へ戻します。
+# 電池や太陽電池で動作させる場合に、CPUと無線の動作時間を減らします。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   stream(handle, duty=DutyCycle())
+#
+#【動作】
+#   ・メダル毎に、Manufacturerの値が変化した時刻の間隔を平均して送信間隔とする
+#   ・全メダルの次の予想時刻のうち最も早い時刻の guard秒前まで受信を休止
+#   ・予想時刻を guard秒過ぎても受信できないメダルがあれば連続受信
+#     (forget秒以上受信できないメダルは学習から削除)
+#   ・新しいメダルを見つけるため、受信時間の割合は min_duty 以上を保つ
+
+from time import time
+
+from .metrics import METRICS
+
+class Medal:
+    __slots__ = ('last', 'period', 'payload', 'count')
+
+    def __init__(self, t, payload):
+        self.last = t                           # 最後に値が変化した時刻
+        self.period = None                      # 送信間隔の推定値(秒)
+        self.payload = payload
+        self.count = 0                          # 間隔の学習回数
+
+class DutyCycle:
+    def __init__(self, min_duty=0.25, guard=0.3, min_pause=0.5, max_pause=10,
+                 forget=60, alpha=0.2, slice=0.2, prefix='ROHMMedal2'):
+        self.min_duty = min_duty                # 受信時間の最小の割合
+        self.guard = guard                      # 予想時刻の前後の余裕(秒)
+        self.min_pause = min_pause              # これより短い休止はしない(秒)
+        self.max_pause = max_pause              # 最大の休止時間(秒)
+        self.forget = forget                    # 学習から削除するまでの時間(秒)
+        self.alpha = alpha                      # 送信間隔の平滑化係数
+        self.slice = slice                      # 休止を判断する間隔(秒)
+        self.prefix = prefix
+        self.medals = dict()                    # アドレス毎のMedal
+        self.scan_start = None                  # 受信を再開した時刻
+        self.scanned = 0.0                      # 受信した合計時間(秒)
+        self.paused = 0.0                       # 休止した合計時間(秒)
+
+    def observe(self, dev, t=None):
+        # 受信した広告から送信間隔を学習
+        name = dev.getValueText(0x08)           # Short Local Name
+        if not name or not name.startswith(self.prefix):
+            return
+        val = dev.getValueText(0xFF)            # Manufacturer
+        if t is None:
+            t = time()
+        m = self.medals.get(dev.addr)
+        if m is None:
+            self.medals[dev.addr] = Medal(t, val)
+            return
+        if val == m.payload:                    # 同じ内容の再送信
+            return
+        dt = t - m.last
+        m.last = t
+        m.payload = val
+        if dt <= 0:
+            return
+        if m.period is not None:
+            n = max(round(dt / m.period), 1)    # 受信できなかった送信を考慮
+            dt /= n
+            m.period += self.alpha * (dt - m.period)
+        else:
+            m.period = dt
+        m.count += 1
+
+    def plan(self, now=None):
+        # 休止する秒数(0は受信を続ける)
+        if now is None:
+            now = time()
+        if self.scan_start is None:
+            self.scan_start = now
+        nearest = None
+        for addr, m in list(self.medals.items()):
+            if now - m.last > self.forget:
+                del self.medals[addr]           # 受信できなくなったメダル
+                continue
+            if m.period is None or m.count < 2:
+                return 0                        # 学習中
+            expected = m.last + m.period
+            if now > expected + self.guard:
+                return 0                        # 予想時刻に受信できなかった
+            if nearest is None or expected < nearest:
+                nearest = expected
+        scanning = now - self.scan_start
+        limit = (self.scanned + scanning) * (1 - self.min_duty) / self.min_duty \
+                - self.paused                   # 受信時間の割合を保つ
+        if nearest is None:                     # メダルが居ない時
+            pause = self.max_pause
+        else:
+            pause = nearest - self.guard - now
+        pause = min(pause, limit, self.max_pause)
+        if pause < self.min_pause:
+            return 0
+        return pause
+
+    def pausing(self, now, pause):
+        # 休止の開始時に呼ぶ
+        self.scanned += now - self.scan_start
+        self.paused += pause
+        self.scan_start = None
+        METRICS.inc('scan_paused_seconds_total', pause)
+
+    def duty(self):
+        total = self.scanned + self.paused
+        return self.scanned / total if total else 1.0
@@ -0,0 +1,129 @@
+# coding: utf-8
+
+################################################################################
+# SensorMedal2 アドバタイジング・データ(Manufacturer)のデコーダ
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【データ構造】
+#   Manufacturer(29バイト, リトルエンディアン)
+#       位置  長さ  内容
+#        0     2    ID (Company ID)
+#        2     2    温度       -45 + 175 * val / 65536 ℃
+#        4     2    湿度       100 * val / 65536 %
+#        6     1    SEQ        送信毎に1ずつ増加(8ビット)
+#        7     1    状態フラグ
+#        8     6    加速度XYZ  符号付, val / 4096 g
+#       14     6    地磁気XYZ  符号付, val / 10 uT
+#       20     3    気圧       val / 2048 hPa
+#       23     2    照度       val / 1.2 lx
+#       25     1    磁気センサ
+#       26     2    歩数
+#       28     1    電池残量   %
+#
+#【参考文献】
+#   https://www.rohm.co.jp/documents/11401/3946483/sensormedal-evk-002_ug-j.pdf
+
+import struct
+
+FRAME = struct.Struct('<HHHBBhhhhhhHBHBHB')     # 気圧(3バイト)は H + B で取得
+FRAME_SIZE = FRAME.size                         # 29バイト
+
+class SensorMedal2Frame:
+    __slots__ = ('id', 'temperature', 'humidity', 'seq', 'flags',
+                 'accel_x', 'accel_y', 'accel_z', 'geo_x', 'geo_y', 'geo_z',
+                 'pressure', 'illuminance', 'magnetic', 'steps', 'battery')
+
+    def __init__(self, data):
+        (self.id, temp, humi, self.seq, self.flags,
+         ax, ay, az, gx, gy, gz, press_l, press_h,
+         illum, self.magnetic, self.steps, self.battery) = FRAME.unpack_from(data)
+        self.temperature = -45 + 175 * temp / 65536
+        self.humidity = 100 * humi / 65536
+        self.accel_x = ax / 4096
+        self.accel_y = ay / 4096
+        self.accel_z = az / 4096
+        self.geo_x = gx / 10
+        self.geo_y = gy / 10
+        self.geo_z = gz / 10
+        self.pressure = (press_l + (press_h << 16)) / 2048
+        self.illuminance = illum / 1.2
+
+    @classmethod
+    def from_hex(cls, val):                     # getScanData()の16進文字列から
+        return cls(bytes.fromhex(val))
+
+    def accel(self):                            # 加速度の大きさ
+        return (self.accel_x ** 2 + self.accel_y ** 2 + self.accel_z ** 2) ** 0.5
+
+    def geomagnetic(self):                      # 地磁気の大きさ
+        return (self.geo_x ** 2 + self.geo_y ** 2 + self.geo_z ** 2) ** 0.5
+
+    def sensors(self):                          # 従来の辞書型変数sensorsの形式
+        return {
+            'ID': hex(self.id),
+            'Temperature': self.temperature,
+            'Humidity': self.humidity,
+            'SEQ': self.seq,
+            'Condition Flags': bin(self.flags),
+            'Accelerometer X': self.accel_x,
+            'Accelerometer Y': self.accel_y,
+            'Accelerometer Z': self.accel_z,
+            'Accelerometer': self.accel(),
+            'Geomagnetic X': self.geo_x,
+            'Geomagnetic Y': self.geo_y,
+            'Geomagnetic Z': self.geo_z,
+            'Geomagnetic': self.geomagnetic(),
+            'Pressure': self.pressure,
+            'Illuminance': self.illuminance,
+            'Magnetic': hex(self.magnetic),
+            'Steps': self.steps,
+            'Battery Level': self.battery,
+        }
+
+def decode(val):                                # 16進文字列を辞書型へ変換
+    return SensorMedal2Frame.from_hex(val).sensors()
+
+# 一括デコード用のNumPy構造化データ型(FRAMEと同じ並び, 詰め物なし)
+FRAME_DTYPE = [
+    ('id', '<u2'), ('temperature', '<u2'), ('humidity', '<u2'),
+    ('seq', 'u1'), ('flags', 'u1'),
+    ('accel', '<i2', (3,)), ('geo', '<i2', (3,)),
+    ('pressure_l', '<u2'), ('pressure_h', 'u1'),
+    ('illuminance', '<u2'), ('magnetic', 'u1'), ('steps', '<u2'),
+    ('battery', 'u1'),
+]
+
+def decode_batch(payloads):
+    # 多数のペイロード(16進文字列またはバイト列)をまとめてNumPy配列へ変換
+    # 長さ不足のフレームは除外するので、'index'(各行の入力の番号)で時刻や
+    # アドレスと対応付けてください
+    import numpy as np                          # 一括処理時のみ必要
+    buf = bytearray()
+    index = []
+    for i, p in enumerate(payloads):
+        if isinstance(p, str):
+            p = bytes.fromhex(p)
+        if len(p) < FRAME_SIZE:                 # 長さ不足のフレームは除外
+            continue
+        buf += p[:FRAME_SIZE]
+        index.append(i)
+    raw = np.frombuffer(bytes(buf), dtype=np.dtype(FRAME_DTYPE))
+    return {
+        'index': np.array(index, dtype=np.int64),
+        'id': raw['id'].astype(np.int64),
+        'temperature': -45 + 175 * raw['temperature'].astype(np.float64) / 65536,
+        'humidity': 100 * raw['humidity'].astype(np.float64) / 65536,
+        'seq': raw['seq'].astype(np.int64),
+        'accel_x': raw['accel'][:, 0] / 4096,
+        'accel_y': raw['accel'][:, 1] / 4096,
+        'accel_z': raw['accel'][:, 2] / 4096,
+        'geo_x': raw['geo'][:, 0] / 10,
+        'geo_y': raw['geo'][:, 1] / 10,
+        'geo_z': raw['geo'][:, 2] / 10,
+        'pressure': (raw['pressure_l'] + raw['pressure_h'].astype(np.int64) * 65536) / 2048,
+        'illuminance': raw['illuminance'] / 1.2,
+        'steps': raw['steps'].astype(np.int64),
+        'battery': raw['battery'].astype(np.int64),
+    }
@@ -0,0 +1,225 @@
+# coding: utf-8
+
+################################################################################
+# メダル毎の直近の履歴(リングバッファ)とHTTP/JSONによる問い合わせ
+# センサ毎に固定長の配列へ記録するので、動作時間が長くなっても遅くなりません。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   history = History(size=3600)            # メダル毎に直近3600件を保持
+#                                           # と直近window秒(300秒)の移動窓の集計
+#   history.add(record)                     # 受信毎(HistorySinkから呼ばれる)
+#   serve(history, 8080)
+#
+#【問い合わせ】
+#   http://localhost:8080/devices                   メダルの一覧
+#   http://localhost:8080/latest?id=1               最新値(idを省略すると全メダル)
+#   http://localhost:8080/range?id=1&start=-600     直近600秒の全センサ値
+#   http://localhost:8080/range?id=1&start=-3600&step=60&fields=Temperature,Humidity
+#       start, end: UNIX時刻(負の値は現在からの秒数)  step: 間引く間隔(秒, 平均値)
+#   http://localhost:8080/rolling?id=1&how=max      直近window秒の集計値(移動窓)
+#       how: 'mean'(平均値, 省略時), 'min', 'max', 'last'  idを省略すると全メダル
+
+import json
+import threading
+from array import array
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+from urllib.parse import parse_qs, urlsplit
+
+from .aggregate import NUMERIC, SlidingWindow, summarize
+
+class Ring:
+    # 1台分の履歴(時刻とセンサ毎の配列)
+    __slots__ = ('size', 't', 'cols', 'head', 'count', 'addr', 'sensors')
+
+    def __init__(self, size):
+        self.size = size
+        self.t = array('d', bytes(8 * size))
+        self.cols = dict((key, array('d', bytes(8 * size))) for key in NUMERIC)
+        self.head = 0                           # 次に書き込む位置
+        self.count = 0                          # 記録数
+        self.addr = None
+        self.sensors = None                     # 最新値(辞書型)
+
+    def append(self, t, addr, sensors):
+        i = self.head
+        self.t[i] = t
+        for key, col in self.cols.items():
+            col[i] = sensors[key]
+        self.head = (i + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+        self.addr = addr
+        self.sensors = sensors
+
+    def pos(self, n):
+        # 古い方からn番目の配列上の位置
+        return (self.head - self.count + n) % self.size
+
+    def bisect(self, t):
+        # 時刻t以降の最初の記録の番号(時刻順に記録されていること)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.t[self.pos(mid)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, start, end, fields, step=None):
+        first = self.bisect(start)
+        last = self.bisect(end)
+        res = dict((key, []) for key in ['t'] + fields)
+        if not step:
+            for n in range(first, last):
+                i = self.pos(n)
+                res['t'].append(self.t[i])
+                for key in fields:
+                    res[key].append(self.cols[key][i])
+            return res
+        bucket = None
+        sums = dict.fromkeys(fields, 0.0)       # 区間毎の合計
+        count = 0
+        for n in range(first, last):
+            i = self.pos(n)
+            b = self.t[i] - self.t[i] % step    # 時刻をstepの境界に揃える
+            if b != bucket:
+                if bucket is not None:
+                    res['t'].append(bucket)
+                    for key in fields:
+                        res[key].append(sums[key] / count)
+                bucket = b
+                sums = dict.fromkeys(fields, 0.0)
+                count = 0
+            for key in fields:
+                sums[key] += self.cols[key][i]
+            count += 1
+        if bucket is not None:
+            res['t'].append(bucket)
+            for key in fields:
+                res[key].append(sums[key] / count)
+        return res
+
+class History:
+    def __init__(self, size=3600, max_devices=256, window=300):
+        self.size = size                        # メダル毎の記録数
+        self.max_devices = max_devices
+        self.rings = OrderedDict()              # ID毎のRing(古い順)
+        self.sliding = SlidingWindow(window) if window else None  # 直近window秒の集計
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            ring = self.rings.get(record.id)
+            if ring is None:
+                if len(self.rings) >= self.max_devices:
+                    dev_id = self.rings.popitem(last=False)[0]  # 最も古いメダルを削除
+                    if self.sliding:
+                        self.sliding.remove(dev_id)
+                ring = self.rings[record.id] = Ring(self.size)
+            else:
+                self.rings.move_to_end(record.id)
+            ring.append(record.t, record.addr, record.sensors)
+            if self.sliding:
+                self.sliding.add(record)
+
+    def devices(self):
+        with self.lock:
+            return [{'id': dev_id, 'addr': ring.addr, 'count': ring.count,
+                     'first': ring.t[ring.pos(0)],
+                     'last': ring.t[ring.pos(ring.count - 1)]}
+                    for dev_id, ring in sorted(self.rings.items())]
+
+    def latest(self, dev_id=None):
+        with self.lock:
+            if dev_id is not None:
+                ring = self.rings.get(dev_id)
+                if ring is None:
+                    return None
+                return dict(ring.sensors, t=ring.t[ring.pos(ring.count - 1)])
+            return dict((dev_id, dict(ring.sensors, t=ring.t[ring.pos(ring.count - 1)]))
+                        for dev_id, ring in sorted(self.rings.items()))
+
+    def query(self, dev_id, start=None, end=None, fields=None, step=None):
+        now = time()
+        if start is None:
+            start = 0
+        elif start < 0:                         # 負の値は現在からの秒数
+            start += now
+        if end is None:
+            end = float('inf')
+        elif end < 0:
+            end += now
+        fields = [key for key in (fields or NUMERIC) if key in NUMERIC]
+        with self.lock:
+            ring = self.rings.get(dev_id)
+            if ring is None:
+                return None
+            return ring.query(start, end, fields, step)
+
+    def rolling(self, dev_id=None, how='mean'):
+        # 直近window秒の集計値(辞書型変数sensorsの形式)
+        if not self.sliding:
+            return None
+        with self.lock:
+            if dev_id is not None:
+                stats = self.sliding.stats(dev_id)
+                return summarize(stats, how) if stats else None
+            res = dict()
+            for dev_id in sorted(self.sliding.devices()):
+                stats = self.sliding.stats(dev_id)
+                if stats:
+                    res[dev_id] = summarize(stats, how)
+            return res
+
+class HistoryHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        q = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        history = self.server.history
+        try:
+            dev_id = int(q['id']) if 'id' in q else None
+            if url.path == '/devices':
+                res = history.devices()
+            elif url.path == '/latest':
+                res = history.latest(dev_id)
+            elif url.path == '/rolling':
+                how = q.get('how', 'mean')
+                if how not in ('mean', 'min', 'max', 'last'):
+                    raise ValueError(how)
+                res = history.rolling(dev_id, how)
+            elif url.path == '/range' and dev_id is not None:
+                res = history.query(dev_id,
+                                    float(q['start']) if 'start' in q else None,
+                                    float(q['end']) if 'end' in q else None,
+                                    q['fields'].split(',') if 'fields' in q else None,
+                                    float(q['step']) if 'step' in q else None)
+            else:
+                self.send_error(404)
+                return
+        except ValueError:
+            self.send_error(400)
+            return
+        if res is None:
+            self.send_error(404, 'no such medal')
+            return
+        body = json.dumps(res).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):       # アクセス毎の表示をしない
+        pass
+
+def serve(history, port=8080, addr='127.0.0.1'):
+    server = ThreadingHTTPServer((addr, port), HistoryHandler)
+    server.history = history
+    threading.Thread(target=server.serve_forever, name='history', daemon=True).start()
+    return server
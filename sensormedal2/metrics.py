@@ -0,0 +1,233 @@
+# coding: utf-8
+
+################################################################################
+# 動作状況の計測(受信数・処理時間・SEQ欠損・キュー長)
+# Prometheusのテキスト形式でHTTP公開し、一定間隔で概要を表示します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   from sensormedal2.metrics import METRICS, serve, Summary
+#   METRICS.inc('frames_total')                         # カウンタ
+#   with METRICS.timer('decode_seconds'): ...           # 処理時間(ヒストグラム)
+#   METRICS.gauge('queue_depth', q.qsize, queue='csv')      # キュー長
+#   serve(9100)                             # http://localhost:9100/metrics
+#   Summary(60).start()                     # 60秒毎に概要を1行表示
+#
+#【SEQ欠損の推定】
+#   センサメダルのSEQは送信毎に1ずつ増える8ビットの値(255の次は0)なので、
+#   前回のSEQとの差から受信できなかった広告の数を推定します。
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, perf_counter, sleep
+
+BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1,
+           0.5, 1, 5, 10)
+
+def labelstr(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, labels[k]) for k in sorted(labels)) + '}'
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        for i, b in enumerate(BUCKETS):
+            if value <= b:
+                self.counts[i] += 1
+                break
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+class Timer:
+    __slots__ = ('hist', 't')
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.t = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.hist.observe(perf_counter() - self.t)
+
+class SeqTracker:
+    # メダル毎のSEQから欠損数を推定
+    def __init__(self):
+        self.last = dict()                      # ID毎の前回のSEQ
+        self.received = 0
+        self.lost = 0
+        self.devices = dict()                   # ID毎の[受信数, 欠損数]
+
+    def update(self, dev_id, seq):
+        d = self.devices.get(dev_id)
+        if d is None:
+            d = self.devices[dev_id] = [0, 0]
+        last = self.last.get(dev_id)
+        self.last[dev_id] = seq
+        d[0] += 1
+        self.received += 1
+        if last is None:
+            return 0
+        gap = (seq - last) & 0xFF               # 255 -> 0 の桁あふれを考慮
+        if gap == 0 or gap >= 128:              # 重複または再起動等
+            return 0
+        d[1] += gap - 1
+        self.lost += gap - 1
+        return gap - 1
+
+    def loss_rate(self, dev_id=None):
+        if dev_id is None:
+            received, lost = self.received, self.lost
+        else:
+            received, lost = self.devices.get(dev_id, (0, 0))
+        return lost / (received + lost) if received + lost else 0.0
+
+class Metrics:
+    def __init__(self):
+        self.counters = dict()                  # (名前, ラベル) -> 値
+        self.hists = dict()                     # (名前, ラベル) -> Histogram
+        self.gauges = dict()                    # (名前, ラベル) -> 関数
+        self.seq = SeqTracker()
+        self.lock = threading.Lock()
+
+    def key(self, name, labels):
+        return (name, labelstr(labels))
+
+    def inc(self, name, n=1, **labels):
+        k = self.key(name, labels)
+        with self.lock:
+            self.counters[k] = self.counters.get(k, 0) + n
+
+    def histogram(self, name, **labels):
+        k = self.key(name, labels)
+        h = self.hists.get(k)
+        if h is None:
+            with self.lock:
+                h = self.hists.setdefault(k, Histogram())
+        return h
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def timer(self, name, **labels):
+        return Timer(self.histogram(name, **labels))
+
+    def gauge(self, name, func, **labels):
+        with self.lock:
+            self.gauges[self.key(name, labels)] = func
+
+    def get(self, name, **labels):
+        return self.counters.get(self.key(name, labels), 0)
+
+    def text(self):
+        # Prometheusのテキスト形式
+        p = 'sensormedal2_'
+        with self.lock:                         # 表示中に追加されても良いように複製
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            hists = sorted(self.hists.items())
+            devices = sorted(dict(self.seq.devices).items())
+        lines = []
+        last = None
+        for (name, labels), v in counters:
+            if name != last:                    # 同じ名前の最初の行の前に型を出力
+                lines.append('# TYPE %s%s counter' % (p, name))
+                last = name
+            lines.append(p + name + labels + ' ' + str(v))
+        for (name, labels), func in gauges:
+            if name != last:
+                lines.append('# TYPE %s%s gauge' % (p, name))
+                last = name
+            try:
+                lines.append(p + name + labels + ' ' + str(func()))
+            except Exception:
+                pass
+        for (name, labels), h in hists:
+            if name != last:
+                lines.append('# TYPE %s%s histogram' % (p, name))
+                last = name
+            inner = labels[1:-1] + ',' if labels else ''
+            n = 0
+            for b, c in zip(BUCKETS, h.counts):
+                n += c
+                lines.append('%s%s_bucket{%sle="%s"} %d' % (p, name, inner, b, n))
+            lines.append('%s%s_bucket{%sle="+Inf"} %d' % (p, name, inner, h.count))
+            lines.append(p + name + '_sum' + labels + ' ' + str(h.total))
+            lines.append(p + name + '_count' + labels + ' ' + str(h.count))
+        for i, name in enumerate(('seq_received_total', 'seq_lost_total')):
+            lines.append('# TYPE %s%s counter' % (p, name))
+            lines.append(p + name + ' ' + str(self.seq.lost if i else self.seq.received))
+            for dev_id, d in devices:
+                lines.append('%s%s{id="%d"} %d' % (p, name, dev_id, d[i]))
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()                             # 共通の計測値
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = METRICS.text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):       # アクセス毎の表示をしない
+        pass
+
+def serve(port=9100, addr='127.0.0.1'):
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+class Summary:
+    # interval秒毎に概要を1行で表示
+    def __init__(self, interval=60, out=print):
+        self.interval = interval
+        self.out = out
+        self.thread = threading.Thread(target=self.run, name='summary', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def line(self, frames, elapsed):
+        decode = METRICS.histogram('decode_seconds')
+        s = 'frames/s: %.1f' % (frames / elapsed if elapsed else 0)
+        s += '  decode: %.0fus' % (decode.mean() * 1e6)
+        s += '  loss: %.1f%%' % (METRICS.seq.loss_rate() * 100)
+        s += '  duplicates: %d' % METRICS.get('duplicates_total')
+        with METRICS.lock:
+            gauges = sorted(METRICS.gauges.items())
+        for (name, labels), func in gauges:
+            if name == 'queue_depth':
+                try:
+                    s += '  %s: %d' % (labels.split('"')[1], func())
+                except Exception:
+                    pass
+        return s
+
+    def run(self):
+        last = METRICS.get('frames_total')
+        t = monotonic()
+        while True:
+            sleep(self.interval)
+            frames = METRICS.get('frames_total')
+            now = monotonic()
+            self.out(self.line(frames - last, now - t))
+            last, t = frames, now
@@ -0,0 +1,234 @@
+# coding: utf-8
+
+################################################################################
+# 複数のBLEアダプタによる同時受信
+# アダプタ(hci0, hci1, ...)毎に別プロセスで受信し、1つの受信順の流れに統合します。
+# 複数のアダプタで受信した同じ広告は、RSSIが最も強いものだけを残します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   stream(handle, iface=[0, 1])            # hci0 と hci1 で受信
+#
+#   scanner = MultiScanner([0, 1, 2])       # btle.Scannerと同じ使い方
+#   stream(handle, scanner=scanner)
+#
+#【統合の方法】
+#   (アドレス, Manufacturerデータ)が同じ広告を同じ送信とみなし、最初に受信して
+#   から window秒の間に他のアダプタで受信したものと比べ、RSSIが最も強い広告を
+#   受信順に渡します。window秒を過ぎてから届いた同じ広告は破棄します。
+#
+#【再生】
+#   SENSORMEDAL2_REPLAY=fleet:台数:Hz を設定すると、各アダプタの代わりに同じ
+#   擬似メダルをアダプタ毎に異なるRSSIと欠落で再生します(BLEアダプタ不要)。
+
+import getpass
+import multiprocessing
+import os
+import queue
+import sys
+from collections import OrderedDict
+from sys import argv
+from time import monotonic, sleep, time
+
+from .metrics import METRICS
+from .prefilter import Prefilter
+from .replay import ReplayDevice, ReplayFinished, ReplayScanner, device_time, source
+from .scan import BTLEException, StreamDelegate, btle
+
+def worker(iface, out, replay=None, speed=1.0, start=None, prefix='ROHMMedal2',
+           batch=64, latency=0.05):
+    # 子プロセス: 1台のアダプタで受信し、広告をまとめて親プロセスへ送る
+    if replay:
+        scanner = ReplayScanner(source(replay, start, seed=iface), speed)
+    else:
+        scanner = btle.Scanner(iface)
+    buf = []
+    prefilter = Prefilter(prefix=prefix.encode()) if prefix else None
+
+    def handle(dev):
+        if prefilter is not None and not prefilter.check(dev):
+            return
+        buf.append((device_time(dev), dev.addr, dev.addrType, dev.rssi,
+                    dev.getScanData()))
+        if len(buf) >= batch:
+            flush()
+
+    def flush():
+        if buf:
+            out.put((iface, list(buf)))
+            buf.clear()
+
+    scanner.withDelegate(StreamDelegate(handle))
+    started = False
+    try:
+        while True:
+            try:
+                if not started:
+                    scanner.clear()
+                    scanner.start()
+                    started = True
+                scanner.process(latency)
+            except ReplayFinished:
+                return
+            except BTLEException as e:
+                print("ERROR hci" + str(iface), e)
+                if getpass.getuser() != 'root':
+                    print('使用方法: sudo', argv[0])
+                    return
+                try:
+                    scanner.stop()
+                except Exception:
+                    pass
+                started = False
+                sleep(1)
+            flush()
+    finally:
+        flush()
+        out.put((iface, None))                  # 受信の終了
+
+class MultiScanner:
+    # btle.Scannerの代わりに、複数のアダプタの受信を統合して渡す
+    def __init__(self, ifaces=(0, 1), window=0.2, prefix='ROHMMedal2',
+                 replay=None, speed=None, maxsize=1024):
+        self.ifaces = list(ifaces)
+        self.window = window                    # 同じ広告を待つ時間(秒)
+        self.prefix = prefix                    # 転送する機器名(Noneは全て)
+        if replay is None:
+            replay = os.environ.get('SENSORMEDAL2_REPLAY')
+        if speed is None:
+            speed = float(os.environ.get('SENSORMEDAL2_SPEED', 1))
+        self.replay = replay
+        self.speed = speed
+        self.maxsize = maxsize
+        self.delegate = None
+        self.procs = []
+        self.queue = None
+        self.running = 0                        # 受信中のプロセス数
+        self.pending = OrderedDict()            # 統合待ちの広告
+        self.done = OrderedDict()               # 渡し終えた広告
+        self.scanned = dict()
+        self.received = dict((i, 0) for i in self.ifaces)  # アダプタ毎の受信数
+        self.best = dict((i, 0) for i in self.ifaces)      # RSSIが最も強かった数
+        self.merged = 0                         # 統合により破棄した数
+        self.late = 0                           # window秒を過ぎて破棄した数
+
+    def withDelegate(self, delegate):
+        self.delegate = delegate
+        return self
+
+    def clear(self):
+        self.scanned = dict()
+
+    def start(self, passive=False):
+        if self.procs:
+            return
+        # 他のスレッドが持つロックを引き継がないよう、forkではなくspawnで起動
+        ctx = multiprocessing.get_context('spawn')
+        self.queue = ctx.Queue(self.maxsize)
+        start = time()                          # 再生時は全アダプタで同じ時刻
+        # 子プロセスで起動元のスクリプト(受信処理)を再び実行しないように隠す
+        main = sys.modules['__main__']
+        hidden = dict((k, getattr(main, k)) for k in ('__file__', '__spec__')
+                      if hasattr(main, k))
+        for k in hidden:
+            setattr(main, k, None)
+        try:
+            for iface in self.ifaces:
+                p = ctx.Process(target=worker, name='hci' + str(iface), daemon=True,
+                                args=(iface, self.queue, self.replay, self.speed,
+                                      start, self.prefix))
+                p.start()
+                self.procs.append(p)
+        finally:
+            for k, v in hidden.items():
+                setattr(main, k, v)
+        self.running = len(self.procs)
+
+    def stop(self):
+        for p in self.procs:
+            if p.is_alive():
+                p.terminate()
+            p.join(1)
+        self.procs = []
+        self.running = 0
+
+    def add(self, iface, entry, now):
+        t, addr, addrType, rssi, data = entry
+        self.received[iface] += 1
+        METRICS.inc('adapter_frames_total', iface='hci' + str(iface))
+        val = None
+        for d in data:
+            if d[0] == 0xFF:                    # Manufacturer
+                val = d[2]
+        key = (addr, val)
+        p = self.pending.get(key)
+        if p is not None:
+            self.merged += 1
+            if rssi > p[1].rssi:                # より強い受信に置き換え
+                p[1] = ReplayDevice(t, addr, addrType, rssi, data)
+                p[2] = iface
+            return
+        if key in self.done:
+            self.late += 1
+            return
+        self.pending[key] = [now + self.window,
+                             ReplayDevice(t, addr, addrType, rssi, data), iface]
+
+    def emit(self, now, force=False):
+        while self.pending:
+            key, p = next(iter(self.pending.items()))
+            if not force and p[0] > now:
+                break
+            del self.pending[key]
+            self.done[key] = now + self.window * 10
+            self.best[p[2]] += 1
+            dev = p[1]
+            isNewDev = dev.addr not in self.scanned
+            self.scanned[dev.addr] = dev
+            if self.delegate is not None:
+                self.delegate.handleDiscovery(dev, isNewDev, True)
+        while self.done and next(iter(self.done.values())) <= now:
+            self.done.popitem(last=False)       # 古い記録を消去
+
+    def process(self, timeout=10.0):
+        if not self.procs:
+            self.start()
+        end = monotonic() + timeout
+        while True:
+            now = monotonic()
+            wait = end - now
+            if self.pending:
+                wait = min(wait, next(iter(self.pending.values()))[0] - now)
+            try:
+                iface, entries = self.queue.get(timeout=max(wait, 0))
+            except queue.Empty:
+                entries = ()
+            now = monotonic()
+            if entries is None:                 # アダプタの受信が終了
+                self.running -= 1
+                if self.running <= 0:
+                    self.emit(now, force=True)
+                    self.stop()
+                    if self.replay:
+                        raise ReplayFinished()
+                    raise BTLEException('all adapters stopped')
+                continue
+            for entry in entries:
+                self.add(iface, entry, now)
+            self.emit(now)
+            if now >= end:
+                return
+
+    def scan(self, timeout=10):
+        self.clear()
+        try:
+            self.process(timeout)
+        except ReplayFinished:
+            if not self.scanned:
+                raise
+        return list(self.scanned.values())
+
+    def getDevices(self):
+        return list(self.scanned.values())
@@ -0,0 +1,90 @@
+# coding: utf-8
+
+################################################################################
+# 受信データの処理(1回の受信・1回のデコードで複数の出力先へ配信)
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   pipeline = Pipeline([ConsoleSink(), CsvSink()])
+#   stream(pipeline.handle)                 # 受信した広告を各出力先へ
+#   pipeline.close()                        # 出力先の送信待ちを完了させる
+
+import struct
+
+from .dedup import DedupCache
+from .frame import SensorMedal2Frame
+from .metrics import METRICS
+from .prefilter import Prefilter
+from .replay import device_time
+from .state import DeviceTable
+
+class Record:
+    # 出力先へ渡す1回分の受信データ(出力先では変更しないこと)
+    __slots__ = ('t', 'addr', 'rssi', 'payload', 'sensors', 'id')
+
+    def __init__(self, t, addr, rssi, payload, sensors):
+        self.t = t                              # 受信時刻(UNIX時刻)
+        self.addr = addr                        # BLEアドレス
+        self.rssi = rssi
+        self.payload = payload                  # Manufacturerの16進文字列
+        self.sensors = sensors                  # センサ値(辞書型)
+        self.id = int(sensors['ID'], 16)        # メダルのID
+
+class Pipeline:
+    def __init__(self, sinks, dedup=True, max_devices=256, prefilter=None):
+        self.sinks = list(sinks)
+        self.prefilter = prefilter or Prefilter()   # メダル以外の広告を除外
+        self.dedup = DedupCache() if dedup else None
+        self.medals = DeviceTable(max_devices)
+        self.frames = 0                         # 処理したフレーム数
+        self.errors = 0                         # デコードできなかったフレーム数
+
+    def handle(self, dev):
+        if not self.prefilter.check(dev):       # 機器名・アドレスで判定
+            return
+        val = dev.getValueText(0xFF)            # Manufacturer
+        if not val:
+            return
+        t = device_time(dev)
+        if self.dedup is not None and self.dedup.seen(dev.addr, val, t):
+            METRICS.inc('duplicates_total')
+            return
+        try:
+            with METRICS.timer('decode_seconds'):
+                sensors = SensorMedal2Frame.from_hex(val).sensors()
+        except (ValueError, struct.error):
+            self.errors += 1
+            METRICS.inc('decode_errors_total')
+            return
+        sensors['RSSI'] = dev.rssi
+        state = self.medals.update(dev.addr, sensors, dev.rssi, t)
+        METRICS.seq.update(state.id, state.seq)
+        METRICS.inc('frames_total')
+        self.frames += 1
+        with METRICS.timer('publish_seconds'):
+            self.publish(Record(t, dev.addr, dev.rssi, val, sensors))
+
+    def publish(self, record):
+        for sink in self.sinks:
+            sink.put(record)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def get_state(self):                        # チェックポイント用
+        return {'medals': self.medals.get_state(),
+                'dedup': self.dedup.get_state() if self.dedup is not None else None,
+                'seq': dict(METRICS.seq.last),
+                'sinks': dict((sink.name, sink.get_state()) for sink in self.sinks)}
+
+    def set_state(self, state):
+        self.medals.set_state(state['medals'])
+        if self.dedup is not None and state['dedup']:
+            self.dedup.set_state(state['dedup'])
+        METRICS.seq.last.update(state['seq'])
+        for sink in self.sinks:
+            if sink.name in state['sinks']:
+                sink.set_state(state['sinks'][sink.name])
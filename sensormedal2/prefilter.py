@@ -0,0 +1,87 @@
+# coding: utf-8
+
+################################################################################
+# センサメダル以外の広告を早い段階で除外する前処理
+# スマートフォンやビーコン等の広告を、文字列への変換や項目毎の処理をせずに、
+# アドレスの許可・拒否リストと学習済みのアドレスの表で除外します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   prefilter = Prefilter(deny=['4c:00:00:00:00:01'])
+#   def handle(dev):
+#       if not prefilter.check(dev):        # センサメダル以外
+#           return
+#       ...
+#
+#【判定の方法】
+#   1. 拒否リストにあるアドレス、許可リスト(指定時)に無いアドレスは除外
+#   2. 判定済みのアドレスは表を引くだけ(メダル以外はttl秒間は除外)
+#      期限切れの確認は256件の除外毎にまとめて行う(広告毎に時刻を取得しない)
+#   3. 初めてのアドレスは、生データ(dev.scanData)の機器名の先頭を比較
+#      機器名の無い広告は判定せずに除外(次の広告で判定)
+
+from collections import OrderedDict
+from time import monotonic
+
+from .metrics import METRICS
+
+class Prefilter:
+    def __init__(self, allow=None, deny=None, prefix=b'ROHMMedal2',
+                 max_cache=4096, ttl=600):
+        self.allow = set(a.lower() for a in allow) if allow else None
+        self.deny = set(a.lower() for a in deny) if deny else set()
+        self.prefix = prefix                    # メダルの機器名の先頭(バイト列)
+        self.max_cache = max_cache              # 学習するアドレスの最大数
+        self.ttl = ttl                          # メダル以外と判定した有効期間(秒)
+        self.medals = dict()                    # メダルと判定したアドレス
+        self.others = OrderedDict()             # メダル以外のアドレス -> 期限
+        self.passed = 0
+        self.rejected = 0
+        METRICS.gauge('prefilter_passed', lambda: self.passed)
+        METRICS.gauge('prefilter_rejected', lambda: self.rejected)
+
+    def check(self, dev):
+        # センサメダルの広告であればTrue
+        addr = dev.addr
+        if addr in self.others:                 # 周囲の広告の方が多いので先に確認
+            self.rejected += 1
+            if not self.rejected & 0xFF:
+                self.expire()
+            return False
+        if addr in self.medals:
+            self.passed += 1
+            return True
+        if addr in self.deny or (self.allow is not None and addr not in self.allow):
+            self.rejected += 1
+            return False
+        data = getattr(dev, 'scanData', None)
+        if data is None:                        # 生データが無い時
+            name = dev.getValueText(0x08)
+            name = name.encode() if name else None
+        else:
+            name = data.get(0x08) or data.get(0x09)  # Short / Complete Local Name
+        if not name:
+            self.rejected += 1
+            return False
+        if name.startswith(self.prefix):
+            if len(self.medals) >= self.max_cache:
+                self.medals.clear()             # 学習し直す
+            self.medals[addr] = True
+            self.passed += 1
+            return True
+        self.others[addr] = monotonic() + self.ttl
+        while len(self.others) > self.max_cache:
+            self.others.popitem(last=False)     # 古いものから削除
+        self.rejected += 1
+        return False
+
+    def expire(self):
+        # 期限切れのアドレスを削除(アドレスの再利用に備えて再判定する)
+        now = monotonic()
+        while self.others:
+            addr, expire = next(iter(self.others.items()))
+            if expire > now:
+                break
+            del self.others[addr]               # 登録順なので古いものから
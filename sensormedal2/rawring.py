@@ -0,0 +1,187 @@
+# coding: utf-8
+
+################################################################################
+# 受信フレームの生データを保存するリングファイル(メモリマップ)
+# Manufacturerの値・RSSI・受信時刻を固定長の記録として上書きしながら保存し、
+# デコード処理を修正した時などに、後から読み出して処理し直せるようにします。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   書き込み
+#       ring = RingWriter('SensorMedal2.ring', capacity=262144)
+#       ring.append(time(), dev.addr, dev.rssi, val)    # valは16進文字列かバイト列
+#   読み出し(コピーせずに参照)
+#       reader = RingReader('SensorMedal2.ring')
+#       for n, t, addr, rssi, payload in reader:        # 古い順
+#           frame = SensorMedal2Frame(payload)
+#       a = reader.array()                  # NumPyの構造化配列(RING_DTYPE)
+#       for v in reader.views(): ...        # NumPyのビュー(折り返し位置で最大2つ)
+#   コマンドで表示
+#       python3 -m sensormedal2.rawring SensorMedal2.ring [件数]
+#
+#【ファイル形式】
+#   ヘッダ(64バイト)  識別子 'SM2R', 版, 記録長, 記録数, 書き込み総数(uint64)
+#   記録(48バイト)    受信時刻(float64), アドレス(6), RSSI(int8), 長さ(uint8),
+#                     Manufacturer(29), 詰め物(3)
+#   書き込み総数 n 番目の記録は (n % 記録数) 番目の位置に保存されます。
+
+import mmap
+import os
+import struct
+import sys
+
+from .frame import FRAME_DTYPE, FRAME_SIZE
+
+RING_MAGIC = b'SM2R'
+RING_VERSION = 1
+HEADER = struct.Struct('<4sBBHI')               # 識別子, 版, 予備, 記録長, 記録数
+TOTAL = struct.Struct('<Q')                     # 書き込み総数
+TOTAL_OFFSET = 16
+HEADER_SIZE = 64
+RECORD = struct.Struct('<d6sbB%ds3x' % FRAME_SIZE)
+RECORD_HEAD = struct.Struct('<d6sbB')          # 記録のManufacturerより前
+PAYLOAD_OFFSET = 16                             # 記録内のManufacturerの位置
+
+# NumPyで参照する時の構造化データ型(RECORDと同じ並び)
+RING_DTYPE = [
+    ('t', '<f8'), ('addr', 'u1', (6,)), ('rssi', 'i1'), ('length', 'u1'),
+    ('payload', FRAME_DTYPE), ('pad', 'V3'),
+]
+
+def addr_bytes(addr):
+    return bytes.fromhex(addr.replace(':', ''))
+
+def addr_str(b):
+    return ':'.join('%02x' % c for c in b)
+
+class RingWriter:
+    def __init__(self, filename, capacity=262144):
+        self.filename = filename
+        new = not os.path.exists(filename) or os.path.getsize(filename) < HEADER_SIZE
+        if new:
+            with open(filename, 'wb') as fp:    # 全体の大きさのファイルを作成
+                fp.write(HEADER.pack(RING_MAGIC, RING_VERSION, 0, RECORD.size, capacity))
+                fp.truncate(HEADER_SIZE + RECORD.size * capacity)
+        self.fp = open(filename, 'r+b')
+        self.mm = mmap.mmap(self.fp.fileno(), 0)
+        magic, ver, flags, size, self.capacity = HEADER.unpack_from(self.mm)
+        if magic != RING_MAGIC or size != RECORD.size:
+            raise ValueError(filename + ' is not a ring file')
+        self.total = TOTAL.unpack_from(self.mm, TOTAL_OFFSET)[0]
+        self.addrs = dict()                     # アドレスのバイト列(再利用)
+
+    def append(self, t, addr, rssi, payload):
+        if isinstance(payload, str):
+            payload = bytes.fromhex(payload)
+        a = self.addrs.get(addr)
+        if a is None:
+            a = self.addrs[addr] = addr_bytes(addr)
+        off = HEADER_SIZE + (self.total % self.capacity) * RECORD.size
+        RECORD.pack_into(self.mm, off, t, a, rssi, min(len(payload), FRAME_SIZE), payload)
+        self.total += 1
+        TOTAL.pack_into(self.mm, TOTAL_OFFSET, self.total)  # 記録の後に更新
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        if not self.mm.closed:
+            self.mm.flush()
+            self.mm.close()
+            self.fp.close()
+
+class RingReader:
+    def __init__(self, filename):
+        self.fp = open(filename, 'rb')
+        self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, ver, flags, size, self.capacity = HEADER.unpack_from(self.mm)
+        if magic != RING_MAGIC or size != RECORD.size:
+            raise ValueError(filename + ' is not a ring file')
+        self.view = memoryview(self.mm)
+
+    def total(self):                            # 書き込み総数(書き込み中も更新)
+        return TOTAL.unpack_from(self.mm, TOTAL_OFFSET)[0]
+
+    def first(self):                            # 残っている最も古い記録の番号
+        return max(self.total() - self.capacity, 0)
+
+    def __len__(self):
+        return min(self.total(), self.capacity)
+
+    def segments(self, start=None, stop=None):
+        # 番号 start～stop-1 の記録の (位置, 件数) の並び(折り返しで最大2つ)
+        total = self.total()
+        first = max(total - self.capacity, 0)
+        start = first if start is None else max(start, first)
+        stop = total if stop is None else min(stop, total)
+        segs = []
+        while start < stop:
+            i = start % self.capacity
+            n = min(stop - start, self.capacity - i)
+            segs.append((i, n))
+            start += n
+        return segs
+
+    def records(self, start=None, stop=None):
+        # (番号, 時刻, アドレス, RSSI, Manufacturer)を古い順に返す
+        # Manufacturerはファイルを直接参照するmemoryview(コピーしない)
+        n = start if start is not None else self.first()
+        for i, count in self.segments(start, stop):
+            off = HEADER_SIZE + i * RECORD.size
+            for j in range(count):
+                t, addr, rssi, length = RECORD_HEAD.unpack_from(self.mm, off)
+                yield (n, t, addr_str(addr), rssi,
+                       self.view[off + PAYLOAD_OFFSET:off + PAYLOAD_OFFSET + length])
+                off += RECORD.size
+                n += 1
+
+    def __iter__(self):
+        return self.records()
+
+    def views(self, start=None, stop=None):
+        # NumPyの構造化配列のビュー(コピーしない)のリスト
+        import numpy as np                      # 配列で参照する時のみ必要
+        dtype = np.dtype(RING_DTYPE)
+        return [np.frombuffer(self.mm, dtype=dtype, count=n,
+                              offset=HEADER_SIZE + i * RECORD.size)
+                for i, n in self.segments(start, stop)]
+
+    def array(self, start=None, stop=None):
+        # 古い順に並べたNumPyの構造化配列(折り返しがある時のみコピー)
+        import numpy as np
+        v = self.views(start, stop)
+        if len(v) == 1:
+            return v[0]
+        if not v:
+            return np.zeros(0, dtype=np.dtype(RING_DTYPE))
+        return np.concatenate(v)
+
+    def close(self):                            # 参照中のManufacturerを破棄してから
+        self.view.release()
+        self.mm.close()
+        self.fp.close()
+
+def dump(reader, start=None):
+    # CSV形式で表示
+    from datetime import datetime
+    from .frame import SensorMedal2Frame
+    for n, t, addr, rssi, payload in reader.records(start):
+        s = datetime.fromtimestamp(t).strftime('%Y/%m/%d %H:%M:%S.%f')[:-3]
+        s += ', ' + addr + ', ' + str(rssi) + ', ' + payload.hex()
+        if len(payload) == FRAME_SIZE:
+            f = SensorMedal2Frame(payload)
+            s += ', ID=' + str(f.id) + ' SEQ=' + str(f.seq)
+        print(s)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('使用方法:', sys.argv[0], 'ファイル名 [件数]')
+        exit()
+    reader = RingReader(sys.argv[1])
+    total = reader.total()
+    start = total - int(sys.argv[2]) if len(sys.argv) >= 3 else None
+    print('# records:', len(reader), '/', reader.capacity, ' total:', total)
+    dump(reader, start)
+    reader.close()
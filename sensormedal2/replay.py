@@ -0,0 +1,236 @@
+# coding: utf-8
+
+################################################################################
+# BLE広告の記録と再生
+# 受信した広告をファイルへ記録し、btle.Scannerの代わりに再生します。
+# センサメダルやBLEアダプタが無くても動作確認や負荷試験ができます。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   記録(ロガーの実行時)
+#       sudo SENSORMEDAL2_CAPTURE=capture.jsonl ./ble_logger_SensorMedal2.py
+#   再生(sudo不要)
+#       SENSORMEDAL2_REPLAY=capture.jsonl ./ble_logger_SensorMedal2.py
+#   擬似メダル100台 x 1Hz を最高速度で再生
+#       SENSORMEDAL2_REPLAY=fleet:100:1 SENSORMEDAL2_SPEED=0 ./ble_logger_SensorMedal2.py
+#   擬似メダルの記録ファイルを作成(メダル数, 送信頻度Hz, 秒数)
+#       python3 -m sensormedal2.replay fleet.jsonl 100 1 60
+#
+#【記録ファイルの形式】
+#   1行に1つの広告をJSON形式で記録します
+#   {"t":受信時刻, "addr":アドレス, "addrType":種別, "rssi":RSSI,
+#    "data":[[adtype, desc, value], ...]}
+
+import atexit
+import json
+import math
+import random
+import sys
+from time import monotonic, sleep, time
+
+from .frame import FRAME
+
+class ReplayFinished(Exception):                # 再生データの終了
+    pass
+
+class Recorder:
+    def __init__(self, filename):
+        self.fp = open(filename, 'a')
+        self.count = 0
+        atexit.register(self.close)
+
+    def record(self, dev, t=None):
+        self.fp.write(json.dumps({
+            't': time() if t is None else t, 'addr': dev.addr,
+            'addrType': dev.addrType, 'rssi': dev.rssi,
+            'data': [list(d) for d in dev.getScanData()]}) + '\n')
+        self.count += 1
+
+    def close(self):
+        if not self.fp.closed:
+            self.fp.close()
+
+class ReplayDevice:
+    # bluepyのScanEntryと同じ使い方ができる受信データ
+    __slots__ = ('t', 'addr', 'addrType', 'rssi', 'data', 'scanData')
+
+    def __init__(self, t, addr, addrType, rssi, data):
+        self.t = t
+        self.addr = addr
+        self.addrType = addrType
+        self.rssi = rssi
+        self.data = data                        # [(adtype, desc, value), ...]
+        self.scanData = dict()                  # adtype毎の生データ
+        for adtype, desc, val in data:
+            if adtype in (0x08, 0x09):          # 機器名は文字列
+                self.scanData[adtype] = val.encode()
+                continue
+            try:
+                self.scanData[adtype] = bytes.fromhex(val)
+            except ValueError:
+                self.scanData[adtype] = val.encode()
+
+    def getScanData(self):
+        return [tuple(d) for d in self.data]
+
+    def getValueText(self, adtype):
+        for d in self.data:
+            if d[0] == adtype:
+                return d[2]
+        return None
+
+def device_time(dev):
+    # 受信時刻(再生時は記録された時刻)
+    t = getattr(dev, 't', None)
+    return time() if t is None else t
+
+def load(filename):
+    # 記録ファイルからReplayDeviceを順に読み出す
+    with open(filename) as fp:
+        for line in fp:
+            try:
+                d = json.loads(line)
+            except ValueError:
+                continue
+            yield ReplayDevice(d['t'], d['addr'], d['addrType'], d['rssi'],
+                               d['data'])
+
+def medal_payload(dev_id, seq, t):
+    # 擬似センサメダルのManufacturerデータ(16進文字列)を作成
+    w = math.sin(t / 600 + dev_id)
+    temp = int((25 + 5 * w + 45) * 65536 / 175)
+    humi = int((50 + 10 * w) * 65536 / 100)
+    press = int((1000 + 10 * w) * 2048)
+    illum = int((300 + 200 * w) * 1.2)
+    return FRAME.pack(dev_id, temp, humi, seq & 0xFF, 0x02,
+                      int(0.1 * w * 4096), 0, 4096, -224, 5, -626,
+                      press & 0xFFFF, press >> 16, illum, 0x03,
+                      int(t) % 65536, 90).hex()
+
+def fleet(medals=10, hz=1.0, duration=None, start=None, repeat=1, others=0,
+          seed=None):
+    # 擬似メダル medals台が hz回/秒 で送信する広告を時刻順に作成
+    #   repeat: 同じSEQの送信回数  others: メダル以外の機器の台数
+    #   seed:   指定時はRSSIを揺らし、1割の広告を欠落させる(アダプタ毎の違い)
+    if start is None:
+        start = time()
+    rnd = random.Random(seed) if seed is not None else None
+    period = 1 / hz
+    n = 0
+    while duration is None or n * period < duration:
+        for i in range(medals):
+            t = start + n * period + period * i / medals
+            data = [(0x08, 'Short Local Name', 'ROHMMedal2_%04d_01.00' % (i + 1)),
+                    (0x01, 'Flags', '06'),
+                    (0xFF, 'Manufacturer', medal_payload(i + 1, n, t))]
+            rssi = -50 - i % 40
+            if rnd is not None:
+                if rnd.random() < 0.1:
+                    continue
+                rssi += rnd.randint(-6, 6)
+            for r in range(repeat):
+                yield ReplayDevice(t, 'ff:e0:9b:%02x:%02x:%02x' % (i >> 16, (i >> 8) & 0xFF, i & 0xFF),
+                                   'random', rssi, data)
+        for i in range(others):                 # スマートフォン等を想定
+            t = start + n * period + period * (i + 0.5) / max(others, 1)
+            yield ReplayDevice(t, '4c:00:00:%02x:%02x:%02x' % (i >> 16, (i >> 8) & 0xFF, i & 0xFF),
+                               'random', -70, [(0x01, 'Flags', '1a'),
+                               (0xFF, 'Manufacturer', '4c0010050b1c0a1b2c')])
+        n += 1
+
+def source(name, start=None, seed=None):
+    # 'fleet:メダル数:Hz[:秒数]' または記録ファイル名
+    if name.startswith('fleet:'):
+        args = name.split(':')[1:]
+        return fleet(int(args[0]), float(args[1]) if len(args) > 1 else 1.0,
+                     float(args[2]) if len(args) > 2 else None,
+                     start=start, seed=seed)
+    return load(name)
+
+class ReplayScanner:
+    # btle.Scannerの代わりに記録ファイルや擬似メダルの広告を再生
+    #   speed: 1.0で実時間, 2.0で2倍速, 0で待ち時間なし(最高速度)
+    def __init__(self, devices, speed=1.0):
+        self.devices = iter(devices)
+        self.speed = speed
+        self.delegate = None
+        self.scanned = dict()
+        self.next = None
+        self.t0 = None                          # 再生開始時の記録時刻
+        self.clock0 = None                      # 再生開始時の実時刻
+        self.count = 0                          # 再生した広告数
+        self.stopped = False                    # stop()で受信を休止中
+        self.missed = 0                         # 休止中に送信された広告数
+
+    def withDelegate(self, delegate):
+        self.delegate = delegate
+        return self
+
+    def clear(self):
+        self.scanned = dict()
+
+    def start(self, passive=False):
+        if self.stopped and self.speed and self.t0 is not None:
+            # 休止中に送信された広告は受信できない
+            while True:
+                dev = self.next if self.next is not None else next(self.devices, None)
+                self.next = dev
+                if dev is None or self.clock0 + (dev.t - self.t0) / self.speed >= monotonic():
+                    break
+                self.next = None
+                self.missed += 1
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    def process(self, timeout=10.0):
+        end = monotonic() + timeout
+        while True:
+            if self.next is None:
+                self.next = next(self.devices, None)
+                if self.next is None:
+                    raise ReplayFinished()
+            dev = self.next
+            if self.t0 is None:
+                self.t0 = dev.t
+                self.clock0 = monotonic()
+            if self.speed:
+                due = self.clock0 + (dev.t - self.t0) / self.speed
+                if due > end:
+                    sleep(max(end - monotonic(), 0))
+                    return
+                if due > monotonic():
+                    sleep(due - monotonic())
+            elif monotonic() > end:
+                return
+            self.next = None
+            self.count += 1
+            isNewDev = dev.addr not in self.scanned
+            self.scanned[dev.addr] = dev
+            if self.delegate is not None:
+                self.delegate.handleDiscovery(dev, isNewDev, True)
+
+    def scan(self, timeout=10):
+        self.clear()
+        try:
+            self.process(timeout)
+        except ReplayFinished:
+            if not self.scanned:
+                raise
+        return list(self.scanned.values())
+
+    def getDevices(self):
+        return list(self.scanned.values())
+
+if __name__ == '__main__':
+    if len(sys.argv) < 5:
+        print('使用方法:', sys.argv[0], 'ファイル名 メダル数 Hz 秒数')
+        exit()
+    rec = Recorder(sys.argv[1])
+    for dev in fleet(int(sys.argv[2]), float(sys.argv[3]), float(sys.argv[4])):
+        rec.record(dev, dev.t)
+    rec.close()
+    print(rec.count, '件の広告を', sys.argv[1], 'へ記録しました')
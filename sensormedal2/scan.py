@@ -0,0 +1,118 @@
+# coding: utf-8
+
+################################################################################
+# BLE 連続受信(ストリーミング)処理
+# scanner.scan(interval)の受信窓を待たずに、受信した広告を即座に処理します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   def handle(dev):                        # 広告を受信する度に呼ばれる
+#       print(dev.addr, dev.rssi)
+#   stream(handle)
+#   stream(handle, iface=[0, 1])            # 複数のアダプタで受信(multiscan.py)
+#   stream(handle, duty=DutyCycle())        # 受信の間欠動作(dutycycle.py)
+#
+#【記録と再生】(sensormedal2/replay.py)
+#   SENSORMEDAL2_CAPTURE=ファイル名     受信した広告をファイルへ記録
+#   SENSORMEDAL2_REPLAY=ファイル名      BLEの代わりに記録ファイルを再生
+#   SENSORMEDAL2_REPLAY=fleet:台数:Hz   BLEの代わりに擬似メダルを再生
+#   SENSORMEDAL2_SPEED=倍率             再生速度(0で最高速度, 省略時は実時間)
+#
+#【参考文献】
+#   https://ianharvey.github.io/bluepy-doc/scanner.html
+#   https://ianharvey.github.io/bluepy-doc/delegate.html
+
+import getpass
+import os
+from sys import argv
+from time import sleep, time
+
+try:
+    from bluepy import btle
+    DefaultDelegate = btle.DefaultDelegate
+    BTLEException = btle.BTLEException
+except ImportError:                             # 再生のみで使用する場合
+    btle = None
+    DefaultDelegate = object
+    class BTLEException(Exception):
+        pass
+
+from .replay import ReplayFinished, ReplayScanner, Recorder, source
+
+class StreamDelegate(DefaultDelegate):
+    def __init__(self, callback):
+        DefaultDelegate.__init__(self)
+        self.callback = callback
+
+    def handleDiscovery(self, dev, isNewDev, isNewData):
+        if isNewDev or isNewData:               # 新しい機器か内容が変化した時
+            self.callback(dev)
+
+def open_scanner(iface=0):
+    # 環境変数SENSORMEDAL2_REPLAYが設定されていれば再生用のScannerを返す
+    if isinstance(iface, (list, tuple)) and len(iface) > 1:
+        from .multiscan import MultiScanner
+        return MultiScanner(iface)
+    if isinstance(iface, (list, tuple)):
+        iface = iface[0]
+    replay = os.environ.get('SENSORMEDAL2_REPLAY')
+    if replay:
+        return ReplayScanner(source(replay),
+                             float(os.environ.get('SENSORMEDAL2_SPEED', 1)))
+    return btle.Scanner(iface)
+
+def stream(callback, iface=0, timeout=1, clear_interval=60, scanner=None,
+           duty=None):
+    # 受信した広告を逐次callback(dev)へ渡す(再生時は終了時に戻ります)
+    if scanner is None:
+        scanner = open_scanner(iface)
+    capture = os.environ.get('SENSORMEDAL2_CAPTURE')
+    if capture:
+        recorder = Recorder(capture)
+        def handle(dev):
+            recorder.record(dev)
+            callback(dev)
+    else:
+        handle = callback
+    if duty is not None:                        # 受信間隔の学習
+        received = handle
+        def handle(dev):
+            duty.observe(dev)
+            received(dev)
+        timeout = min(timeout, duty.slice)
+    scanner.withDelegate(StreamDelegate(handle))
+    started = False
+    cleared = time()
+    while True:
+        try:
+            if not started:
+                scanner.clear()
+                scanner.start()
+                started = True
+            scanner.process(timeout)            # timeout秒だけ受信処理を実行
+            if duty is not None:
+                pause = duty.plan()
+                if pause > 0:                   # 次の送信の予想時刻まで休止
+                    duty.pausing(time(), pause)
+                    scanner.stop()
+                    started = False
+                    sleep(pause)
+        except ReplayFinished:
+            return
+        except BTLEException as e:
+            print("ERROR",e)
+            if getpass.getuser() != 'root':
+                print('使用方法: sudo', argv[0])
+                exit()
+            try:
+                scanner.stop()
+            except Exception:
+                pass
+            started = False
+            sleep(timeout)
+            continue
+        if time() - cleared >= clear_interval:  # 受信済み機器の一覧を定期的に消去
+            scanner.clear()
+            cleared = time()
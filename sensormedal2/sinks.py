@@ -0,0 +1,411 @@
+# coding: utf-8
+
+################################################################################
+# 受信データの出力先(画面表示・CSV保存・UDP送信・Ambient送信・アーカイブ・履歴・生データ・
+# SQLite)
+# 出力先毎にキューとスレッドを持ち、遅い出力先が他を止めないようにします。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【出力先の追加方法】
+#   class MySink(Sink):
+#       name = 'my'
+#       def write(self, record):            # 出力先のスレッドで実行される
+#           print(record.sensors['Temperature'])
+
+import datetime
+import os
+import queue
+import threading
+from time import monotonic, time
+
+from .aggregate import TumblingWindow, summarize
+from .ambient import AmbientUploader
+from .archive import ArchiveWriter
+from .channels import AmbientScheduler
+from .csvwriter import CsvWriter
+from .database import SqliteWriter
+from .history import History
+from .metrics import METRICS
+from .rawring import RingWriter
+from .udp import UdpSender
+
+class Sink:
+    name = 'sink'
+    tick_interval = None                        # tick()を実行する間隔(秒)
+    state_objects = ()                          # チェックポイントに保存する
+    state_values = ()                           #   属性(get_state()を持つ物と値)
+
+    def __init__(self, maxsize=1024):
+        self.queue = queue.Queue(maxsize)       # 出力待ちのRecord
+        self.processed = 0                      # 出力したRecord数
+        self.dropped = 0                        # キュー満杯で破棄したRecord数
+        self.errors = 0
+        self.ticked = monotonic()
+        self.lock = threading.Lock()            # write()・tick()・close()の排他
+        self.timer = METRICS.timer('sink_write_seconds', sink=self.name)
+        METRICS.gauge('queue_depth', self.queue.qsize, queue=self.name)
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            METRICS.inc('sink_dropped_total', sink=self.name)
+
+    def call(self, func, *args):
+        try:
+            with self.lock:
+                func(*args)
+            return True
+        except Exception as e:                  # 例外処理発生時
+            self.errors += 1
+            print(self.name, e)                 # エラー内容を表示
+            return False
+
+    def run(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=self.tick_interval)
+            except queue.Empty:
+                record = None
+            if record is not None:
+                with self.timer:
+                    ok = self.call(self.write, record)
+                if ok:
+                    self.processed += 1
+                self.queue.task_done()
+            if self.tick_interval and monotonic() - self.ticked >= self.tick_interval:
+                self.ticked = monotonic()
+                self.call(self.tick)
+
+    def write(self, record):
+        raise NotImplementedError
+
+    def tick(self):                             # 定期的な処理(集計結果の出力等)
+        pass
+
+    def close(self):                            # 出力待ちが無くなるまで待つ
+        self.queue.join()
+
+    def get_state(self):
+        # 出力待ちのRecordと集計途中の値等(チェックポイント用)
+        with self.queue.mutex:
+            state = {'queue': list(self.queue.queue)}
+        with self.lock:
+            for k in self.state_objects:
+                if getattr(self, k) is not None:
+                    state[k] = getattr(self, k).get_state()
+            for k in self.state_values:
+                state[k] = getattr(self, k)
+        return state
+
+    def set_state(self, state):
+        with self.lock:
+            for k in self.state_objects:
+                if k in state and getattr(self, k) is not None:
+                    getattr(self, k).set_state(state[k])
+            for k in self.state_values:
+                if k in state:
+                    setattr(self, k, state[k])
+        for record in state.get('queue', ()):
+            self.put(record)
+
+def console_lines(record):
+    sensors = record.sensors
+    return [
+        '\nDevice %s, RSSI=%d dB' % (record.addr, record.rssi),
+        '    ID            = ' + sensors['ID'],
+        '    SEQ           = ' + str(sensors['SEQ']),
+        '    Temperature   = ' + str(round(sensors['Temperature'],2)) + ' ℃',
+        '    Humidity      = ' + str(round(sensors['Humidity'],2)) + ' %',
+        '    Pressure      = ' + str(round(sensors['Pressure'],3)) + ' hPa',
+        '    Illuminance   = ' + str(round(sensors['Illuminance'],1)) + ' lx',
+        '    Accelerometer = ' + str(round(sensors['Accelerometer'],3)) + ' g ( '
+            + str(round(sensors['Accelerometer X'],3)) + ' '
+            + str(round(sensors['Accelerometer Y'],3)) + ' '
+            + str(round(sensors['Accelerometer Z'],3)) + ' g)',
+        '    Geomagnetic   = ' + str(round(sensors['Geomagnetic'],1)) + ' uT ( '
+            + str(round(sensors['Geomagnetic X'],1)) + ' '
+            + str(round(sensors['Geomagnetic Y'],1)) + ' '
+            + str(round(sensors['Geomagnetic Z'],1)) + ' uT)',
+        '    Magnetic      = ' + sensors['Magnetic'],
+        '    Steps         = ' + str(sensors['Steps']) + ' 歩',
+        '    Battery Level = ' + str(sensors['Battery Level']) + ' %',
+        '    RSSI          = ' + str(sensors['RSSI']) + ' dB',
+    ]
+
+class ConsoleSink(Sink):
+    name = 'console'
+
+    def write(self, record):
+        print('\n'.join(console_lines(record)))
+
+def csv_lines(record, filename='SensorMedal2.csv'):
+    # ble_logger_SensorMedal2_save.pyと同じ形式の(ファイル名, 行)のリスト
+    sensors = record.sensors
+    date = datetime.datetime.fromtimestamp(record.t).strftime('%Y/%m/%d %H:%M')
+    s = date + ', SensorMedal2'
+    s += ', ' + str(record.id)
+    s += ', ' + str(sensors['SEQ'])
+    for key in ('Temperature', 'Humidity', 'Pressure', 'Illuminance',
+                'Accelerometer', 'Accelerometer X', 'Accelerometer Y',
+                'Accelerometer Z', 'Geomagnetic', 'Geomagnetic X',
+                'Geomagnetic Y', 'Geomagnetic Z'):
+        s += ', ' + str(sensors[key])
+    s += ', ' + str(int(sensors['Magnetic'],16))
+    s += ', ' + str(sensors['Steps'])
+    s += ', ' + str(sensors['Battery Level'])
+    s += ', ' + str(sensors['RSSI'])
+    lines = [(filename, s)]
+
+    # センサ個別値のファイル
+    for sensor in sensors:
+        if sensor.find(' ') >= 0 or len(sensor) <= 5 or sensor == 'Magnetic':
+            continue
+        s = date + ', ' + sensor
+        s += ', ' + str(sensors[sensor])
+        if sensor == 'Accelerometer' or sensor == 'Geomagnetic':
+            s += ', ' + str(sensors[sensor + ' X'])
+            s += ', ' + str(sensors[sensor + ' Y'])
+            s += ', ' + str(sensors[sensor + ' Z'])
+        lines.append((sensor + '.csv', s))
+    return lines
+
+class CsvSink(Sink):
+    name = 'csv'
+    tick_interval = 1
+    state_objects = ('change',)
+
+    def __init__(self, filename='SensorMedal2.csv', username=None, change=None,
+                 **writer_args):
+        self.filename = filename
+        self.writer = CsvWriter(username, **writer_args)
+        self.change = change                    # ChangeFilter(変化した時のみ保存)
+        Sink.__init__(self)
+
+    def write(self, record):
+        for filename, s in csv_lines(record, self.filename):
+            if self.change:                     # ファイル毎に変化を確認
+                group = 'all' if filename == self.filename \
+                        else os.path.splitext(filename)[0]
+                if not self.change.changed(record.id, record.sensors, group, record.t):
+                    continue
+            self.writer.write(filename, s)
+
+    def tick(self):                             # 受信が途絶えた時も書き込む
+        self.writer.tick()
+
+    def close(self):
+        Sink.close(self)
+        with self.lock:                         # tick()と同時に書き込まない
+            self.writer.close()
+
+def udp_lines(sensors, n, device_s='medal'):
+    # ble_logger_SensorMedal2_udp_tx.pyと同じ形式のUDP送信データ
+    s1 = 'illum_' + n
+    s1 += ',' + str(round(sensors['Illuminance'],0))
+    s2 = 'envir_' + n
+    s2 += ',' + str(round(sensors['Temperature'],1))
+    s2 += ',' + str(round(sensors['Humidity'],0))
+    s2 += ',' + str(round(sensors['Pressure'],0))
+    s3 = 'accem_' + n
+    s3 += ',' + str(round(sensors['Accelerometer X'],0))
+    s3 += ',' + str(round(sensors['Accelerometer Y'],0))
+    s3 += ',' + str(round(sensors['Accelerometer Z'],0))
+    s4 = device_s[0:5] + '_' + n
+    s4 += ',' + str(round(sensors['Accelerometer'],0))
+    s4 += ',' + str(round(sensors['Geomagnetic'],0))
+    s4 += ',' + str(int(sensors['Magnetic'],16))
+    s4 += ',' + str(sensors['Battery Level'])
+    s4 += ',' + str(sensors['Steps'])
+    s4 += ',' + str(sensors['RSSI'])
+    return [s1, s2, s3, s4]
+
+UDP_GROUPS = ('illum', 'envir', 'accem', 'medal')  # udp_lines()の順
+
+class UdpSink(Sink):
+    name = 'udp'
+    state_objects = ('tumbling', 'change')
+
+    def __init__(self, udp_to='255.255.255.255', udp_port=1024, device_s='medal',
+                 device_n=None, interval=None, aggregate='mean', change=None,
+                 **sender_args):
+        self.device_s = device_s
+        self.device_n = device_n                # NoneでメダルのID下1桁
+        self.change = change                    # ChangeFilter(変化した時のみ送信)
+        self.sender = UdpSender(udp_to, udp_port, **sender_args)
+        self.aggregate = aggregate
+        self.tumbling = None
+        if interval:                            # interval秒毎に集計値を送信
+            self.tumbling = TumblingWindow(interval, self.send_stats)
+            self.tick_interval = 1
+        Sink.__init__(self)
+
+    def send(self, dev_id, sensors, t=None):
+        n = self.device_n[0] if self.device_n else str(dev_id % 10)
+        for group, s in zip(UDP_GROUPS, udp_lines(sensors, n, self.device_s)):
+            if self.change and not self.change.changed(dev_id, sensors, group, t):
+                continue
+            self.sender.send(s)
+
+    def send_stats(self, dev_id, start, stats):
+        self.send(dev_id, summarize(stats, self.aggregate), start)
+
+    def write(self, record):
+        if self.tumbling:
+            self.tumbling.add(record)
+        else:
+            self.send(record.id, record.sensors, record.t)
+
+    def tick(self):
+        self.tumbling.flush()
+
+    def close(self):
+        Sink.close(self)
+        if self.tumbling:
+            with self.lock:
+                self.tumbling.flush(force=True)
+        self.sender.join()
+
+def ambient_data(sensors):
+    return {
+        'd1': sensors['Temperature'],
+        'd2': sensors['Humidity'],
+        'd3': sensors['Pressure'],
+        'd4': sensors['Illuminance'],
+        'd5': sensors['Accelerometer Z'],       # Z軸：基板に垂直
+        'd6': sensors['Geomagnetic X'],         # BLEモジュールが北側
+        'd7': sensors['Steps'],
+        'd8': sensors['Battery Level'],
+    }
+
+class AmbientSink(Sink):
+    name = 'ambient'
+    state_objects = ('tumbling',)
+    state_values = ('ambient_id', 'sent')
+
+    def __init__(self, chid, wkey, interval=30, ambient_id=None, aggregate=None,
+                 **uploader_args):
+        self.interval = max(interval, 30)       # Ambientへの送信間隔
+        self.ambient_id = ambient_id            # Noneは最初に受信したメダル
+        self.aggregate = aggregate              # 'mean','min','max'で集計値を送信
+        self.sent = None
+        self.uploader = AmbientUploader(chid, wkey, **uploader_args)
+        self.tumbling = None
+        if aggregate:
+            self.tumbling = TumblingWindow(self.interval, self.send_stats)
+            self.tick_interval = 1
+        Sink.__init__(self)
+
+    def send_stats(self, dev_id, start, stats):
+        self.uploader.send(ambient_data(summarize(stats, self.aggregate)), start)
+
+    def write(self, record):
+        if self.ambient_id is None:
+            self.ambient_id = record.id
+        if record.id != self.ambient_id:
+            return
+        if self.tumbling:                       # 送信間隔内の値を集計
+            self.tumbling.add(record)
+            return
+        if self.sent is not None and 0 <= record.t - self.sent < self.interval:
+            return
+        self.sent = record.t                    # 最後に送信した受信時刻
+        self.uploader.send(ambient_data(record.sensors), record.t)
+
+    def tick(self):
+        self.tumbling.flush()
+
+    def close(self):
+        Sink.close(self)
+        if self.tumbling:
+            with self.lock:
+                self.tumbling.flush(force=True)
+        self.uploader.flush(10)
+
+class AmbientChannelsSink(Sink):
+    # 多数のメダルを複数のチャネルへ振り分けて送信(sensormedal2/channels.py)
+    name = 'ambient'
+    tick_interval = 1
+    state_objects = ('scheduler',)
+
+    def __init__(self, channels, aggregate='mean', **channel_args):
+        self.scheduler = AmbientScheduler(channels, aggregate, **channel_args)
+        Sink.__init__(self)
+
+    def write(self, record):
+        self.scheduler.add(record)
+        self.scheduler.poll(record.t)
+
+    def tick(self):                             # 受信が途絶えたメダルの集計も送信
+        self.scheduler.poll(time())
+
+    def close(self):
+        Sink.close(self)
+        self.scheduler.flush(10)
+
+class ArchiveSink(Sink):
+    name = 'archive'
+    tick_interval = 1
+
+    def __init__(self, filename='SensorMedal2.sm2', **archive_args):
+        self.archive = ArchiveWriter(filename, **archive_args)
+        Sink.__init__(self)
+
+    def write(self, record):
+        self.archive.append(record.t, record.payload, record.rssi)
+
+    def tick(self):
+        self.archive.tick()
+
+    def close(self):
+        Sink.close(self)
+        with self.lock:                         # tick()と同時に書き出さない
+            self.archive.close()
+
+class HistorySink(Sink):
+    name = 'history'
+
+    def __init__(self, size=3600, max_devices=256, window=300):
+        self.history = History(size, max_devices, window)
+        Sink.__init__(self)
+
+    def write(self, record):
+        self.history.add(record)
+
+class RawRingSink(Sink):
+    name = 'raw'
+
+    def __init__(self, filename='SensorMedal2.ring', capacity=262144):
+        self.ring = RingWriter(filename, capacity)
+        Sink.__init__(self, maxsize=8192)
+
+    def write(self, record):
+        self.ring.append(record.t, record.addr, record.rssi, record.payload)
+
+    def close(self):
+        Sink.close(self)
+        self.ring.close()
+
+class SqliteSink(Sink):
+    name = 'sqlite'
+    tick_interval = 1
+
+    def __init__(self, filename='SensorMedal2.db', **writer_args):
+        self.db = SqliteWriter(filename, **writer_args)
+        Sink.__init__(self, maxsize=8192)
+
+    def write(self, record):
+        self.db.append(record.t, record.addr, record.sensors)
+
+    def tick(self):
+        self.db.tick()
+
+    def close(self):
+        Sink.close(self)
+        with self.lock:
+            self.db.close()
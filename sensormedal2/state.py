@@ -0,0 +1,96 @@
+# coding: utf-8
+
+################################################################################
+# センサメダル毎の状態管理
+# 複数のメダルの最新値・SEQ・受信時刻・RSSIをアドレス毎に保持します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   table = DeviceTable(max_devices=256)
+#   state = table.update(dev.addr, sensors, dev.rssi)
+#   print(state.id, state.seq, state.sensors['Temperature'])
+#   for state in table: ...                 # 最近受信した順(古い順)
+
+from collections import OrderedDict
+from time import time
+
+class DeviceState:
+    __slots__ = ('addr', 'id', 'sensors', 'seq', 'first_seen', 'last_seen',
+                 'rssi', 'count')
+
+    def __init__(self, addr, t):
+        self.addr = addr
+        self.id = None                          # メダルのID(整数)
+        self.sensors = None                     # 最新のセンサ値(辞書型)
+        self.seq = None                         # 最新のSEQ
+        self.first_seen = t                     # 最初の受信時刻
+        self.last_seen = t                      # 最後の受信時刻
+        self.rssi = None
+        self.count = 0                          # 受信回数
+
+class DeviceTable:
+    def __init__(self, max_devices=256):
+        self.max_devices = max_devices          # 保持する最大台数
+        self.devices = OrderedDict()            # アドレス毎のDeviceState
+        self.ids = dict()                       # ID -> アドレス
+
+    def update(self, addr, sensors, rssi=None, t=None):
+        if t is None:
+            t = time()
+        state = self.devices.get(addr)
+        if state is None:
+            state = self.devices[addr] = DeviceState(addr, t)
+            while len(self.devices) > self.max_devices:
+                self.remove(next(iter(self.devices)))   # 最も古いメダルを削除
+        else:
+            self.devices.move_to_end(addr)
+        state.sensors = sensors
+        state.id = int(sensors['ID'], 16)
+        state.seq = sensors['SEQ']
+        state.last_seen = t
+        state.rssi = rssi
+        state.count += 1
+        self.ids[state.id] = addr
+        return state
+
+    def get(self, addr):
+        return self.devices.get(addr)
+
+    def by_id(self, dev_id):
+        addr = self.ids.get(dev_id)
+        return None if addr is None else self.devices.get(addr)
+
+    def remove(self, addr):
+        state = self.devices.pop(addr, None)
+        if state is not None and self.ids.get(state.id) == addr:
+            del self.ids[state.id]
+
+    def expire(self, age, t=None):
+        # age秒以上受信していないメダルを削除
+        if t is None:
+            t = time()
+        while self.devices:
+            state = next(iter(self.devices.values()))
+            if t - state.last_seen < age:
+                break
+            self.remove(state.addr)
+
+    def get_state(self):                        # チェックポイント用
+        return [tuple(getattr(state, k) for k in DeviceState.__slots__)
+                for state in list(self.devices.values())]
+
+    def set_state(self, states):
+        for values in states:
+            state = DeviceState(values[0], values[4])
+            for k, v in zip(DeviceState.__slots__, values):
+                setattr(state, k, v)
+            self.devices[state.addr] = state
+            self.ids[state.id] = state.addr
+
+    def __iter__(self):
+        return iter(list(self.devices.values()))
+
+    def __len__(self):
+        return len(self.devices)
@@ -0,0 +1,91 @@
+# coding: utf-8
+
+################################################################################
+# UDP送信処理(キュー付き)
+# 1つのソケットと1つの送信スレッドで、キューに入ったデータを順に送信します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【使い方】
+#   udp = UdpSender('255.255.255.255', 1024, pace=0.1)
+#   udp.send('illum_3,93.0')                # キューへ入れてすぐに戻る
+#
+#【設定】
+#   pace        送信間隔(秒)
+#   coalesce    1つのUDPパケットへまとめる最大バイト数(0でまとめない)
+#               まとめた場合は、データを改行で区切って送信します
+#   block       キューが満杯のときに空くまで待つ(Falseのときは破棄)
+
+import queue
+import socket
+import threading
+from time import sleep
+
+from .metrics import METRICS
+
+class UdpSender:
+    def __init__(self, udp_to='255.255.255.255', udp_port=1024, pace=0.1,
+                 maxsize=256, coalesce=0, block=False, verbose=True):
+        self.addr = (udp_to, udp_port)
+        self.pace = pace
+        self.coalesce = coalesce
+        self.block = block
+        self.verbose = verbose
+        self.queue = queue.Queue(maxsize)
+        self.sent = 0                           # 送信したデータ数
+        self.packets = 0                        # 送信したパケット数
+        self.dropped = 0                        # キュー満杯で破棄したデータ数
+        self.errors = 0                         # 送信エラー数
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # ソケット作成
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.timer = METRICS.timer('udp_send_seconds')
+        METRICS.gauge('queue_depth', self.queue.qsize, queue='udp_tx')
+        self.thread = threading.Thread(target=self.run, name='udp_tx', daemon=True)
+        self.thread.start()
+
+    def send(self, s):
+        try:
+            self.queue.put(s, block=self.block)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            METRICS.inc('udp_dropped_total')
+            if self.verbose:
+                print('送信待ちが満杯のため破棄 (累計', self.dropped, '件)')
+            return False
+
+    def next_packet(self):
+        s = self.queue.get()
+        n = 1
+        if self.coalesce:                       # 待機中のデータをまとめる
+            size = len(s.encode()) + 1
+            while not self.queue.empty():
+                peek = self.queue.queue[0]
+                if size + len(peek.encode()) + 1 > self.coalesce:
+                    break
+                s += '\n' + self.queue.get_nowait()
+                size += len(peek.encode()) + 1
+                n += 1
+        return s, n
+
+    def run(self):
+        while True:
+            s, n = self.next_packet()
+            if self.verbose:
+                print(threading.current_thread().name, 'send :', s)
+            try:
+                with self.timer:
+                    self.sock.sendto((s + '\n').encode(), self.addr)  # UDP送信
+                self.sent += n
+                self.packets += 1
+            except Exception as e:                # 例外処理発生時
+                self.errors += 1
+                print(e)                          # エラー内容を表示
+            for i in range(n):
+                self.queue.task_done()
+            if self.pace:
+                sleep(self.pace)                  # 送信間隔の調整
+
+    def join(self):                             # キューが空になるまで待つ
+        self.queue.join()
@@ -0,0 +1,70 @@
+# coding: utf-8
+
+################################################################################
+# 列形式アーカイブの試験
+# データ部に識別子(SM2A)と同じバイト列を含むブロックを読めること、書き込み途中や
+# 破損したブロックを読み飛ばして後続のブロックを読めることを確認します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【実行方法】
+#   python3 -m pytest -q tests
+
+from sensormedal2.archive import (BLOCK_HEAD, BLOCK_MAGIC, MINMAX, ArchiveReader,
+                                  ArchiveWriter)
+from sensormedal2.bench import payloads
+
+HEAD_LEN = BLOCK_HEAD.size + MINMAX.size
+
+def values(accel_x):
+    # 保存用の整数の並び(COLUMNSの順)
+    return (26000, 30000, 1, 0, accel_x, 0, 4096, 0, 0, 0, 2048000, 120, 3, 0, 90, -60)
+
+def write_blocks(path, blocks=10, rows=10):
+    writer = ArchiveWriter(str(path), block_size=rows)
+    for i, p in enumerate(payloads(blocks * rows, medals=1)):
+        writer.append(1.6e9 + i, p, -50)
+    writer.close()
+    reader = ArchiveReader(str(path))
+    starts = [b[5] - HEAD_LEN for b in reader.index]
+    reader.close()
+    return starts
+
+def test_magic_in_payload(tmp_path):
+    path = tmp_path / 'magic.sm2'
+    writer = ArchiveWriter(str(path), compress=False)
+    writer.append_values(1.6e9, 1, values(0x4d53))  # accel_x の列が b'SM2A' になる
+    writer.append_values(1.6e9 + 1, 1, values(0x4132))
+    writer.close()
+    assert BLOCK_MAGIC in path.read_bytes()[4:]
+    reader = ArchiveReader(str(path))
+    assert len(reader.index) == 1
+    assert reader.skipped == 0
+    assert reader.query(columns=['accel_x'])['accel_x'] == [0x4d53 / 4096, 0x4132 / 4096]
+    reader.close()
+
+def test_resync_after_torn_block(tmp_path):
+    path = tmp_path / 'a.sm2'
+    starts = write_blocks(path)
+    data = path.read_bytes()
+    # 4番目のブロックの書き込み途中で再起動し、その後に5番目以降を追記した状態
+    torn = data[:starts[3]] + data[starts[3]:starts[3] + 30] + data[starts[4]:]
+    (tmp_path / 'b.sm2').write_bytes(torn + data[starts[2]:starts[2] + 20])
+    reader = ArchiveReader(str(tmp_path / 'b.sm2'))
+    assert len(reader.index) == 9
+    assert reader.skipped == 30 + 20
+    assert len(reader.query()['time']) == 90
+    reader.close()
+
+def test_skip_corrupt_block(tmp_path):
+    path = tmp_path / 'a.sm2'
+    starts = write_blocks(path)
+    data = bytearray(path.read_bytes())
+    data[starts[1] + HEAD_LEN + 5] ^= 0xFF      # データ部の1バイトを破損
+    path.write_bytes(bytes(data))
+    reader = ArchiveReader(str(path))
+    assert len(reader.index) == 9
+    assert reader.skipped == starts[2] - starts[1]
+    assert len(reader.query()['time']) == 90
+    reader.close()
@@ -0,0 +1,66 @@
+# coding: utf-8
+
+################################################################################
+# デコーダの試験
+# 一括デコード(decode_batch)と1件毎のデコード(SensorMedal2Frame)の結果が
+# 全ての項目で一致することを、全範囲の乱数のペイロードで確認します。
+#
+#                                               Copyright (c) 2019 Wataru KUNINO
+################################################################################
+
+#【実行方法】
+#   python3 -m pytest -q tests
+
+import random
+
+import pytest
+
+from sensormedal2.frame import FRAME, SensorMedal2Frame, decode_batch
+
+np = pytest.importorskip('numpy')
+
+# decode_batch()の項目名とsensors()のキー
+FIELDS = {
+    'temperature': 'Temperature', 'humidity': 'Humidity', 'seq': 'SEQ',
+    'accel_x': 'Accelerometer X', 'accel_y': 'Accelerometer Y',
+    'accel_z': 'Accelerometer Z', 'geo_x': 'Geomagnetic X',
+    'geo_y': 'Geomagnetic Y', 'geo_z': 'Geomagnetic Z', 'pressure': 'Pressure',
+    'illuminance': 'Illuminance', 'steps': 'Steps', 'battery': 'Battery Level',
+}
+
+def payloads(n, seed=1):
+    rnd = random.Random(seed)
+    r = rnd.randint
+    return [FRAME.pack(r(0, 65535), r(0, 65535), r(0, 65535), r(0, 255), r(0, 255),
+                       r(-32768, 32767), r(-32768, 32767), r(-32768, 32767),
+                       r(-32768, 32767), r(-32768, 32767), r(-32768, 32767),
+                       r(0, 65535), r(0, 255), r(0, 65535), r(0, 255),
+                       r(0, 65535), r(0, 255)) for i in range(n)]
+
+@pytest.mark.parametrize('hex_input', [False, True])
+def test_decode_batch_matches_frame(hex_input):
+    data = payloads(1000)
+    batch = decode_batch([p.hex() for p in data] if hex_input else data)
+    assert list(batch['index']) == list(range(len(data)))
+    for i, p in enumerate(data):
+        sensors = SensorMedal2Frame(p).sensors()
+        assert batch['id'][i] == int(sensors['ID'], 16)
+        for name, key in FIELDS.items():
+            assert batch[name][i] == pytest.approx(sensors[key], rel=1e-12, abs=1e-12), name
+
+def test_decode_batch_known_payload():
+    # README の実行結果の一例(31.21 ℃, 73.108 %)
+    val = '01007d6f28bb30042dff3500b2ef68ffdbffd2ff27071f00000300005a'
+    batch = decode_batch([val])
+    assert round(batch['temperature'][0], 2) == 31.21
+    assert round(batch['humidity'][0], 3) == 73.108
+
+def test_decode_batch_skips_short_frames():
+    data = payloads(5)
+    batch = decode_batch([data[0], data[1][:10], data[2], b'', data[4].hex()])
+    assert len(batch['id']) == 3
+    assert list(batch['index']) == [0, 2, 4]
+    for row, i in enumerate(batch['index']):   # 各行は入力のindex番目のフレーム
+        sensors = SensorMedal2Frame(data[i]).sensors()
+        assert batch['id'][row] == int(sensors['ID'], 16)
+        assert batch['temperature'][row] == pytest.approx(sensors['Temperature'])